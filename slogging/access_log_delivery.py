@@ -25,12 +25,16 @@ import cStringIO
 import functools
 import random
 import errno
+import itertools
 
 from swift.common.daemon import Daemon
 from swift.common.utils import get_logger, TRUE_VALUES, split_path, lock_file
 from swift.common.exceptions import LockTimeout, ChunkReadTimeout
-from slogging.log_common import LogProcessorCommon, multiprocess_collate, \
-                                   BadFileDownload
+from slogging.log_common import LogProcessorCommon, get_collate_func, \
+                                   BadFileDownload, schedule_largest_first, \
+                                   WorkerPool, WorkItem, log_worker_stats, \
+                                   max_worker_load
+from slogging.processed_files import ProcessedFilesJournal
 
 
 month_map = '_ Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split()
@@ -67,6 +71,7 @@ def memoize(func):
                 del cache[key_to_delete]
         cache[key] = result
         return result
+    wrapped.clear = cache.clear
     return wrapped
 
 
@@ -122,8 +127,16 @@ class AccessLogDelivery(LogProcessorCommon):
         self.file_buffer = FileBuffer(buffer_limit, logger)
         self.hidden_ips = [x.strip() for x in
                             conf.get('hidden_ips', '').split(',') if x.strip()]
+        # the run of the daemon the flags in the memo were looked up for
+        self.generation = None
 
-    def process_one_file(self, account, container, object_name):
+    def process_one_file(self, account, container, object_name, etag=None,
+                         generation=None):
+        if generation is not None and generation != self.generation:
+            # a new run, look the flags up again (they are kept in
+            # memcache for a run)
+            AccessLogDelivery.get_container_save_log_flag.clear()
+            self.generation = generation
         files_to_upload = set()
         try:
             year, month, day, hour, _unused = object_name.split('/', 4)
@@ -136,7 +149,7 @@ class AccessLogDelivery(LogProcessorCommon):
         # get an iter of the object data
         compressed = object_name.endswith('.gz')
         stream = self.get_object_data(account, container, object_name,
-                                      compressed=compressed)
+                                      compressed=compressed, etag=etag)
         buff = collections.defaultdict(list)
         for line in stream:
             clf, account, container = self.convert_log_line(line)
@@ -270,6 +283,29 @@ class AccessLogDeliveryDaemon(Daemon):
         self.processed_files_object_name = c.get('processed_files_object_name',
                                                  'processed_files.pickle.gz')
         self.worker_count = int(c.get('worker_count', '1'))
+        self.listing_concurrency = int(c.get('listing_concurrency', '0'))
+        self.listing_checkpoint = \
+            c.get('listing_checkpoint', 'false').lower() in TRUE_VALUES
+        self.listing_resync_hours = int(c.get('listing_resync_hours', '24'))
+        self.listing_checkpoint_object_name = c.get(
+            'listing_checkpoint_object_name', 'listing_checkpoint.pickle.gz')
+        self.persistent_workers = \
+            c.get('persistent_workers', 'false').lower() in TRUE_VALUES
+        self.max_files_per_worker = int(c.get('max_files_per_worker', '0'))
+        self.item_timeout = int(c.get('item_timeout', '0'))
+        self.item_retries = int(c.get('item_retries', '1'))
+        self.executor = c.get('executor', 'process')
+        self.collate_func = get_collate_func(self.executor)
+        self.processed_files_journal = c.get('processed_files_journal',
+                                             'false').lower() in TRUE_VALUES
+        self.processed_files_journal_prefix = c.get(
+            'processed_files_journal_prefix', 'processed_files_journal/')
+        self.journal_compact_deltas = int(c.get('journal_compact_deltas',
+                                                '24'))
+        self.journal = None
+        self.worker_pool = None
+        # sent with the work items, so the workers know when a run starts
+        self.run_count = 0
         self.working_dir = c.get('working_dir', '/tmp/swift')
         if self.working_dir.endswith('/'):
             self.working_dir = self.working_dir.rstrip('/')
@@ -277,6 +313,7 @@ class AccessLogDeliveryDaemon(Daemon):
     def run_once(self, *a, **kw):
         self.logger.info(_("Beginning log processing"))
         start = time.time()
+        self.run_count += 1
         if self.lookback_hours == 0:
             lookback_start = None
             lookback_end = None
@@ -294,53 +331,104 @@ class AccessLogDeliveryDaemon(Daemon):
                 lookback_end = lookback_end.strftime('%Y%m%d%H')
         self.logger.debug('lookback_start: %s' % lookback_start)
         self.logger.debug('lookback_end: %s' % lookback_end)
-        try:
-            # Note: this file (or data set) will grow without bound.
-            # In practice, if it becomes a problem (say, after many months of
-            # running), one could manually prune the file to remove older
-            # entries. Automatically pruning on each run could be dangerous.
-            # There is not a good way to determine when an old entry should be
-            # pruned (lookback_hours could be set to anything and could change)
-            processed_files_stream = self.log_processor.get_object_data(
+        already_processed_files = self.get_processed_files()
+        if already_processed_files is None:
+            self.logger.error(_('Access log delivery unable to load list '
+                'of already processed log files'))
+            return
+        self.logger.debug(_('found %d processed files') % \
+                          len(already_processed_files))
+        checkpoint = None
+        if self.listing_checkpoint:
+            checkpoint = self.log_processor.get_listing_checkpoint(
                                         self.log_delivery_account,
                                         self.log_delivery_container,
-                                        self.processed_files_object_name,
-                                        compressed=True)
-            buf = '\n'.join(x for x in processed_files_stream)
-            if buf:
-                already_processed_files = cPickle.loads(buf)
+                                        self.listing_checkpoint_object_name,
+                                        self.listing_resync_hours * 3600)
+            if checkpoint.full_listing:
+                self.logger.info(_('Listing the whole lookback interval'))
+        # passed with the work items, to save the object cache a HEAD
+        etags = {}
+        if self.listing_concurrency:
+            # start processing while the listing is still in progress
+            logs_to_process = self.log_processor.iter_container_listing(
+                                        self.source_account,
+                                        self.source_container,
+                                        lookback_start,
+                                        lookback_end,
+                                        already_processed_files,
+                                        concurrency=self.listing_concurrency,
+                                        checkpoint=checkpoint, etags=etags)
+            first_log = next(logs_to_process, None)
+            if first_log is not None:
+                logs_to_process = itertools.chain([first_log],
+                                                  logs_to_process)
             else:
-                already_processed_files = set()
-        except BadFileDownload, err:
-            if err.status_code == 404:
-                already_processed_files = set()
-            else:
-                self.logger.error(_('Access log delivery unable to load list '
-                    'of already processed log files'))
-                return
-        self.logger.debug(_('found %d processed files') % \
-                          len(already_processed_files))
-        logs_to_process = self.log_processor.get_container_listing(
-                                                self.source_account,
-                                                self.source_container,
-                                                lookback_start,
-                                                lookback_end,
-                                                already_processed_files)
-        self.logger.info(_('loaded %d files to process') %
-                         len(logs_to_process))
+                logs_to_process = []
+            makespan = None
+        else:
+            listing = self.log_processor.get_container_listing(
+                                                    self.source_account,
+                                                    self.source_container,
+                                                    lookback_start,
+                                                    lookback_end,
+                                                    already_processed_files,
+                                                    with_sizes=True,
+                                                    checkpoint=checkpoint,
+                                                    etags=etags)
+            self.logger.info(_('loaded %d files to process') %
+                             len(listing))
+            logs_to_process, makespan = schedule_largest_first(
+                                                    [x[0] for x in listing],
+                                                    dict(listing),
+                                                    self.worker_count)
+            if logs_to_process:
+                total_bytes = sum(x[1] for x in listing)
+                self.logger.info(_('Predicted makespan %(makespan)d bytes '
+                                   'per worker (ideal %(ideal)d)') %
+                                 {'makespan': makespan,
+                                  'ideal': total_bytes /
+                                           max(self.worker_count, 1)})
         if not logs_to_process:
+            self.store_listing_checkpoint(checkpoint,
+                                          already_processed_files)
             self.logger.info(_("Log processing done (%0.2f minutes)") %
                         ((time.time() - start) / 60))
             return
 
-        logs_to_process = [(self.source_account, self.source_container, x)
-                            for x in logs_to_process]
+        logs_to_process = (WorkItem((self.source_account,
+                                     self.source_container, x),
+                                    {'etag': etags.pop(x, None),
+                                     'generation': self.run_count})
+                           for x in logs_to_process)
 
         # map
         processor_args = (self.conf, self.logger)
-        results = multiprocess_collate(AccessLogDelivery, processor_args,
-                                       'process_one_file', logs_to_process,
-                                       self.worker_count)
+        failed_items = []
+        worker_stats = {}
+        if self.persistent_workers and self.executor == 'process':
+            if self.worker_pool is None:
+                self.worker_pool = WorkerPool(AccessLogDelivery,
+                                        processor_args,
+                                        'process_one_file',
+                                        self.worker_count,
+                                        max_items=self.max_files_per_worker,
+                                        logger=self.logger,
+                                        item_timeout=self.item_timeout,
+                                        item_retries=self.item_retries,
+                                        send_stats=True)
+            results = self.worker_pool.collate(logs_to_process, failed_items,
+                                               worker_stats)
+        else:
+            results = self.collate_func(AccessLogDelivery, processor_args,
+                                        'process_one_file',
+                                        logs_to_process,
+                                        self.worker_count,
+                                        logger=self.logger,
+                                        failed_items=failed_items,
+                                        item_timeout=self.item_timeout,
+                                        item_retries=self.item_retries,
+                                        worker_stats=worker_stats)
 
         #reduce
         processed_files = already_processed_files
@@ -350,6 +438,18 @@ class AccessLogDeliveryDaemon(Daemon):
             processed_files.add(o)
             if data:
                 files_to_upload.update(data)
+        if failed_items:
+            # left out of processed_files, so they are tried again next time
+            self.logger.error(_('%d files could not be processed') %
+                              len(failed_items))
+        log_worker_stats(self.logger, worker_stats)
+        if makespan:
+            max_bytes, max_busy = max_worker_load(worker_stats)
+            self.logger.info(_('Busiest worker %(max_bytes)d bytes in '
+                               '%(max_busy).2fs (predicted makespan '
+                               '%(makespan)d bytes)') %
+                             {'max_bytes': max_bytes, 'max_busy': max_busy,
+                              'makespan': makespan})
         len_working_dir = len(self.working_dir) + 1  # +1 for the trailing '/'
         for filename in files_to_upload:
             target_name = filename[len_working_dir:]
@@ -369,22 +469,86 @@ class AccessLogDeliveryDaemon(Daemon):
                                     filename, account))
 
         # cleanup
+        if not self.store_processed_files(processed_files):
+            self.logger.error('Error uploading updated processed files log')
+        self.store_listing_checkpoint(checkpoint, processed_files)
+        self.logger.info(_("Log processing done (%0.2f minutes)") %
+                    ((time.time() - start) / 60))
+
+    def get_processed_files(self):
+        """
+        :returns: the names of the files already processed, or None on
+                  error. With processed_files_journal, this is a
+                  ProcessedFilesJournal that is loaded once and kept for the
+                  next runs.
+        """
+        if self.processed_files_journal:
+            if self.journal is None:
+                journal = ProcessedFilesJournal(self.log_processor,
+                                    self.log_delivery_account,
+                                    self.log_delivery_container,
+                                    self.processed_files_journal_prefix,
+                                    self.processed_files_object_name,
+                                    self.journal_compact_deltas)
+                if not journal.load():
+                    return None
+                self.journal = journal
+            return self.journal
+        try:
+            # Note: this file (or data set) will grow without bound.
+            # In practice, if it becomes a problem (say, after many months of
+            # running), one could manually prune the file to remove older
+            # entries. Automatically pruning on each run could be dangerous.
+            # There is not a good way to determine when an old entry should be
+            # pruned (lookback_hours could be set to anything and could change)
+            processed_files_stream = self.log_processor.get_object_data(
+                                        self.log_delivery_account,
+                                        self.log_delivery_container,
+                                        self.processed_files_object_name,
+                                        compressed=True)
+            buf = '\n'.join(x for x in processed_files_stream)
+            if buf:
+                return cPickle.loads(buf)
+            return set()
+        except BadFileDownload, err:
+            if err.status_code == 404:
+                return set()
+            return None
+
+    def store_processed_files(self, processed_files):
+        """
+        Stores the names of the files processed.
+
+        :returns: True if successful, False otherwise
+        """
+        if isinstance(processed_files, ProcessedFilesJournal):
+            return processed_files.store()
         s = cPickle.dumps(processed_files, cPickle.HIGHEST_PROTOCOL)
         f = cStringIO.StringIO(s)
-        success = self.log_processor.internal_proxy.upload_file(f,
+        return self.log_processor.internal_proxy.upload_file(f,
                                         self.log_delivery_account,
                                         self.log_delivery_container,
                                         self.processed_files_object_name)
-        if not success:
-            self.logger.error('Error uploading updated processed files log')
-        self.logger.info(_("Log processing done (%0.2f minutes)") %
-                    ((time.time() - start) / 60))
+
+    def store_listing_checkpoint(self, checkpoint, processed_files):
+        if checkpoint is None:
+            return
+        checkpoint.advance(lambda a, c, o, size: o in processed_files)
+        if not self.log_processor.store_listing_checkpoint(checkpoint,
+                                        self.log_delivery_account,
+                                        self.log_delivery_container,
+                                        self.listing_checkpoint_object_name):
+            self.logger.error('Error uploading updated listing checkpoint')
 
     def run_forever(self, *a, **kw):
-        while True:
-            start_time = time.time()
-            self.run_once()
-            end_time = time.time()
-            # don't run more than once every self.frequency seconds
-            sleep_time = self.frequency - (end_time - start_time)
-            time.sleep(max(0, sleep_time))
+        try:
+            while True:
+                start_time = time.time()
+                self.run_once()
+                end_time = time.time()
+                # don't run more than once every self.frequency seconds
+                sleep_time = self.frequency - (end_time - start_time)
+                time.sleep(max(0, sleep_time))
+        finally:
+            if self.worker_pool is not None:
+                self.worker_pool.close()
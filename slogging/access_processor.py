@@ -135,67 +135,80 @@ class AccessLogProcessor(object):
     def process(self, obj_stream, data_object_account, data_object_container,
                 data_object_name):
         '''generate hourly groupings of data from one access log file'''
+        return self.process_batch([obj_stream], data_object_account,
+                                  data_object_container, data_object_name)
+
+    def process_batch(self, obj_batches, data_object_account,
+                      data_object_container, data_object_name):
+        '''
+        generate hourly groupings of data from one access log file delivered
+        as an iterable of lists of lines
+        '''
         hourly_aggr_info = {}
         total_lines = 0
         bad_lines = 0
-        for line in obj_stream:
-            line_data = self.log_line_parser(line)
-            total_lines += 1
-            if not line_data:
-                bad_lines += 1
-                continue
-            account = line_data['account']
-            container_name = line_data['container_name']
-            year = line_data['year']
-            month = line_data['month']
-            day = line_data['day']
-            hour = line_data['hour']
-            bytes_out = line_data['bytes_out']
-            bytes_in = line_data['bytes_in']
-            method = line_data['method']
-            code = int(line_data['code'])
-            object_name = line_data['object_name']
-            client_ip = line_data['client_ip']
-
-            op_level = None
-            if not container_name:
-                op_level = 'account'
-            elif container_name and not object_name:
-                op_level = 'container'
-            elif object_name:
-                op_level = 'object'
-
-            aggr_key = (account, year, month, day, hour)
-            d = hourly_aggr_info.get(aggr_key, {})
-            if line_data['lb_ip'] in self.lb_private_ips:
-                source = 'service'
-            else:
-                source = 'public'
-
-            if line_data['client_ip'] in self.service_ips:
-                source = 'service'
-
-            d[(source, 'bytes_out')] = d.setdefault((
-                source, 'bytes_out'), 0) + bytes_out
-            d[(source, 'bytes_in')] = d.setdefault((source, 'bytes_in'), 0) + \
-                                      bytes_in
-
-            d['format_query'] = d.setdefault('format_query', 0) + \
-                                line_data.get('format', 0)
-            d['marker_query'] = d.setdefault('marker_query', 0) + \
-                                line_data.get('marker', 0)
-            d['prefix_query'] = d.setdefault('prefix_query', 0) + \
-                                line_data.get('prefix', 0)
-            d['delimiter_query'] = d.setdefault('delimiter_query', 0) + \
-                                   line_data.get('delimiter', 0)
-            path = line_data.get('path', 0)
-            d['path_query'] = d.setdefault('path_query', 0) + path
-
-            code = '%dxx' % (code / 100)
-            key = (source, op_level, method, code)
-            d[key] = d.setdefault(key, 0) + 1
-
-            hourly_aggr_info[aggr_key] = d
+        log_line_parser = self.log_line_parser
+        lb_private_ips = self.lb_private_ips
+        service_ips = self.service_ips
+        for batch in obj_batches:
+            for line in batch:
+                line_data = log_line_parser(line)
+                total_lines += 1
+                if not line_data:
+                    bad_lines += 1
+                    continue
+                account = line_data['account']
+                container_name = line_data['container_name']
+                year = line_data['year']
+                month = line_data['month']
+                day = line_data['day']
+                hour = line_data['hour']
+                bytes_out = line_data['bytes_out']
+                bytes_in = line_data['bytes_in']
+                method = line_data['method']
+                code = int(line_data['code'])
+                object_name = line_data['object_name']
+                client_ip = line_data['client_ip']
+
+                op_level = None
+                if not container_name:
+                    op_level = 'account'
+                elif container_name and not object_name:
+                    op_level = 'container'
+                elif object_name:
+                    op_level = 'object'
+
+                aggr_key = (account, year, month, day, hour)
+                d = hourly_aggr_info.get(aggr_key, {})
+                if line_data['lb_ip'] in lb_private_ips:
+                    source = 'service'
+                else:
+                    source = 'public'
+
+                if line_data['client_ip'] in service_ips:
+                    source = 'service'
+
+                d[(source, 'bytes_out')] = d.setdefault((
+                    source, 'bytes_out'), 0) + bytes_out
+                d[(source, 'bytes_in')] = d.setdefault((
+                    source, 'bytes_in'), 0) + bytes_in
+
+                d['format_query'] = d.setdefault('format_query', 0) + \
+                                    line_data.get('format', 0)
+                d['marker_query'] = d.setdefault('marker_query', 0) + \
+                                    line_data.get('marker', 0)
+                d['prefix_query'] = d.setdefault('prefix_query', 0) + \
+                                    line_data.get('prefix', 0)
+                d['delimiter_query'] = d.setdefault('delimiter_query', 0) + \
+                                       line_data.get('delimiter', 0)
+                path = line_data.get('path', 0)
+                d['path_query'] = d.setdefault('path_query', 0) + path
+
+                code = '%dxx' % (code / 100)
+                key = (source, op_level, method, code)
+                d[key] = d.setdefault(key, 0) + 1
+
+                hourly_aggr_info[aggr_key] = d
         if bad_lines > (total_lines * self.warn_percent):
             name = '/'.join([data_object_account, data_object_container,
                              data_object_name])
@@ -0,0 +1,511 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import cPickle
+import tempfile
+from array import array
+from itertools import izip, groupby
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def merge_aggregates(aggr_data, data):
+    """
+    Merges the hourly stats of one or more log files into aggr_data.
+
+    Both are dicts with (account, year, month, day, hour) keys and dict
+    values mapping a stats key to a value. Values for the same hour and key
+    are summed; processing plugins need to realize this. data can also be a
+    PackedAggregate.
+
+    aggr_data can also be a DenseAggregate or a SpillingAggregate, which
+    data is merged into.
+
+    :returns: aggr_data
+    """
+    if isinstance(aggr_data, (DenseAggregate, SpillingAggregate)):
+        return aggr_data.merge(data)
+    if isinstance(data, (PackedAggregate, DenseAggregate)):
+        return data.merge_into(aggr_data)
+    for k, d in data.iteritems():
+        existing_data = aggr_data.get(k)
+        if existing_data is None:
+            aggr_data[k] = dict(d)
+            continue
+        for i, j in d.iteritems():
+            existing_data[i] = existing_data.get(i, 0) + j
+    return aggr_data
+
+
+class PackedAggregate(object):
+    """
+    A compact encoding of the hourly stats of one or more log files, for
+    sending them between processes.
+
+    The hour keys and stats keys are each stored once, in tables. For each
+    hour, the number of stats it has is stored in hour_sizes, and its stats
+    as stats key indexes (in stat_indexes) and values (in values, an array
+    of C ints, or longs if needed). The arrays pickle as plain strings.
+    Hours with values that do not fit in a C long (long ints, floats, ...)
+    are kept as a dict in overflow instead.
+
+    merge_aggregates merges a PackedAggregate without unpacking it to dicts.
+    """
+
+    def __init__(self):
+        self.hour_keys = []
+        self.stat_keys = []
+        self.hour_sizes = array('L')
+        self.stat_indexes = array('H')
+        self.values = array('l')
+        self.overflow = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict of hourly stats, as returned by the plugins
+        :returns: a PackedAggregate of data
+        """
+        packed = cls()
+        stat_keys = packed.stat_keys
+        stat_index = {}
+        indexes = []
+        for hour, stats in data.iteritems():
+            try:
+                values = array('l', stats.itervalues())
+            except (TypeError, OverflowError):
+                packed.overflow[hour] = stats
+                continue
+            for key in stats:
+                i = stat_index.get(key)
+                if i is None:
+                    i = stat_index[key] = len(stat_keys)
+                    stat_keys.append(key)
+                indexes.append(i)
+            packed.hour_keys.append(hour)
+            packed.hour_sizes.append(len(values))
+            packed.values.extend(values)
+        if len(stat_keys) > 0xffff:
+            packed.stat_indexes = array('L', indexes)
+        else:
+            packed.stat_indexes = array('H', indexes)
+        values = packed.values
+        if values and -0x80000000 <= min(values) and max(values) <= 0x7fffffff:
+            packed.values = array('i', values)
+        return packed
+
+    def to_dict(self):
+        return self.merge_into({})
+
+    def merge_into(self, aggr_data):
+        """
+        Merges the packed stats into a dict of hourly stats.
+
+        :returns: aggr_data
+        """
+        stat_keys = self.stat_keys
+        stat_indexes = self.stat_indexes
+        values = self.values
+        pos = 0
+        for hour, size in izip(self.hour_keys, self.hour_sizes):
+            d = aggr_data.get(hour)
+            if d is None:
+                d = aggr_data[hour] = {}
+            end = pos + size
+            for i, value in izip(stat_indexes[pos:end], values[pos:end]):
+                key = stat_keys[i]
+                d[key] = d.get(key, 0) + value
+            pos = end
+        for hour, stats in self.overflow.iteritems():
+            d = aggr_data.get(hour)
+            if d is None:
+                d = aggr_data[hour] = {}
+            for key, value in stats.iteritems():
+                d[key] = d.get(key, 0) + value
+        return aggr_data
+
+    def __getstate__(self):
+        return (self.hour_keys, self.stat_keys, self.hour_sizes.tostring(),
+                self.stat_indexes.typecode, self.stat_indexes.tostring(),
+                self.values.typecode, self.values.tostring(), self.overflow)
+
+    def __setstate__(self, state):
+        (self.hour_keys, self.stat_keys, hour_sizes, index_typecode,
+         stat_indexes, value_typecode, values, self.overflow) = state
+        self.hour_sizes = array('L')
+        self.hour_sizes.fromstring(hour_sizes)
+        self.stat_indexes = array(index_typecode)
+        self.stat_indexes.fromstring(stat_indexes)
+        self.values = array(value_typecode)
+        self.values.fromstring(values)
+
+    def __eq__(self, other):
+        return isinstance(other, PackedAggregate) and \
+            self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class DenseAggregate(object):
+    """
+    Hourly stats kept as rows of counters, for reducing the results of many
+    log files in the parent without a dict per hour.
+
+    Each stats key is given a column the first time it is seen (stat_keys
+    and columns map between the two), and each hour a row, an array of C
+    longs with a counter per column. Merging a PackedAggregate only looks
+    its stats keys up once per message. Values that do not fit in a C long
+    are kept in a dict per hour in overflow, and the columns of keys that
+    were merged but sum to 0 are recorded in zeros, so that to_dict returns
+    the same dict merging into a dict would.
+
+    merge_aggregates merges into and from a DenseAggregate.
+    """
+
+    def __init__(self):
+        self.stat_keys = []
+        self.columns = {}
+        self.rows = {}
+        self.overflow = {}
+        self.zeros = {}
+
+    def _column(self, key):
+        i = self.columns.get(key)
+        if i is None:
+            i = self.columns[key] = len(self.stat_keys)
+            self.stat_keys.append(key)
+        return i
+
+    def _row(self, hour):
+        row = self.rows.get(hour)
+        if row is None:
+            row = self.rows[hour] = array('l')
+        if len(row) < len(self.stat_keys):
+            row.extend(array('l', [0]) * (len(self.stat_keys) - len(row)))
+        return row
+
+    def _add_overflow(self, hour, key, value):
+        d = self.overflow.setdefault(hour, {})
+        d[key] = d.get(key, 0) + value
+
+    def _add_zero(self, hour, i):
+        self.zeros.setdefault(hour, set()).add(i)
+
+    def merge(self, data):
+        """
+        Merges a dict of hourly stats, a PackedAggregate or a DenseAggregate
+        into the rows.
+
+        :returns: self
+        """
+        if isinstance(data, DenseAggregate):
+            data = data.to_dict()
+        if isinstance(data, PackedAggregate):
+            columns = [self._column(key) for key in data.stat_keys]
+            width = len(self.stat_keys)
+            stat_keys = data.stat_keys
+            stat_indexes = data.stat_indexes
+            values = data.values
+            pos = 0
+            for hour, size in izip(data.hour_keys, data.hour_sizes):
+                row = self.rows.get(hour)
+                if row is None or len(row) < width:
+                    row = self._row(hour)
+                end = pos + size
+                for i, value in izip(stat_indexes[pos:end],
+                                     values[pos:end]):
+                    column = columns[i]
+                    try:
+                        total = row[column] + value
+                        row[column] = total
+                    except OverflowError:
+                        self._add_overflow(hour, stat_keys[i], value)
+                        continue
+                    if not total:
+                        self._add_zero(hour, column)
+                pos = end
+            data = data.overflow
+        columns = self.columns
+        for hour, stats in data.iteritems():
+            row = self.rows.get(hour)
+            if row is None or len(row) < len(self.stat_keys):
+                row = self._row(hour)
+            for key, value in stats.iteritems():
+                i = columns.get(key)
+                if i is None:
+                    i = self._column(key)
+                    row = self._row(hour)
+                try:
+                    total = row[i] + value
+                    row[i] = total
+                except (TypeError, OverflowError):
+                    self._add_overflow(hour, key, value)
+                    continue
+                if not total:
+                    self._add_zero(hour, i)
+        return self
+
+    def row_dict(self, hour):
+        """
+        :returns: the stats of hour as a dict of stats key to value
+        """
+        row = self.rows[hour]
+        zeros = self.zeros.get(hour, ())
+        stat_keys = self.stat_keys
+        d = dict((stat_keys[i], value) for i, value in enumerate(row)
+                 if value or i in zeros)
+        for key, value in self.overflow.get(hour, {}).iteritems():
+            d[key] = d.get(key, 0) + value
+        return d
+
+    def items(self):
+        return [(hour, self.row_dict(hour)) for hour in self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def merge_into(self, aggr_data):
+        """
+        Merges the rows into a dict of hourly stats.
+
+        :returns: aggr_data
+        """
+        for hour in self.rows:
+            d = aggr_data.get(hour)
+            if d is None:
+                aggr_data[hour] = self.row_dict(hour)
+                continue
+            for key, value in self.row_dict(hour).iteritems():
+                d[key] = d.get(key, 0) + value
+        return aggr_data
+
+    def __getstate__(self):
+        hours = self.rows.keys()
+        return (self.stat_keys, hours,
+                [self.rows[hour].tostring() for hour in hours],
+                self.overflow, self.zeros)
+
+    def __setstate__(self, state):
+        self.stat_keys, hours, rows, self.overflow, self.zeros = state
+        self.columns = dict((key, i) for i, key in enumerate(self.stat_keys))
+        self.rows = {}
+        for hour, data in izip(hours, rows):
+            row = self.rows[hour] = array('l')
+            row.fromstring(data)
+
+
+def _read_run(f):
+    f.seek(0)
+    while True:
+        try:
+            yield cPickle.load(f)
+        except EOFError:
+            return
+
+
+class SpillingAggregate(object):
+    """
+    Hourly stats reduced within a budget of rows: once the aggregate being
+    merged into has more than max_rows hours, its rows are written to a
+    temporary file sorted by hour (a run) and a new aggregate is started.
+    iteritems merges the runs and the rows still in memory back into one
+    row per hour, in hour order.
+
+    :param max_rows: number of hours to keep in memory
+    :param new_aggregate: function returning an empty aggregate to merge
+                          into, a dict or a DenseAggregate
+    :param spill_dir: directory of the run files, the system's temporary
+                      directory if None
+    """
+
+    def __init__(self, max_rows, new_aggregate=dict, spill_dir=None):
+        self.max_rows = max_rows
+        self.new_aggregate = new_aggregate
+        self.spill_dir = spill_dir
+        self.current = new_aggregate()
+        self.runs = []
+
+    def merge(self, data):
+        """
+        Merges data like merge_aggregates, spilling the rows in memory if
+        there are too many.
+
+        :returns: self
+        """
+        merge_aggregates(self.current, data)
+        if len(self.current) > self.max_rows:
+            self.spill()
+        return self
+
+    def spill(self):
+        """
+        Writes the rows in memory to a new run.
+        """
+        rows = self.current.items()
+        self.current = self.new_aggregate()
+        rows.sort(key=lambda x: x[0])
+        f = tempfile.TemporaryFile(dir=self.spill_dir)
+        pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+        for row in rows:
+            pickler.dump(row)
+            # rows are written once, there is nothing to memoize
+            pickler.clear_memo()
+        f.flush()
+        self.runs.append(f)
+
+    def finish(self):
+        """
+        :returns: the aggregate in memory if nothing was spilled, or self
+        """
+        if not self.runs:
+            return self.current
+        return self
+
+    def iteritems(self):
+        """
+        :returns: an iterator of (hour, dict of stats) sorted by hour, with
+                  the stats of the runs summed
+        """
+        rows = self.current.items()
+        rows.sort(key=lambda x: x[0])
+        # the run number keeps heapq.merge from comparing stats dicts
+        runs = [((hour, n, stats) for hour, stats in run)
+                for n, run in enumerate([rows] +
+                                        [_read_run(f) for f in self.runs])]
+        for hour, group in groupby(heapq.merge(*runs), lambda x: x[0]):
+            stats = {}
+            for _junk, _junk, d in group:
+                for key, value in d.iteritems():
+                    stats[key] = stats.get(key, 0) + value
+            yield hour, stats
+
+    def __nonzero__(self):
+        return bool(self.runs) or bool(self.current)
+
+    def close(self):
+        for f in self.runs:
+            f.close()
+        self.runs = []
+
+
+class KeylistIndex(object):
+    """
+    A keylist mapping compiled into an inverted index, from each stats key
+    to the output fields it is summed into, so that applying it to an hour
+    only looks up the stats keys the hour has.
+
+    fields are the output field names, sorted. A mapping is either a list
+    or set of stats keys or a single stats key.
+
+    :param keylist_mapping: dict of output field name to its mapping
+    """
+
+    def __init__(self, keylist_mapping):
+        self.fields = sorted(keylist_mapping)
+        self.index = {}
+        for i, field in enumerate(self.fields):
+            mapping = keylist_mapping[field]
+            if not isinstance(mapping, (list, set)):
+                mapping = [mapping]
+            for key in mapping:
+                self.index.setdefault(key, []).append(i)
+
+    def _sum_stats(self, values, stats):
+        index = self.index
+        for key, value in stats.iteritems():
+            for i in index.get(key, ()):
+                values[i] += value
+
+    def apply(self, aggr_data):
+        """
+        :param aggr_data: dict of hourly stats, or a DenseAggregate
+        :returns: a dict of hour to a dict of output field to the sum of the
+                  values of its stats keys
+        """
+        fields = self.fields
+        final_info = {}
+        if isinstance(aggr_data, DenseAggregate):
+            column_fields = [self.index.get(key, ())
+                             for key in aggr_data.stat_keys]
+            for hour, row in aggr_data.rows.iteritems():
+                values = [0] * len(fields)
+                for indexes, value in izip(column_fields, row):
+                    if value:
+                        for i in indexes:
+                            values[i] += value
+                overflow = aggr_data.overflow.get(hour)
+                if overflow:
+                    self._sum_stats(values, overflow)
+                final_info[hour] = dict(izip(fields, values))
+            return final_info
+        for hour, stats in aggr_data.iteritems():
+            final_info[hour] = self.apply_stats(stats)
+        return final_info
+
+    def apply_stats(self, stats):
+        """
+        :param stats: dict of the stats of one hour
+        :returns: a dict of output field to the sum of the values of its
+                  stats keys
+        """
+        values = [0] * len(self.fields)
+        self._sum_stats(values, stats)
+        return dict(izip(self.fields, values))
+
+    def apply_numpy(self, aggr_data):
+        """
+        Applies the index with NumPy: the stats are loaded into an (hour,
+        stats key) matrix of 64 bit integers, which is multiplied by a
+        (stats key, output field) matrix of the number of times each stats
+        key is summed into each field.
+
+        :param aggr_data: dict of hourly stats, or a DenseAggregate
+        :returns: the hours, sorted, and a matrix of the values of their
+                  output fields in fields order, or None if NumPy is not
+                  installed, the stats are not all integers that fit or
+                  aggr_data is a SpillingAggregate.
+        """
+        if numpy is None or isinstance(aggr_data, SpillingAggregate):
+            return None
+        if not isinstance(aggr_data, DenseAggregate):
+            aggr_data = DenseAggregate().merge(aggr_data)
+        if aggr_data.overflow:
+            return None
+        hours = sorted(aggr_data.rows)
+        width = len(aggr_data.stat_keys)
+        zero = array('l', [0])
+        buf = ''.join((row + zero * (width - len(row))).tostring()
+                      for row in (aggr_data.rows[x] for x in hours))
+        matrix = numpy.frombuffer(buf, dtype=numpy.int_).astype(
+                     numpy.int64).reshape(len(hours), width)
+        projection = numpy.zeros((width, len(self.fields)),
+                                 dtype=numpy.int64)
+        for j, key in enumerate(aggr_data.stat_keys):
+            for i in self.index.get(key, ()):
+                projection[j, i] += 1
+        if hours and width and \
+                numpy.abs(matrix.astype(float)).sum(axis=1).max() * \
+                projection.max() >= 2 ** 62:
+            # the sums might not fit
+            return None
+        return hours, matrix.dot(projection)
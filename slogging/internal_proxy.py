@@ -128,21 +128,54 @@ class InternalProxy(object):
             return False
         return True
 
-    def get_object(self, account, container, object_name):
+    def get_object(self, account, container, object_name, headers=None):
         """
         Get object.
 
         :param account: account name object is in
         :param container: container name object is in
         :param object_name: name of object to get
+        :param headers: optional dict of extra request headers (e.g. Range)
         :returns: iterator for object data
         """
         req = webob.Request.blank('/v1/%s/%s/%s' %
                             (account, container, object_name),
-                            environ={'REQUEST_METHOD': 'GET'})
+                            environ={'REQUEST_METHOD': 'GET'},
+                            headers=headers)
         resp = self._handle_request(req)
         return resp.status_int, resp.app_iter
 
+    def head_object(self, account, container, object_name):
+        """
+        Get object metadata.
+
+        :param account: account name object is in
+        :param container: container name object is in
+        :param object_name: name of object to head
+        :returns: status code and dict of response headers
+        """
+        req = webob.Request.blank('/v1/%s/%s/%s' %
+                            (account, container, object_name),
+                            environ={'REQUEST_METHOD': 'HEAD'})
+        resp = self._handle_request(req)
+        return resp.status_int, dict(resp.headers)
+
+    def delete_object(self, account, container, object_name):
+        """
+        Delete object.
+
+        :param account: account name object is in
+        :param container: container name object is in
+        :param object_name: name of object to delete
+        :returns: True if successful or the object did not exist, otherwise
+                  False
+        """
+        req = webob.Request.blank('/v1/%s/%s/%s' %
+                            (account, container, object_name),
+                            environ={'REQUEST_METHOD': 'DELETE'})
+        resp = self._handle_request(req)
+        return 200 <= resp.status_int < 300 or resp.status_int == 404
+
     def create_container(self, account, container):
         """
         Create container.
@@ -189,6 +222,50 @@ class InternalProxy(object):
                                                   delimiter,
                                                   full_listing=False)
             return rv
+        code, listing = self._get_container_page(account, container, marker,
+                                                 end_marker, limit, prefix,
+                                                 delimiter)
+        if code < 200 or code >= 300:
+            return []  # see list_container to tell errors apart
+        return listing
+
+    def list_container(self, account, container, prefix=None,
+                       delimiter=None):
+        """
+        Get a full listing of objects for the container, like
+        get_container_list, telling a listing that failed from an empty one.
+
+        :param account: account name for the container
+        :param container: container name to get a listing for
+        :param prefix: prefix query
+        :param delimiter: string to delimit the queries on
+        :returns: list of objects, [] if the container does not exist, or
+                  None if a page of the listing could not be fetched
+        """
+        rv = []
+        marker = None
+        while True:
+            code, listing = self._get_container_page(account, container,
+                                                     marker, None, None,
+                                                     prefix, delimiter)
+            if code == 404 and not rv:
+                return []
+            if code < 200 or code >= 300:
+                return None
+            if not listing:
+                return rv
+            rv.extend(listing)
+            if not delimiter:
+                marker = listing[-1]['name']
+            else:
+                marker = listing[-1].get('name', listing[-1].get('subdir'))
+
+    def _get_container_page(self, account, container, marker, end_marker,
+                            limit, prefix, delimiter):
+        """
+        :returns: status code and the objects of one page of the listing
+                  ([] on errors and for a 204)
+        """
         path = '/v1/%s/%s' % (account, quote(container))
         qs = 'format=json'
         if marker:
@@ -204,11 +281,10 @@ class InternalProxy(object):
         path += '?%s' % qs
         req = webob.Request.blank(path, environ={'REQUEST_METHOD': 'GET'})
         resp = self._handle_request(req)
-        if resp.status_int < 200 or resp.status_int >= 300:
-            return []  # TODO: distinguish between 404 and empty container
-        if resp.status_int == 204:
-            return []
-        return json_loads(resp.body)
+        if resp.status_int < 200 or resp.status_int >= 300 or \
+                resp.status_int == 204:
+            return resp.status_int, []
+        return resp.status_int, json_loads(resp.body)
 
     def get_container_metadata(self, account, container):
         path = '/v1/%s/%s/' % (account, container)
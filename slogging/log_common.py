@@ -18,25 +18,268 @@ import Queue
 import datetime
 import zlib
 import time
+import sys
+import threading
+import collections
+import itertools
+import heapq
+import cPickle
+import cStringIO
 from paste.deploy import appconfig
 from contextlib import contextmanager
 import os
 import errno
 import fcntl
 
-from eventlet import sleep
+import greenlet
+import eventlet.queue
+from eventlet import GreenPool, sleep
+from eventlet.green import threading as green_threading
 
 from swift.common.memcached import MemcacheRing
 from slogging.internal_proxy import InternalProxy
+from slogging.object_cache import ObjectCache
 from swift.common.utils import get_logger
 from swift.common.exceptions import ChunkReadTimeout, LockTimeout
 
 
+# items handed out per worker process by multiprocess_collate ahead of their
+# results
+COLLATE_QUEUE_DEPTH = 16
+# seconds multiprocess_collate waits for a result before checking that its
+# worker processes are still alive
+WORKER_CHECK_INTERVAL = 1
+# seconds a worker processing several items at once waits between checks for
+# more items
+WORKER_POLL_INTERVAL = 0.01
+
+
 class BadFileDownload(Exception):
     def __init__(self, status_code=None):
         self.status_code = status_code
 
 
+def _split_chunks(chunks):
+    '''
+    Yields, for each chunk of data, the list of lines completed by that chunk.
+
+    Each chunk is split once, in C, and its complete lines are handed out
+    as-is. The line that straddles two chunks is the only one that needs to be
+    glued together. When a line spans more than two chunks (long lines or small
+    decompressed chunks), the pieces are collected in a reusable bytearray so
+    that the cost stays linear instead of re-copying the partial line for
+    every chunk.
+
+    :param chunks: iterable of str chunks
+    '''
+    tail = ''
+    spill = bytearray()
+    spilling = False
+    for chunk in chunks:
+        lines = chunk.split('\n')
+        if len(lines) == 1:
+            # no newline in this chunk, keep accumulating the current line
+            if not spilling:
+                spill += tail
+                spilling = True
+            spill += chunk
+            continue
+        if spilling:
+            spill += lines[0]
+            lines[0] = str(spill)
+            del spill[:]
+            spilling = False
+        elif tail:
+            lines[0] = tail + lines[0]
+        tail = lines.pop()
+        yield lines
+    if spilling:
+        tail = str(spill)
+    if tail:
+        yield [tail]
+
+
+def iter_lines(chunks):
+    '''
+    Yields the lines found in an iterable of chunks of data.
+
+    :param chunks: iterable of str chunks
+    '''
+    for lines in _split_chunks(chunks):
+        for line in lines:
+            yield line
+
+
+def iter_line_batches(chunks, batch_size):
+    '''
+    Yields the lines found in an iterable of chunks of data as lists.
+
+    Lines are grouped a chunk at a time, so every list except the last one
+    holds at least batch_size lines.
+
+    :param chunks: iterable of str chunks
+    :param batch_size: minimum number of lines per list
+    '''
+    batch = []
+    for lines in _split_chunks(chunks):
+        if batch:
+            batch.extend(lines)
+        else:
+            batch = lines
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_line_range(chunks, offset, start, end):
+    '''
+    Trims chunks of data to the lines that begin in a byte range.
+
+    A line belongs to the range [start, end) if its first byte is in it. Lines
+    that begin before start are dropped and the line that begins before end
+    but finishes after it is kept whole, so adjacent ranges of the same object
+    yield every line exactly once. To tell whether a line begins at start, the
+    data must be read from start - 1 when start is not 0.
+
+    :param chunks: iterable of str chunks, the first one beginning at offset;
+                   it is closed once the range's last line has been read
+    :param offset: byte offset in the object of the first chunk
+    :param start: first byte of the range
+    :param end: byte after the last byte of the range
+    '''
+    pos = offset
+    skipping = start > 0
+    for chunk in chunks:
+        i = 0
+        if skipping:
+            # drop the line that is in progress at start
+            i = chunk.find('\n', max(start - 1 - pos, 0))
+            if i == -1:
+                pos += len(chunk)
+                continue
+            i += 1
+            skipping = False
+        # the last line is the one that covers byte end - 1, there is none
+        # if the line in progress at start already covers it
+        j = chunk.find('\n', max(end - 1 - pos, i - 1, 0))
+        if j != -1:
+            if j >= i:
+                yield chunk[i:j + 1]
+            if hasattr(chunks, 'close'):
+                # don't leave the rest of the object to be downloaded
+                chunks.close()
+            return
+        if i < len(chunk):
+            yield chunk[i:]
+        pos += len(chunk)
+
+
+def read_ahead(chunks, max_chunks, max_bytes=0, timings=None):
+    '''
+    Yields the items of chunks while a background thread keeps pulling the
+    next ones.
+
+    Pulling a chunk of object data means waiting on the network and, for
+    compressed objects, inflating it. Both release the GIL, so running them
+    in a thread overlaps them with whatever the consumer does with the
+    previous chunks. Errors raised by chunks (or by closing it) are
+    re-raised in the consumer once the chunks read before the error have
+    been yielded.
+
+    Called from a green thread (worker_concurrency, or the eventlet
+    executor), the reader is a green thread too: a thread waiting on a
+    lock would block every other green thread, and the object data would
+    be fetched outside of the hub that runs them.
+
+    :param chunks: iterable of str chunks
+    :param max_chunks: maximum number of chunks buffered ahead of the consumer
+    :param max_bytes: if non-zero, maximum number of bytes buffered ahead of
+                      the consumer (a single chunk is always allowed)
+    :param timings: optional dict; time the consumer spent waiting for data
+                    is added to 'read_ahead_wait' and time the reader spent
+                    waiting for buffer space is added to 'read_ahead_full'
+    '''
+    threads = threading
+    if greenlet.getcurrent().parent is not None:
+        threads = green_threading
+    cond = threads.Condition()
+    buf = collections.deque()
+    state = {'bytes': 0, 'done': False, 'closed': False, 'error': None,
+             'wait': 0.0, 'full': 0.0}
+
+    def reader():
+        try:
+            for chunk in chunks:
+                cond.acquire()
+                try:
+                    start = time.time()
+                    while not state['closed'] and buf and \
+                            (len(buf) >= max_chunks or (max_bytes and
+                             state['bytes'] + len(chunk) > max_bytes)):
+                        cond.wait()
+                    state['full'] += time.time() - start
+                    if state['closed']:
+                        break
+                    buf.append(chunk)
+                    state['bytes'] += len(chunk)
+                    cond.notify()
+                finally:
+                    cond.release()
+        except BaseException:
+            # timeouts and kills too, the consumer must not wait forever
+            state['error'] = sys.exc_info()
+        finally:
+            try:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+            except BaseException:
+                if state['error'] is None:
+                    state['error'] = sys.exc_info()
+            finally:
+                cond.acquire()
+                try:
+                    state['done'] = True
+                    cond.notify()
+                finally:
+                    cond.release()
+
+    thread = threads.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            cond.acquire()
+            try:
+                start = time.time()
+                while not buf and not state['done']:
+                    cond.wait()
+                state['wait'] += time.time() - start
+                if buf:
+                    chunk = buf.popleft()
+                    state['bytes'] -= len(chunk)
+                    cond.notify()
+                elif state['error']:
+                    exc_type, exc_value, exc_tb = state['error']
+                    raise exc_type, exc_value, exc_tb
+                else:
+                    break
+            finally:
+                cond.release()
+            yield chunk
+    finally:
+        cond.acquire()
+        try:
+            state['closed'] = True
+            cond.notify()
+        finally:
+            cond.release()
+        if timings is not None:
+            timings['read_ahead_wait'] += state['wait']
+            timings['read_ahead_full'] += state['full']
+
+
 class LogProcessorCommon(object):
 
     def __init__(self, conf, logger, log_route='log-processor'):
@@ -49,6 +292,25 @@ class LogProcessorCommon(object):
             if s.strip()])
         self.conf = conf
         self._internal_proxy = None
+        # settings are looked up in the conf directly, then in a section
+        # called log-processor
+        stats_conf = conf.get('log-processor', {})
+        self.read_ahead_chunks = int(conf.get('read_ahead_chunks',
+                                     stats_conf.get('read_ahead_chunks', '0')))
+        self.read_ahead_bytes = int(conf.get('read_ahead_bytes',
+                                    stats_conf.get('read_ahead_bytes', '0')))
+        self.stage_timings = collections.defaultdict(float)
+        # bytes of objects read, see pop_stats
+        self.bytes_read = 0
+        cache_dir = conf.get('object_cache_dir',
+                             stats_conf.get('object_cache_dir', ''))
+        self.object_cache = None
+        if cache_dir:
+            cache_size = int(conf.get('object_cache_size',
+                             stats_conf.get('object_cache_size',
+                                            '10737418240')))
+            self.object_cache = ObjectCache(cache_dir, cache_size,
+                                            self.logger)
 
     @property
     def internal_proxy(self):
@@ -71,22 +333,69 @@ class LogProcessorCommon(object):
                                                  retries=3)
         return self._internal_proxy
 
-    def get_object_data(self, swift_account, container_name, object_name,
-                        compressed=False):
-        '''reads an object and yields its lines'''
-        code, o = self.internal_proxy.get_object(swift_account, container_name,
-                                                 object_name)
+    def get_object_chunks(self, swift_account, container_name, object_name,
+                          compressed=False, byte_range=None, etag=None):
+        '''
+        reads an object and yields its (decompressed) chunks
+
+        If read_ahead_chunks is configured, the object is fetched and
+        decompressed in a background thread while the caller works through
+        the chunks already read.
+
+        If byte_range is given as (start, end), only the lines that begin in
+        [start, end) of an uncompressed object are read.
+
+        etag, if known from the container listing, saves the object cache a
+        HEAD request to find which version of the object it has to serve.
+        '''
+        chunks = self._read_object_chunks(swift_account, container_name,
+                                          object_name, compressed, byte_range,
+                                          etag)
+        if self.read_ahead_chunks > 0:
+            chunks = read_ahead(chunks, self.read_ahead_chunks,
+                                max_bytes=self.read_ahead_bytes,
+                                timings=self.stage_timings)
+        return chunks
+
+    def _read_object_chunks(self, swift_account, container_name, object_name,
+                            compressed, byte_range=None, etag=None):
+        timings = self.stage_timings
+        start = time.time()
+        if byte_range is None and self.object_cache:
+            code, o = self._get_cached_object(swift_account, container_name,
+                                              object_name, etag)
+        elif byte_range is None:
+            code, o = self.internal_proxy.get_object(swift_account,
+                                                     container_name,
+                                                     object_name)
+        else:
+            # read on until the end of the range's last line
+            offset = max(byte_range[0] - 1, 0)
+            code, o = self.internal_proxy.get_object(swift_account,
+                                container_name, object_name,
+                                headers={'Range': 'bytes=%d-' % offset})
+        timings['fetch'] += time.time() - start
         if code < 200 or code >= 300:
             raise BadFileDownload(code)
-        last_part = ''
-        last_compressed_part = ''
+        if byte_range is not None:
+            o = iter_line_range(o, offset, *byte_range)
         # magic in the following zlib.decompressobj argument is courtesy of
         # Python decompressing gzip chunk-by-chunk
         # http://stackoverflow.com/questions/2423866
         d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        o = iter(o)
         try:
-            for chunk in o:
+            while True:
+                start = time.time()
+                try:
+                    chunk = o.next()
+                except StopIteration:
+                    break
+                finally:
+                    timings['fetch'] += time.time() - start
+                self.bytes_read += len(chunk)
                 if compressed:
+                    start = time.time()
                     try:
                         chunk = d.decompress(chunk)
                     except zlib.error:
@@ -94,22 +403,94 @@ class LogProcessorCommon(object):
                             % '/'.join((swift_account, container_name,
                                         object_name)))
                         raise BadFileDownload()  # bad compressed data
-                parts = chunk.split('\n')
-                parts[0] = last_part + parts[0]
-                for part in parts[:-1]:
-                    yield part
-                last_part = parts[-1]
-            if last_part:
-                yield last_part
+                    finally:
+                        timings['decompress'] += time.time() - start
+                yield chunk
         except ChunkReadTimeout:
             raise BadFileDownload()
 
+    def _get_cached_object(self, swift_account, container_name,
+                           object_name, etag=None):
+        '''
+        Like InternalProxy.get_object, but serves the object from the object
+        cache when it has the current version of it, and adds it to the cache
+        otherwise. Without the etag of the object, it is looked up with a
+        HEAD request.
+        '''
+        code = 200
+        if not etag:
+            code, headers = self.internal_proxy.head_object(swift_account,
+                                                            container_name,
+                                                            object_name)
+            etag = headers.get('Etag', headers.get('ETag'))
+        if code < 200 or code >= 300 or not etag:
+            return self.internal_proxy.get_object(swift_account,
+                                                  container_name, object_name)
+        cache = self.object_cache
+        cached = cache.get(swift_account, container_name, object_name, etag)
+        if cached is not None:
+            self.logger.debug(_('Object cache hit for %s') %
+                '/'.join((swift_account, container_name, object_name)))
+            return 200, cached
+        code, o = self.internal_proxy.get_object(swift_account,
+                                                 container_name, object_name)
+        if code < 200 or code >= 300:
+            return code, o
+        return code, cache.put(swift_account, container_name, object_name,
+                               etag, o)
+
+    def get_object_data(self, swift_account, container_name, object_name,
+                        compressed=False, byte_range=None, etag=None):
+        '''reads an object and yields its lines'''
+        return iter_lines(self.get_object_chunks(swift_account,
+                                                 container_name,
+                                                 object_name,
+                                                 compressed=compressed,
+                                                 byte_range=byte_range,
+                                                 etag=etag))
+
+    def get_object_batches(self, swift_account, container_name, object_name,
+                           compressed=False, batch_size=1000,
+                           byte_range=None, etag=None):
+        '''reads an object and yields lists of its lines'''
+        return iter_line_batches(self.get_object_chunks(swift_account,
+                                                        container_name,
+                                                        object_name,
+                                                        compressed=compressed,
+                                                        byte_range=byte_range,
+                                                        etag=etag),
+                                 batch_size)
+
+    def pop_stats(self):
+        '''
+        :returns: the bytes of objects read and the counters of the object
+                  cache (hits, misses, hit_bytes, miss_bytes and evictions,
+                  prefixed with cache_) since the last call, for the
+                  collator to add up
+        '''
+        stats = {'bytes': self.bytes_read}
+        self.bytes_read = 0
+        if self.object_cache:
+            for key, value in self.object_cache.stats.iteritems():
+                stats['cache_' + key] = value
+                self.object_cache.stats[key] = 0
+        return stats
+
     def get_container_listing(self, swift_account, container_name,
                               start_date=None, end_date=None,
-                              listing_filter=None):
+                              listing_filter=None, with_sizes=False,
+                              checkpoint=None, etags=None):
         '''
         Get a container listing, filtered by start_date, end_date, and
         listing_filter. Dates, if given, must be in YYYYMMDDHH format
+
+        If with_sizes is True, the listing is a list of (name, bytes) tuples
+        instead of a list of names.
+
+        If a ListingCheckpoint is given, only the objects after its marker
+        for the container are listed, and the listing is recorded in it.
+
+        If etags is given, the etag of each object listed is added to it.
         '''
         search_key = None
         if start_date is not None:
@@ -138,72 +519,1002 @@ class LogProcessorCommon(object):
                 # one to the hour should be all-inclusive.
                 hour = '%02d' % (parsed_date.tm_hour + 1)
                 end_key = '/'.join([year, month, day, hour])
+        if checkpoint is not None:
+            marker = checkpoint.get_marker(swift_account, container_name)
+            if marker is not None:
+                search_key = max(search_key, marker)
         container_listing = self.internal_proxy.get_container_list(
                                     swift_account,
                                     container_name,
                                     marker=search_key,
                                     end_marker=end_key)
+        if checkpoint is not None:
+            checkpoint.add_listing(swift_account, container_name, '',
+                                   container_listing)
         results = []
         if listing_filter is None:
             listing_filter = set()
         for item in container_listing:
             name = item['name']
             if name not in listing_filter:
-                results.append(name)
+                if etags is not None and 'hash' in item:
+                    etags[name] = item['hash']
+                if with_sizes:
+                    results.append((name, item['bytes']))
+                else:
+                    results.append(name)
         return results
 
+    def iter_container_listing(self, swift_account, container_name,
+                               start_date=None, end_date=None,
+                               listing_filter=None, with_sizes=False,
+                               concurrency=1, checkpoint=None, etags=None):
+        '''
+        Like get_container_listing, but yields the listing as it is fetched.
+
+        When both start_date and end_date are given, the listing is fetched
+        one hour (YYYY/MM/DD/HH/ prefix) at a time, with up to concurrency
+        hours being listed at once. Hours are yielded in order, each as soon
+        as it and the hours before it have been listed. A ListingCheckpoint,
+        if given, then keeps a marker for each hour.
+        '''
+        prefixes = get_hourly_prefixes(start_date, end_date)
+        if prefixes is None:
+            for x in self.get_container_listing(swift_account,
+                                                container_name, start_date,
+                                                end_date, listing_filter,
+                                                with_sizes=with_sizes,
+                                                checkpoint=checkpoint,
+                                                etags=etags):
+                yield x
+            return
+        if listing_filter is None:
+            listing_filter = set()
+
+        def list_hour(prefix):
+            marker = None
+            if checkpoint is not None:
+                marker = checkpoint.get_marker(swift_account, container_name,
+                                               prefix)
+            listing = self.internal_proxy.get_container_list(swift_account,
+                                                             container_name,
+                                                             marker=marker,
+                                                             prefix=prefix)
+            if checkpoint is not None:
+                checkpoint.add_listing(swift_account, container_name, prefix,
+                                       listing)
+            return listing
+        pool = GreenPool(max(concurrency, 1))
+        for container_listing in pool.imap(list_hour, prefixes):
+            for item in container_listing:
+                name = item['name']
+                if name not in listing_filter:
+                    if etags is not None and 'hash' in item:
+                        etags[name] = item['hash']
+                    if with_sizes:
+                        yield name, item['bytes']
+                    else:
+                        yield name
+
+    def get_listing_checkpoint(self, swift_account, container_name,
+                               object_name, resync_interval):
+        '''
+        :returns: the ListingCheckpoint stored in the given object, or a new
+                  one (that lists everything) if there is none or it cannot
+                  be loaded.
+        '''
+        state = None
+        try:
+            stream = self.get_object_data(swift_account, container_name,
+                                          object_name, compressed=True)
+            buf = '\n'.join(x for x in stream)
+            if buf:
+                state = cPickle.loads(buf)
+        except BadFileDownload, err:
+            if err.status_code != 404:
+                self.logger.error(_('Unable to load the listing checkpoint, '
+                                    'listing everything'))
+        return ListingCheckpoint(resync_interval, state)
+
+    def store_listing_checkpoint(self, checkpoint, swift_account,
+                                 container_name, object_name):
+        '''
+        Stores a ListingCheckpoint in the given object.
+
+        :returns: True if successful, False otherwise
+        '''
+        s = cPickle.dumps(checkpoint.get_state(), cPickle.HIGHEST_PROTOCOL)
+        f = cStringIO.StringIO(s)
+        return self.internal_proxy.upload_file(f, swift_account,
+                                               container_name, object_name)
+
+
+def get_hourly_prefixes(start_date, end_date):
+    '''
+    :returns: the list of YYYY/MM/DD/HH/ object name prefixes for every hour
+              from start_date to end_date (inclusive), or None if either date
+              is missing or is not in YYYYMMDDHH format.
+    '''
+    try:
+        start = datetime.datetime.strptime(start_date, '%Y%m%d%H')
+        end = datetime.datetime.strptime(end_date, '%Y%m%d%H')
+    except (TypeError, ValueError):
+        return None
+    prefixes = []
+    one_hour = datetime.timedelta(hours=1)
+    while start <= end:
+        prefixes.append(start.strftime('%Y/%m/%d/%H/'))
+        start += one_hour
+    return prefixes
+
+
+class ListingCheckpoint(object):
+    '''
+    High-water marks of the log objects that have been listed and processed,
+    kept per container and per listing prefix (a YYYY/MM/DD/HH/ hour, or ''
+    when a container is listed in one go), so that a run only has to list
+    the objects that were uploaded after the previous one.
+
+    A marker is only moved past an object once it has been processed, so
+    objects that failed are listed again by the next run. Object names are
+    not in upload order within an hour though, so an object that shows up
+    late may sort before the marker of its hour. To pick those up, markers
+    are ignored and the whole lookback window is listed again every
+    resync_interval seconds.
+
+    :param resync_interval: seconds between full listings
+    :param state: the state of a previous checkpoint, as returned by
+                  get_state
+    '''
+
+    def __init__(self, resync_interval=86400, state=None):
+        self.resync_interval = resync_interval
+        self.markers = {}
+        self.last_full_listing = 0
+        if state:
+            self.markers, self.last_full_listing = state
+        self.start_time = time.time()
+        self.full_listing = \
+            self.start_time - self.last_full_listing >= resync_interval
+        self.listed = {}
+
+    def get_state(self):
+        return self.markers, self.last_full_listing
+
+    def get_marker(self, account, container, prefix=''):
+        '''
+        :returns: the name to list the objects under prefix after, or None
+                  if the whole prefix needs to be listed.
+        '''
+        if self.full_listing:
+            return None
+        return self.markers.get((account, container), {}).get(prefix)
+
+    def add_listing(self, account, container, prefix, listing):
+        '''
+        Records the objects listed under a prefix.
+
+        :param listing: the (sorted) container listing, as returned by
+                        InternalProxy.get_container_list
+        '''
+        self.listed[(account, container, prefix)] = \
+            [(item['name'], item['bytes']) for item in listing]
+
+    def advance(self, is_processed):
+        '''
+        Moves the marker of every listed prefix past the listed objects that
+        have been processed, up to the first one that has not. Markers of
+        prefixes that were not listed (hours that fell out of the lookback
+        window) are dropped.
+
+        :param is_processed: function that is given the account, container,
+                             object name and size of a listed object and
+                             returns True if it has been processed
+        '''
+        markers = {}
+        for (account, container, prefix), listing in self.listed.items():
+            container_markers = markers.setdefault((account, container), {})
+            marker = self.get_marker(account, container, prefix)
+            for name, size in listing:
+                if not is_processed(account, container, name, size):
+                    break
+                marker = name
+            if marker is not None:
+                container_markers[prefix] = marker
+        self.markers = markers
+        self.listed = {}
+        if self.full_listing:
+            self.last_full_listing = self.start_time
+
+
+class WorkItem(tuple):
+    '''
+    A work item, the positional parameters of the processor method, with
+    keyword parameters that are passed along with it. It is equal to (and
+    hashes like) the plain tuple, so the keyword parameters are not part of
+    what identifies the item.
+    '''
+
+    def __new__(cls, args, kwargs=None):
+        item = tuple.__new__(cls, args)
+        item.kwargs = kwargs or {}
+        return item
+
+    def __reduce__(self):
+        return (WorkItem, (tuple(self), self.kwargs))
+
+
+def plain_item(item):
+    '''
+    :returns: the work item as a plain tuple if it is a WorkItem, to be
+              stored without its keyword parameters
+    '''
+    if isinstance(item, WorkItem):
+        return tuple(item)
+    return item
+
+
+def call_with_item(method, item):
+    '''calls method with a work item, which may be a WorkItem'''
+    return method(*item, **getattr(item, 'kwargs', {}))
+
+
+def pop_worker_stats(processor, busy):
+    '''
+    :param busy: seconds the worker spent processing items since its last
+                 stats
+    :returns: the stats of a worker that just processed an item, with the
+              counters of the processor (see LogProcessorCommon.pop_stats),
+              if it has any
+    '''
+    stats = {'items': 1, 'busy': busy}
+    pop_stats = getattr(processor, 'pop_stats', None)
+    if pop_stats is not None:
+        stats.update(pop_stats())
+    return stats
+
+
+def add_worker_stats(worker_stats, worker_id, stats):
+    '''adds stats from a worker to the worker_stats dict of a run'''
+    totals = worker_stats.setdefault(worker_id, {})
+    for key, value in stats.iteritems():
+        totals[key] = totals.get(key, 0) + value
+
+
+def log_worker_stats(logger, worker_stats):
+    '''
+    Logs the summary of the stats the workers of a run sent.
+
+    :param worker_stats: dict of worker id to the stats of the worker, as
+                         filled by the collate functions
+    '''
+    totals = {}
+    for stats in worker_stats.itervalues():
+        for key, value in stats.iteritems():
+            totals[key] = totals.get(key, 0) + value
+    if 'cache_hits' in totals:
+        logger.info(_('Object cache: %(cache_hits)d hits (%(cache_hit_bytes)d '
+                      'bytes), %(cache_misses)d misses (%(cache_miss_bytes)d '
+                      'bytes), %(cache_evictions)d evictions') % totals)
+
+
+def max_worker_load(worker_stats):
+    '''
+    :param worker_stats: dict of worker id to the stats of the worker
+    :returns: the most bytes read and the most seconds spent busy by a
+              worker, to compare with the makespan schedule_largest_first
+              predicted
+    '''
+    max_bytes = max_busy = 0
+    for stats in worker_stats.itervalues():
+        max_bytes = max(max_bytes, stats.get('bytes', 0))
+        max_busy = max(max_busy, stats.get('busy', 0))
+    return max_bytes, max_busy
+
+
+def schedule_largest_first(items, item_sizes, worker_count):
+    '''
+    Orders work items largest first. multiprocess_collate hands items out in
+    order to whichever worker is free, so this gives a longest processing
+    time first schedule, which keeps a big item picked up last from keeping
+    one worker busy long after the others are done.
+
+    :param items: work items
+    :param item_sizes: dict of the size in bytes of the work items
+    :param worker_count: number of worker processes
+    :returns: the sorted items and the predicted makespan of the schedule,
+              in bytes processed by the busiest worker
+    '''
+    items = sorted(items, key=lambda x: item_sizes.get(x, 0), reverse=True)
+    loads = [0] * max(worker_count, 1)
+    for item in items:
+        heapq.heapreplace(loads, loads[0] + item_sizes.get(item, 0))
+    return items, max(loads)
+
+
+class WorkerPool(object):
+    '''
+    A pool of worker processes to run collate_worker in, that can be used
+    for any number of runs. Long running daemons can keep one around so that
+    they do not pay for starting the workers (and the processors they build)
+    on every run.
+
+    Workers are started when needed and, if max_items is non-zero, replaced
+    after processing that many items to bound their memory use. See
+    collate_worker for combine_func, combine_count and encode_func.
+
+    The pool keeps track of which worker took which item. A worker that
+    dies, or that spends more than item_timeout seconds (if non-zero) on an
+    item, is replaced and the items it had are handed out again, up to
+    item_retries more times each.
+
+    Each worker processes up to concurrency items at once, see
+    collate_worker. With send_stats, the workers send their stats for
+    collate to add up in its worker_stats.
+    '''
+
+    def __init__(self, processor_klass, processor_args, processor_method,
+                 worker_count, max_items=0, logger=None, combine_func=None,
+                 combine_count=0, encode_func=None, item_timeout=0,
+                 item_retries=0, concurrency=1, send_stats=False):
+        self.processor_klass = processor_klass
+        self.processor_args = processor_args
+        self.processor_method = processor_method
+        self.worker_count = worker_count
+        self.max_items = max_items
+        self.logger = logger
+        self.combine_func = combine_func
+        self.combine_count = combine_count
+        self.encode_func = encode_func
+        self.item_timeout = item_timeout
+        self.item_retries = item_retries
+        self.concurrency = concurrency
+        self.send_stats = send_stats
+        self.in_queue = None
+        self.out_queue = None
+        self.workers = {}
+        # the pipes the workers send the items they start on
+        self.start_conns = {}
+        # per run state, see collate
+        self.outstanding = {}
+        self.owners = {}
+        self.taken = {}
+        self.current = {}
+        self.failed_items = []
+        self.worker_stats = {}
+        self.worker_losses = 0
+
+    def _start(self):
+        if self.in_queue is None:
+            self.in_queue = multiprocessing.Queue()
+            self.out_queue = multiprocessing.Queue()
+        while len(self.workers) < self.worker_count:
+            start_conn, worker_start_conn = multiprocessing.Pipe(False)
+            p = multiprocessing.Process(target=collate_worker,
+                                        args=(self.processor_klass,
+                                              self.processor_args,
+                                              self.processor_method,
+                                              self.in_queue,
+                                              self.out_queue,
+                                              self.combine_func,
+                                              self.combine_count,
+                                              self.encode_func,
+                                              self.max_items,
+                                              worker_start_conn,
+                                              self.concurrency,
+                                              self.send_stats))
+            p.start()
+            worker_start_conn.close()
+            self.workers[p.pid] = p
+            self.start_conns[p.pid] = start_conn
+
+    def _remove_worker(self, pid):
+        p = self.workers.pop(pid)
+        p.join()
+        self._read_starts(pid)
+        self.start_conns.pop(pid).close()
+        self.current.pop(pid, None)
+        return self.taken.pop(pid, ())
+
+    def _read_starts(self, pid):
+        '''notes which items a worker started on since the last call'''
+        conn = self.start_conns[pid]
+        while conn.poll():
+            try:
+                item, started = conn.recv()
+            except EOFError:
+                break
+            if started is None:
+                # its result may still be held back to be combined
+                self.current.get(pid, {}).pop(item, None)
+            elif item in self.outstanding:
+                self.owners[item] = pid
+                self.taken.setdefault(pid, set()).add(item)
+                self.current.setdefault(pid, {})[item] = started
+
+    def _error(self, msg):
+        if self.logger:
+            self.logger.error(msg)
+
+    def collate(self, items_to_process, failed_items=None,
+                worker_stats=None):
+        '''
+        Processes items_to_process and yields (item, result) as the results
+        come in. With a combine_func, (list of items, combined result) is
+        yielded for the results that a worker combined.
+
+        At most COLLATE_QUEUE_DEPTH items per worker are handed out ahead of
+        their results, which bounds both the queued items and the queued
+        results without the cost of bounded queues. The run is over once
+        every item has a result or has failed. Workers are checked on every
+        WORKER_CHECK_INTERVAL seconds.
+
+        :param failed_items: optional list that the items that could not be
+                             processed (errors, or lost with their worker
+                             too many times) are added to
+        :param worker_stats: optional dict that, with send_stats, the stats
+                             of each worker (by pid) are added up in
+        '''
+        if failed_items is None:
+            failed_items = []
+        if worker_stats is None:
+            worker_stats = {}
+        for pid in self.workers:
+            # forget what the workers did in the last run
+            self._read_starts(pid)
+        # items handed out and not done yet, with how many times they were
+        # lost with their worker
+        self.outstanding = {}
+        # which worker took an item, and which items a worker took
+        self.owners = {}
+        self.taken = {}
+        # pid -> {item being processed: when it was started}
+        self.current = {}
+        self.failed_items = failed_items
+        self.worker_stats = worker_stats
+        self.worker_losses = 0
+        self._start()
+        max_in_flight = self.worker_count * COLLATE_QUEUE_DEPTH
+        items_to_process = iter(items_to_process)
+        next_check = time.time() + WORKER_CHECK_INTERVAL
+        done = False
+        try:
+            while True:
+                while items_to_process is not None and \
+                        len(self.outstanding) < max_in_flight:
+                    item = next(items_to_process, None)
+                    if item is None:
+                        items_to_process = None
+                        break
+                    self.outstanding[item] = 0
+                    self.in_queue.put(item)
+                if not self.outstanding:
+                    break
+                if time.time() >= next_check:
+                    if not self._check_workers():
+                        return
+                    next_check = time.time() + WORKER_CHECK_INTERVAL
+                try:
+                    item, data = self.out_queue.get(
+                        timeout=WORKER_CHECK_INTERVAL)
+                except Queue.Empty:
+                    continue
+                if item is None:
+                    if not self._worker_message(*data):
+                        return
+                    continue
+                if isinstance(item, list):
+                    new_items = [x for x in item if x in self.outstanding]
+                    if len(new_items) < len(item):
+                        # some were processed again after their worker
+                        # was thought lost. Their stats can not be taken
+                        # out of the combined result, so it is dropped and
+                        # the other items are processed again on their own
+                        self._error(_('Dropping %d duplicate results') %
+                                    (len(item) - len(new_items)))
+                        for x in new_items:
+                            self._requeue(x)
+                        continue
+                    for x in item:
+                        self._item_done(x)
+                elif not self._item_done(item):
+                    continue
+                self.worker_losses = 0
+                if isinstance(data, Exception):
+                    if self.logger:
+                        self.logger.exception(data)
+                    if isinstance(item, list):
+                        failed_items.extend(item)
+                    else:
+                        failed_items.append(item)
+                else:
+                    yield item, data
+            done = True
+        finally:
+            if not done:
+                self.close(terminate=True)
+
+    def _item_done(self, item):
+        '''
+        Forgets about an item that has a result.
+
+        :returns: False if the item already had a result
+        '''
+        if item not in self.outstanding:
+            return False
+        del self.outstanding[item]
+        pid = self.owners.pop(item, None)
+        if pid is not None:
+            self.taken[pid].discard(item)
+            self.current.get(pid, {}).pop(item, None)
+        return True
+
+    def _requeue(self, item):
+        '''
+        hands out an item again, whose result had to be dropped, unless it
+        was retried too many times
+        '''
+        pid = self.owners.pop(item, None)
+        if pid is not None:
+            self.taken[pid].discard(item)
+            self.current.get(pid, {}).pop(item, None)
+        self._retry(item)
+
+    def _worker_message(self, message, pid, value):
+        '''
+        Handles the message a worker sends with its stats, or when it is
+        done.
+
+        :returns: False if the run has to be stopped
+        '''
+        if message == 'stats':
+            add_worker_stats(self.worker_stats, pid, value)
+            return True
+        if pid not in self.workers:
+            # already replaced
+            return True
+        for item in self._remove_worker(pid):
+            self.owners.pop(item, None)
+            self._retry(item)
+        if self.max_items and value >= self.max_items:
+            # the worker was retired, replace it
+            self._start()
+            return True
+        self._error(_('Worker process %d ended early') % pid)
+        if not self.workers:
+            self._stop()
+            return False
+        return True
+
+    def _check_workers(self):
+        '''
+        Replaces the workers that died or are stuck on an item.
+
+        :returns: False if the run has to be stopped
+        '''
+        now = time.time()
+        for pid, p in self.workers.items():
+            if pid not in self.workers:
+                # the workers were restarted
+                break
+            self._read_starts(pid)
+            if p.is_alive():
+                if not self.item_timeout:
+                    continue
+                stuck = [item for item, started in
+                         self.current.get(pid, {}).iteritems()
+                         if now - started >= self.item_timeout]
+                if not stuck:
+                    continue
+                self._error(_('Worker process %(pid)d timed out processing '
+                              '%(items)s') % {'pid': pid, 'items':
+                              ', '.join(str(x) for x in stuck)})
+                p.terminate()
+            elif p.exitcode == 0:
+                # it ended normally, its last message is on the way
+                continue
+            else:
+                self._error(_('Worker process %(pid)d exited with code '
+                              '%(code)s') % {'pid': pid, 'code': p.exitcode})
+            if not self._lose_worker(pid):
+                return False
+        return True
+
+    def _lose_worker(self, pid):
+        '''
+        Replaces a worker that died or was killed, handing the items it had
+        out again.
+
+        :returns: False if the run has to be stopped
+        '''
+        self.worker_losses += 1
+        if self.worker_losses > self.worker_count * (self.item_retries + 1):
+            # workers keep dying without getting anything done
+            self._stop()
+            return False
+        busy = bool(self.current.get(pid))
+        lost_items = self._remove_worker(pid)
+        if not busy or self.concurrency > 1:
+            # a worker waiting for an item (which one processing several at
+            # once may always be) holds the lock of the item queue, start
+            # over with new queues and workers
+            self._restart(lost_items)
+        else:
+            for item in lost_items:
+                self.owners.pop(item, None)
+                self._retry(item)
+            self._start()
+        return True
+
+    def _retry(self, item):
+        '''hands out an item again, unless it was lost too many times'''
+        if item not in self.outstanding:
+            return
+        self.outstanding[item] += 1
+        if self.outstanding[item] > self.item_retries:
+            self._error(_('Giving up on %s') % (item,))
+            del self.outstanding[item]
+            self.failed_items.append(item)
+        else:
+            self.in_queue.put(item)
+
+    def _restart(self, lost_items=()):
+        '''
+        Restarts the workers with new queues and hands out all the items
+        that do not have a result yet again. The items a worker had taken,
+        and lost_items, count as retried; the others were still queued.
+        '''
+        taken = set(lost_items)
+        for pid in self.workers:
+            self._read_starts(pid)
+            taken.update(self.taken.get(pid, ()))
+        self.close(terminate=True)
+        self.owners = {}
+        self.taken = {}
+        self.current = {}
+        self._start()
+        for item in self.outstanding.keys():
+            if item in taken:
+                self._retry(item)
+            else:
+                self.in_queue.put(item)
+
+    def _stop(self):
+        self._error(_('Stopping the run, %d items handed out were not '
+                      'processed') % len(self.outstanding))
+        self.failed_items.extend(self.outstanding)
+        self.outstanding = {}
+
+    def close(self, terminate=False):
+        '''
+        Stops the workers.
+
+        :param terminate: if True, kill the workers instead of letting them
+                          finish the items they have
+        '''
+        if self.in_queue is None:
+            return
+        if terminate:
+            # don't wait to flush items that no worker is left to take
+            self.in_queue.cancel_join_thread()
+            for p in self.workers.values():
+                p.terminate()
+        else:
+            for _junk in self.workers:
+                self.in_queue.put(None)  # tell the worker to end
+        for p in self.workers.values():
+            p.join()
+        for conn in self.start_conns.values():
+            conn.close()
+        self.in_queue.close()
+        self.in_queue.join_thread()
+        self.workers = {}
+        self.start_conns = {}
+        self.in_queue = self.out_queue = None
+
 
 def multiprocess_collate(processor_klass, processor_args, processor_method,
-                         items_to_process, worker_count, logger=None):
-    '''
-    '''
-    results = []
-    in_queue = multiprocessing.Queue()
-    out_queue = multiprocessing.Queue()
-    for _junk in range(worker_count):
-        p = multiprocessing.Process(target=collate_worker,
-                                    args=(processor_klass,
-                                          processor_args,
-                                          processor_method,
-                                          in_queue,
-                                          out_queue))
-        p.start()
-        results.append(p)
-    for x in items_to_process:
-        in_queue.put(x)
-    for _junk in range(worker_count):
-        in_queue.put(None)  # tell the worker to end
-    while True:
+                         items_to_process, worker_count, logger=None,
+                         combine_func=None, combine_count=0,
+                         encode_func=None, failed_items=None,
+                         item_timeout=0, item_retries=0, concurrency=1,
+                         worker_stats=None):
+    '''
+    Processes items_to_process with worker_count worker processes and yields
+    (item, result) as the results come in. See WorkerPool.collate.
+
+    :param worker_stats: optional dict that the stats of each worker are
+                         added up in, see pop_worker_stats
+    '''
+    pool = WorkerPool(processor_klass, processor_args, processor_method,
+                      worker_count, logger=logger, combine_func=combine_func,
+                      combine_count=combine_count, encode_func=encode_func,
+                      item_timeout=item_timeout, item_retries=item_retries,
+                      concurrency=concurrency,
+                      send_stats=worker_stats is not None)
+    try:
+        for x in pool.collate(items_to_process, failed_items, worker_stats):
+            yield x
+    finally:
+        pool.close()
+
+
+def serial_collate(processor_klass, processor_args, processor_method,
+                   items_to_process, worker_count, logger=None,
+                   failed_items=None, worker_stats=None, **kwargs):
+    '''
+    Processes items_to_process one at a time in the current process and
+    yields (item, result), which keeps profiles and tracebacks readable.
+    Other multiprocess_collate options are accepted and ignored.
+    '''
+    if failed_items is None:
+        failed_items = []
+    processor = processor_klass(*processor_args)
+    method = getattr(processor, processor_method)
+    for item in items_to_process:
+        start = time.time()
         try:
-            item, data = out_queue.get_nowait()
-        except Queue.Empty:
-            sleep(.01)
+            ret = call_with_item(method, item)
+        except Exception, err:
+            ret = err
+        if worker_stats is not None:
+            add_worker_stats(worker_stats, 0,
+                             pop_worker_stats(processor, time.time() - start))
+        if isinstance(ret, Exception):
+            if logger:
+                logger.exception(ret)
+            failed_items.append(item)
         else:
+            yield item, ret
+
+
+def _start_thread(func, *args):
+    t = threading.Thread(target=func, args=args)
+    t.daemon = True
+    t.start()
+
+
+def _local_collate(spawn, queue_klass, processor_klass, processor_args,
+                   processor_method, items_to_process, worker_count,
+                   logger=None, combine_func=None, combine_count=0,
+                   encode_func=None, failed_items=None, concurrency=1,
+                   worker_stats=None):
+    '''
+    Runs worker_count collate_workers in the current process, started with
+    spawn(func, *args), and yields their results like multiprocess_collate.
+    The workers are told apart in worker_stats by their number.
+    '''
+    if failed_items is None:
+        failed_items = []
+    in_queue = queue_klass()
+    out_queue = queue_klass()
+    for i in xrange(worker_count):
+        spawn(collate_worker, processor_klass, processor_args,
+              processor_method, in_queue, out_queue, combine_func,
+              combine_count, encode_func, 0, None, concurrency,
+              worker_stats is not None, i)
+    workers = worker_count
+    in_flight = 0
+    max_in_flight = worker_count * COLLATE_QUEUE_DEPTH
+    items_to_process = iter(items_to_process)
+    try:
+        while workers:
+            while items_to_process is not None and in_flight < max_in_flight:
+                item = next(items_to_process, None)
+                if item is None:
+                    items_to_process = None
+                    for _junk in xrange(workers):
+                        in_queue.put(None)  # tell the worker to end
+                    break
+                in_queue.put(item)
+                in_flight += 1
+            item, data = out_queue.get()
+            if item is None:
+                message, worker_id, value = data
+                if message == 'stats':
+                    add_worker_stats(worker_stats, worker_id, value)
+                else:
+                    # a worker is done
+                    workers -= 1
+                continue
+            if isinstance(item, list):
+                in_flight -= len(item)
+            else:
+                in_flight -= 1
             if isinstance(data, Exception):
                 if logger:
                     logger.exception(data)
+                if isinstance(item, list):
+                    failed_items.extend(item)
+                else:
+                    failed_items.append(item)
             else:
                 yield item, data
-        if not any(r.is_alive() for r in results) and out_queue.empty():
-            # all the workers are done and nothing is in the queue
-            break
+    finally:
+        # the workers left end once the items already handed out are gone
+        while True:
+            try:
+                item = in_queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                failed_items.append(item)
+        for _junk in xrange(workers):
+            in_queue.put(None)
+        if in_flight and logger:
+            logger.error(_('%d items handed out were not processed') %
+                         in_flight)
+
+
+def thread_collate(processor_klass, processor_args, processor_method,
+                   items_to_process, worker_count, logger=None,
+                   combine_func=None, combine_count=0, encode_func=None,
+                   failed_items=None, concurrency=1, worker_stats=None,
+                   **kwargs):
+    '''
+    Like multiprocess_collate, with worker_count threads of the current
+    process instead of worker processes. Items are not timed out or
+    retried, a thread can not be killed.
+    '''
+    return _local_collate(_start_thread, Queue.Queue, processor_klass,
+                          processor_args, processor_method, items_to_process,
+                          worker_count, logger=logger,
+                          combine_func=combine_func,
+                          combine_count=combine_count,
+                          encode_func=encode_func, failed_items=failed_items,
+                          concurrency=concurrency, worker_stats=worker_stats)
+
+
+def eventlet_collate(processor_klass, processor_args, processor_method,
+                     items_to_process, worker_count, logger=None,
+                     combine_func=None, combine_count=0, encode_func=None,
+                     failed_items=None, concurrency=1, worker_stats=None,
+                     **kwargs):
+    '''
+    Like multiprocess_collate, with worker_count green threads of the
+    current process instead of worker processes. Items are not timed out or
+    retried.
+    '''
+    return _local_collate(eventlet.spawn_n, eventlet.queue.Queue,
+                          processor_klass, processor_args, processor_method,
+                          items_to_process, worker_count, logger=logger,
+                          combine_func=combine_func,
+                          combine_count=combine_count,
+                          encode_func=encode_func, failed_items=failed_items,
+                          concurrency=concurrency, worker_stats=worker_stats)
+
+
+# the ways items can be collated, for the executor setting of the daemons
+COLLATE_EXECUTORS = {
+    'serial': serial_collate,
+    'thread': thread_collate,
+    'eventlet': eventlet_collate,
+    'process': multiprocess_collate,
+}
+
+
+def get_collate_func(executor):
+    '''
+    :param executor: one of the names in COLLATE_EXECUTORS
+    :returns: a function with the signature and results of
+              multiprocess_collate
+    :raises ValueError: if the executor is unknown
+    '''
+    try:
+        return COLLATE_EXECUTORS[executor]
+    except KeyError:
+        raise ValueError(_('Unknown executor %(executor)s, use one of '
+                           '%(executors)s') % {'executor': executor,
+                           'executors': ', '.join(sorted(COLLATE_EXECUTORS))})
 
 
 def collate_worker(processor_klass, processor_args, processor_method, in_queue,
-                   out_queue):
-    '''worker process for multiprocess_collate'''
-    p = processor_klass(*processor_args)
-    while True:
-        item = in_queue.get()
-        if item is None:
-            # no more work to process
-            break
-        try:
-            method = getattr(p, processor_method)
-        except AttributeError:
-            return
+                   out_queue, combine_func=None, combine_count=0,
+                   encode_func=None, max_items=0, start_conn=None,
+                   concurrency=1, send_stats=False, worker_id=None):
+    '''
+    worker process for multiprocess_collate and WorkerPool
+
+    If combine_func is given, results are combined with it (as
+    combine_func(combined, result)) while more items are waiting, and sent
+    as (list of items, combined result) once no item is waiting or
+    combine_count items (if non-zero) have been combined. If encode_func is
+    given, results are sent as encode_func(result). If max_items is
+    non-zero, the worker ends after processing that many items. If
+    start_conn is given, (item, time) is sent on it before processing each
+    item and (item, None) after; unlike the queue, the connection sends
+    right away, so the messages are not lost if the worker dies.
+
+    If concurrency is more than 1, up to that many items are processed at
+    once in green threads, so that the worker keeps several object downloads
+    going while it parses whichever one has data.
+
+    If send_stats is True, (None, ('stats', worker_id, stats)) is sent
+    before the result of each item, see pop_worker_stats. worker_id defaults
+    to the pid. Work items may be WorkItems, see call_with_item.
+    '''
+    if encode_func is None:
+        encode_func = lambda ret: ret
+    pid = os.getpid()
+    if worker_id is None:
+        worker_id = pid
+    # the items whose results were combined but not sent yet, and the
+    # combined result
+    combined = [[], None]
+    # how many items are in progress, and since when the worker's busy time
+    # was last sent
+    busy = {'items': 0, 'since': 0.0}
+
+    def send_combined():
+        if combined[0]:
+            out_queue.put((combined[0], encode_func(combined[1])))
+            combined[:] = [[], None]
+
+    def process(method, item):
+        started = time.time()
+        if not busy['items']:
+            busy['since'] = started
+        busy['items'] += 1
+        if start_conn is not None:
+            start_conn.send((item, started))
         try:
-            ret = method(*item)
+            ret = call_with_item(method, item)
         except Exception, err:
             ret = err
-        out_queue.put((item, ret))
+        busy['items'] -= 1
+        if start_conn is not None:
+            start_conn.send((item, None))
+        if send_stats:
+            # items processed at once count once in the busy time
+            now = time.time()
+            stats = pop_worker_stats(p, now - busy['since'])
+            busy['since'] = now
+            out_queue.put((None, ('stats', worker_id, stats)))
+        if isinstance(ret, Exception):
+            out_queue.put((item, ret))
+        elif combine_func is None:
+            out_queue.put((item, encode_func(ret)))
+        else:
+            if combined[0]:
+                combined[1] = combine_func(combined[1], ret)
+            else:
+                combined[1] = ret
+            combined[0].append(item)
+            if combine_count and len(combined[0]) >= combine_count:
+                send_combined()
+
+    pool = None
+    if concurrency > 1:
+        pool = GreenPool(concurrency)
+    item_count = 0
+    try:
+        p = processor_klass(*processor_args)
+        while not max_items or item_count < max_items:
+            try:
+                item = in_queue.get_nowait()
+            except Queue.Empty:
+                send_combined()
+                if pool is not None and pool.running():
+                    # a blocking get would stop the green threads
+                    sleep(WORKER_POLL_INTERVAL)
+                    continue
+                item = in_queue.get()
+            if item is None:
+                # no more work to process
+                break
+            item_count += 1
+            try:
+                method = getattr(p, processor_method)
+            except AttributeError, err:
+                out_queue.put((item, err))
+                return
+            if pool is None:
+                process(method, item)
+            else:
+                pool.spawn_n(process, method, item)
+    finally:
+        if pool is not None:
+            pool.waitall()
+        send_combined()
+        # tell the collator that this worker is done
+        out_queue.put((None, ('end', pid, item_count)))
@@ -18,27 +18,122 @@ import zlib
 import time
 import datetime
 import cStringIO
-import collections
 from paste.deploy import appconfig
 import multiprocessing
 import Queue
 import cPickle
 import hashlib
+import itertools
+import tempfile
 
 from slogging.internal_proxy import InternalProxy
-from swift.common.utils import get_logger, readconf
+from swift.common.utils import get_logger, readconf, TRUE_VALUES
 from swift.common.daemon import Daemon
-from slogging.log_common import LogProcessorCommon, multiprocess_collate, \
-                                   BadFileDownload
+from slogging.log_common import LogProcessorCommon, get_collate_func, \
+                                   BadFileDownload, schedule_largest_first, \
+                                   WorkItem, plain_item, log_worker_stats, \
+                                   max_worker_load
+from slogging import aggregation
+from slogging.aggregation import merge_aggregates, PackedAggregate, \
+                                  DenseAggregate, KeylistIndex, \
+                                  SpillingAggregate
+from slogging.processed_files import ProcessedFiles, HashedSet
 
 now = datetime.datetime.now
 
+# the csv output is kept in memory up to this size, then written to disk
+OUTPUT_SPOOL_SIZE = 1 << 20
+# stands for a SpillingAggregate in a stored run checkpoint or partial,
+# whose rows are pickled one by one after it
+STREAMED_ROWS = '<streamed rows>'
+
+
+def get_shard(account, container, object_name, shard_count):
+    """
+    :returns: the shard (0 to shard_count - 1) that processes a log object,
+              the same on every node and for every plugin and byte range of
+              the object.
+    """
+    path = '/'.join((account, container, object_name))
+    return int(hashlib.md5(path).hexdigest(), 16) % shard_count
+
+
+def spool_state(state):
+    """
+    Pickles state, a tuple, to a spooled temporary file. A SpillingAggregate
+    in it is replaced by STREAMED_ROWS and its (hour, stats) rows are
+    pickled one by one after it, so that it is not read back into memory.
+
+    :returns: the file, rewound
+    """
+    rows = ()
+    state = list(state)
+    for i, value in enumerate(state):
+        if isinstance(value, SpillingAggregate):
+            rows, state[i] = value.iteritems(), STREAMED_ROWS
+    f = tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE)
+    pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+    pickler.dump(tuple(state))
+    for row in rows:
+        pickler.clear_memo()
+        pickler.dump(row)
+    f.seek(0)
+    return f
+
+
+def load_state(chunks):
+    """
+    Reads back a state stored with spool_state, or pickled as one string.
+
+    :param chunks: iterable of the chunks of the stored data
+    :returns: the state, with STREAMED_ROWS replaced by an iterator of the
+              rows pickled after it, or None if there is no data
+    """
+    f = tempfile.SpooledTemporaryFile(OUTPUT_SPOOL_SIZE)
+    for chunk in chunks:
+        f.write(chunk)
+    f.seek(0)
+    try:
+        state = cPickle.load(f)
+    except EOFError:
+        f.close()
+        return None
+
+    def iter_rows():
+        try:
+            while True:
+                try:
+                    yield cPickle.load(f)
+                except EOFError:
+                    return
+        finally:
+            f.close()
+    return tuple(iter_rows() if x == STREAMED_ROWS else x for x in state)
+
+
+def merge_stored_aggregate(aggr_data, data):
+    """
+    Merges data, an aggregate or the rows load_state read, into aggr_data
+    with merge_aggregates, a row at a time for rows.
+
+    :returns: aggr_data
+    """
+    if not hasattr(data, 'next'):
+        return merge_aggregates(aggr_data, data)
+    for hour, stats in data:
+        merge_aggregates(aggr_data, {hour: stats})
+    return aggr_data
+
 
 class LogProcessor(LogProcessorCommon):
     """Load plugins, process logs"""
 
     def __init__(self, conf, logger):
         super(LogProcessor, self).__init__(conf, logger, 'log-processor')
+        stats_conf = conf.get('log-processor', {})
+        # uncompressed objects bigger than this are processed in byte ranges
+        # of this size, as separate work items. 0 disables splitting.
+        self.range_split_size = int(stats_conf.get('range_split_size', '0'))
 
         # load the processing plugins
         self.plugins = {}
@@ -52,39 +147,149 @@ class LogProcessor(LogProcessorCommon):
             module = __import__(import_target, fromlist=[import_target])
             klass = getattr(module, class_name)
             self.plugins[plugin_name]['instance'] = klass(plugin_conf)
+            self.plugins[plugin_name]['batch_size'] = \
+                int(plugin_conf.get('batch_size', '0'))
             self.logger.debug(_('Loaded plugin "%s"') % plugin_name)
 
-    def process_one_file(self, plugin_name, account, container, object_name):
-        self.logger.info(_('Processing %(obj)s with plugin "%(plugin)s"') %
+    def process_one_file(self, plugin_name, account, container, object_name,
+                         byte_range=None, etag=None):
+        if byte_range is None:
+            self.logger.info(_('Processing %(obj)s with plugin "%(plugin)s"')
+                    % {'obj': '/'.join((account, container, object_name)),
+                       'plugin': plugin_name})
+        else:
+            self.logger.info(_('Processing %(obj)s bytes %(start)d-%(end)d '
+                    'with plugin "%(plugin)s"') %
                     {'obj': '/'.join((account, container, object_name)),
+                     'start': byte_range[0], 'end': byte_range[1] - 1,
                      'plugin': plugin_name})
-        # get an iter of the object data
+        # with worker_concurrency, this includes the files processed at the
+        # same time
+        start_timings = dict(self.stage_timings)
         compressed = object_name.endswith('.gz')
-        stream = self.get_object_data(account, container, object_name,
-                                      compressed=compressed)
-        # look up the correct plugin and send the stream to it
-        return self.plugins[plugin_name]['instance'].process(stream,
-                                                             account,
-                                                             container,
-                                                             object_name)
+        plugin = self.plugins[plugin_name]
+        batch_size = plugin.get('batch_size')
+        if batch_size and hasattr(plugin['instance'], 'process_batch'):
+            # get an iter of lists of lines and send it to the plugin
+            batches = self.get_object_batches(account, container, object_name,
+                                              compressed=compressed,
+                                              batch_size=batch_size,
+                                              byte_range=byte_range,
+                                              etag=etag)
+            result = plugin['instance'].process_batch(batches, account,
+                                                      container, object_name)
+        else:
+            # get an iter of the object data
+            stream = self.get_object_data(account, container, object_name,
+                                          compressed=compressed,
+                                          byte_range=byte_range, etag=etag)
+            # look up the correct plugin and send the stream to it
+            result = plugin['instance'].process(stream, account, container,
+                                                object_name)
+        self.logger.debug(_('Stage timings for %(obj)s: %(timings)s') %
+                    {'obj': '/'.join((account, container, object_name)),
+                     'timings': ', '.join('%s %.3fs' %
+                        (k, v - start_timings.get(k, 0.0))
+                        for k, v in sorted(self.stage_timings.items()))})
+        return result
 
     def get_data_list(self, start_date=None, end_date=None,
-                      listing_filter=None):
-        total_list = []
+                      listing_filter=None, checkpoint=None, item_sizes=None):
+        return list(self.iter_data_list(start_date, end_date, listing_filter,
+                                        checkpoint=checkpoint,
+                                        item_sizes=item_sizes))
+
+    def iter_data_list(self, start_date=None, end_date=None,
+                       listing_filter=None, listing_concurrency=0,
+                       checkpoint=None, item_sizes=None):
+        """
+        Yields the work items for the logs that need processing.
+
+        :param listing_concurrency: if non-zero, each plugin's container is
+                                    listed an hour at a time, this many hours
+                                    at once, and items are yielded while the
+                                    listing is still in progress.
+        :param checkpoint: optional ListingCheckpoint to only list the objects
+                           after its markers
+        :param item_sizes: optional dict that the size in bytes of each work
+                           item is added to
+
+        Whole objects are yielded as WorkItems that pass the etag from the
+        listing to process_one_file, which saves the object cache a HEAD.
+        """
         for plugin_name, data in self.plugins.items():
             account = data['swift_account']
             container = data['container_name']
-            listing = self.get_container_listing(account,
-                                                 container,
-                                                 start_date,
-                                                 end_date)
-            for object_name in listing:
-                # The items in this list end up being passed as positional
+            etags = {}
+            if listing_concurrency:
+                listing = self.iter_container_listing(account,
+                                    container, start_date, end_date,
+                                    with_sizes=True,
+                                    concurrency=listing_concurrency,
+                                    checkpoint=checkpoint, etags=etags)
+            else:
+                listing = self.get_container_listing(account,
+                                                     container,
+                                                     start_date,
+                                                     end_date,
+                                                     with_sizes=True,
+                                                     checkpoint=checkpoint,
+                                                     etags=etags)
+            for object_name, size in listing:
+                # The items yielded end up being passed as positional
                 # parameters to process_one_file.
                 x = (plugin_name, account, container, object_name)
-                if x not in listing_filter:
-                    total_list.append(x)
-        return total_list
+                if x in listing_filter:
+                    continue
+                if self.range_split_size and \
+                        size > self.range_split_size and \
+                        not object_name.endswith('.gz'):
+                    # Each range is a work item of its own. The ranges of an
+                    # object only change if range_split_size does.
+                    for byte_range in self.split_byte_ranges(size):
+                        y = x + (byte_range,)
+                        if y not in listing_filter:
+                            if item_sizes is not None:
+                                item_sizes[y] = byte_range[1] - byte_range[0]
+                            yield y
+                else:
+                    if item_sizes is not None:
+                        item_sizes[x] = size
+                    etag = etags.pop(object_name, None)
+                    if etag:
+                        x = WorkItem(x, {'etag': etag})
+                    yield x
+
+    def is_processed(self, processed_files, account, container, object_name,
+                     size):
+        """
+        :returns: True if every plugin reading the container has processed
+                  the object (all of its byte ranges, if it is split).
+        """
+        for plugin_name, data in self.plugins.items():
+            if data['swift_account'] != account or \
+                    data['container_name'] != container:
+                continue
+            x = (plugin_name, account, container, object_name)
+            if x in processed_files:
+                continue
+            if self.range_split_size and \
+                    size > self.range_split_size and \
+                    not object_name.endswith('.gz'):
+                if all(x + (byte_range,) in processed_files
+                       for byte_range in self.split_byte_ranges(size)):
+                    continue
+            return False
+        return True
+
+    def split_byte_ranges(self, size):
+        """
+        :returns: a list of (start, end) byte ranges covering an object of
+                  the given size, each range_split_size bytes long except
+                  the last one.
+        """
+        return [(start, min(start + self.range_split_size, size))
+                for start in xrange(0, size, self.range_split_size)]
 
     def generate_keylist_mapping(self):
         keylist = {}
@@ -112,6 +317,18 @@ class LogProcessor(LogProcessorCommon):
         return keylist
 
 
+def get_output_row(hour, values):
+    """
+    :param hour: (account, year, month, day, hour) key of the row
+    :param values: values of the output fields, in sorted field order
+    :returns: the row of the csv file
+    """
+    account, year, month, day, hour = hour
+    data_ts = '%04d/%02d/%02d %02d:00:00' % \
+        (int(year), int(month), int(day), int(hour))
+    return [data_ts, '%s' % (account)] + [str(v) for v in values]
+
+
 class LogProcessorDaemon(Daemon):
     """
     Gather raw log data and farm proccessing to generate a csv that is
@@ -131,8 +348,51 @@ class LogProcessorDaemon(Daemon):
         self.log_processor_container = c.get('container_name',
                                              'log_processing_data')
         self.worker_count = int(c.get('worker_count', '1'))
+        self.listing_concurrency = int(c.get('listing_concurrency', '0'))
         self._keylist_mapping = None
         self.processed_files_filename = 'processed_files.pickle.gz'
+        self.partition_processed_files = c.get('partition_processed_files',
+                                               'false').lower() in TRUE_VALUES
+        self.processed_files_prefix = 'processed_files/'
+        self.compact_processed_files = c.get('compact_processed_files',
+                                             'false').lower() in TRUE_VALUES
+        self.listing_checkpoint = \
+            c.get('listing_checkpoint', 'false').lower() in TRUE_VALUES
+        self.listing_resync_hours = int(c.get('listing_resync_hours', '24'))
+        self.listing_checkpoint_filename = 'listing_checkpoint.pickle.gz'
+        self.combine_worker_results = \
+            c.get('combine_worker_results', 'false').lower() in TRUE_VALUES
+        self.combine_worker_max_files = \
+            int(c.get('combine_worker_max_files', '1000'))
+        self.pack_worker_results = \
+            c.get('pack_worker_results', 'false').lower() in TRUE_VALUES
+        self.dense_aggregates = \
+            c.get('dense_aggregates', 'false').lower() in TRUE_VALUES
+        self.numpy_output = \
+            c.get('numpy_output', 'false').lower() in TRUE_VALUES
+        self.reduce_max_rows = int(c.get('reduce_max_rows', '0'))
+        self.reduce_spill_dir = c.get('reduce_spill_dir') or None
+        self.checkpoint_interval = int(c.get('checkpoint_interval', '0'))
+        self.run_checkpoint_filename = 'run_checkpoint.pickle.gz'
+        if self.numpy_output and aggregation.numpy is None:
+            self.logger.warning(_('numpy_output is set but NumPy is not '
+                                  'installed'))
+        self.item_timeout = int(c.get('item_timeout', '0'))
+        self.item_retries = int(c.get('item_retries', '1'))
+        self.worker_concurrency = int(c.get('worker_concurrency', '1'))
+        self.executor = c.get('executor', 'process')
+        self.collate_func = get_collate_func(self.executor)
+        self.shard_count = int(c.get('shard_count', '1'))
+        self.shard_index = int(c.get('shard_index', '0'))
+        if not 0 <= self.shard_index < max(self.shard_count, 1):
+            raise ValueError(_('shard_index must be less than shard_count'))
+        self.partials_prefix = 'partials/'
+        if self.shard_count > 1:
+            # every shard lists its own part of the logs
+            self.listing_checkpoint_filename = \
+                'listing_checkpoint.%d.pickle.gz' % self.shard_index
+            self.run_checkpoint_filename = \
+                'run_checkpoint.%d.pickle.gz' % self.shard_index
 
     def get_lookback_interval(self):
         """
@@ -193,17 +453,26 @@ class LogProcessorDaemon(Daemon):
                 files = set()
             else:
                 return None
+        if self.compact_processed_files and not isinstance(files, HashedSet):
+            files = HashedSet(files)
         return files
 
-    def get_aggregate_data(self, processed_files, input_data):
+    def get_aggregate_data(self, processed_files, input_data,
+                           aggr_data=None):
         """
         Aggregates stats data by account/hour, summing as needed.
 
         :param processed_files: set of processed files
-        :param input_data: is the output from multiprocess_collate/the plugins.
+        :param input_data: is the output from collate_func/the plugins.
+                           An item may also be a list of the items whose
+                           results were already merged by a worker, and
+                           the data a PackedAggregate.
+        :param aggr_data: aggregate from new_aggregate to merge into, a new
+                          one if None
 
         :returns: A dict containing data aggregated from the input_data
-        passed in.
+        passed in, or with dense_aggregates, a DenseAggregate of it. If it
+        had more than reduce_max_rows rows, a SpillingAggregate of it.
 
             The dict returned has tuple keys of the form:
                 (account, year, month, day, hour)
@@ -222,21 +491,34 @@ class LogProcessorDaemon(Daemon):
             input_data are summed in the dict returned.
         """
 
-        aggr_data = {}
+        if aggr_data is None:
+            aggr_data = self.new_aggregate()
         for item, data in input_data:
             # since item contains the plugin and the log name, new plugins will
             # "reprocess" the file and the results will be in the final csv.
-            processed_files.add(item)
-            for k, d in data.items():
-                existing_data = aggr_data.get(k, {})
-                for i, j in d.items():
-                    current = existing_data.get(i, 0)
-                    # merging strategy for key collisions is addition
-                    # processing plugins need to realize this
-                    existing_data[i] = current + j
-                aggr_data[k] = existing_data
+            if isinstance(item, list):
+                processed_files.update(plain_item(x) for x in item)
+            else:
+                processed_files.add(plain_item(item))
+            merge_aggregates(aggr_data, data)
+        if isinstance(aggr_data, SpillingAggregate):
+            aggr_data = aggr_data.finish()
         return aggr_data
 
+    def new_aggregate(self):
+        """
+        :returns: an empty aggregate to reduce results into with
+                  merge_aggregates
+        """
+        if self.dense_aggregates:
+            klass = DenseAggregate
+        else:
+            klass = dict
+        if self.reduce_max_rows > 0:
+            return SpillingAggregate(self.reduce_max_rows, klass,
+                                     self.reduce_spill_dir)
+        return klass()
+
     def get_final_info(self, aggr_data):
         """
         Aggregates data from aggr_data based on the keylist mapping.
@@ -253,82 +535,175 @@ class LogProcessorDaemon(Daemon):
             Data is aggregated as specified by the keylist mapping. The
             keylist mapping specifies which keys to combine in aggr_data
             and the final field_names for these combined keys in the dict
-            returned. Fields combined are summed.
-        """
-
-        final_info = collections.defaultdict(dict)
-        for account, data in aggr_data.items():
-            for key, mapping in self.keylist_mapping.items():
-                if isinstance(mapping, (list, set)):
-                    value = 0
-                    for k in mapping:
-                        try:
-                            value += data[k]
-                        except KeyError:
-                            pass
-                else:
-                    try:
-                        value = data[mapping]
-                    except KeyError:
-                        value = 0
-                final_info[account][key] = value
-        return final_info
+            returned. Fields combined are summed. The mapping is compiled
+            into an index of the fields each key is summed into, so only
+            the keys each row has are looked up.
+        """
+
+        return KeylistIndex(self.keylist_mapping).apply(aggr_data)
+
+    def iter_final_info(self, aggr_data):
+        """
+        Like get_final_info, but returns an iterator of (hour, dict of
+        field_name: field_value) sorted by hour. A SpillingAggregate is read
+        back one hour at a time, and closed once read.
+        """
+
+        index = KeylistIndex(self.keylist_mapping)
+        if isinstance(aggr_data, SpillingAggregate):
+            try:
+                for hour, stats in aggr_data.iteritems():
+                    yield hour, index.apply_stats(stats)
+            finally:
+                aggr_data.close()
+            return
+        final_info = index.apply(aggr_data)
+        for hour in sorted(final_info):
+            yield hour, final_info[hour]
+
+    def get_processed_files(self, start_date=None, end_date=None):
+        """
+        :param start_date: start of the lookback interval, see
+                           get_lookback_interval
+        :param end_date: end of the lookback interval
+        :returns: the files that have already been processed or None on
+                  error.
+
+            With partition_processed_files, this is a ProcessedFiles that
+            keeps a partition per day of logs and has the days of the
+            lookback interval loaded. Otherwise it is the set from
+            get_processed_files_list.
+        """
+        if not self.partition_processed_files:
+            return self.get_processed_files_list()
+        processed_files = ProcessedFiles(self.log_processor,
+                                         self.log_processor_account,
+                                         self.log_processor_container,
+                                         self.processed_files_prefix,
+                                         self.processed_files_filename,
+                                         self.compact_processed_files)
+        if not processed_files.load(start_date, end_date):
+            return None
+        return processed_files
 
     def store_processed_files_list(self, processed_files):
         """
         Stores the proccessed files list in the stats account.
 
-        :param processed_files: set of processed files
+        :param processed_files: set of processed files, or a ProcessedFiles
+                                to store the changed partitions of
+        :returns: True if successful, False otherwise
         """
+        if isinstance(processed_files, ProcessedFiles):
+            return processed_files.store()
 
         s = cPickle.dumps(processed_files, cPickle.HIGHEST_PROTOCOL)
         f = cStringIO.StringIO(s)
-        self.log_processor.internal_proxy.upload_file(f,
+        return self.log_processor.internal_proxy.upload_file(f,
             self.log_processor_account,
             self.log_processor_container,
             self.processed_files_filename)
 
-    def get_output(self, final_info):
+    def iter_output(self, final_info):
         """
-        :returns: a list of rows to appear in the csv file.
+        :param final_info: the results of get_final_info, or an iterator of
+                           (hour, final info) sorted by hour like
+                           iter_final_info returns
+        :returns: an iterator of the rows to appear in the csv file.
 
             The first row contains the column headers for the rest of the
-            rows in the returned list.
+            rows.
 
             Each row after the first row corresponds to an account's data
-            for that hour.
+            for that hour. The rows are sorted by account and hour.
         """
 
         sorted_keylist_mapping = sorted(self.keylist_mapping)
-        columns = ['data_ts', 'account'] + sorted_keylist_mapping
-        output = [columns]
-        for (account, year, month, day, hour), d in final_info.items():
-            data_ts = '%04d/%02d/%02d %02d:00:00' % \
-                (int(year), int(month), int(day), int(hour))
-            row = [data_ts, '%s' % (account)]
-            for k in sorted_keylist_mapping:
-                row.append(str(d[k]))
-            output.append(row)
-        return output
+        yield ['data_ts', 'account'] + sorted_keylist_mapping
+        if isinstance(final_info, dict):
+            rows = ((hour, final_info[hour]) for hour in sorted(final_info))
+        else:
+            rows = final_info
+        for hour, d in rows:
+            values = [d[k] for k in sorted_keylist_mapping]
+            yield get_output_row(hour, values)
+
+    def get_output(self, final_info):
+        """
+        :returns: a list of rows to appear in the csv file, see
+                  iter_output.
+        """
+        return list(self.iter_output(final_info))
+
+    def iter_numpy_output(self, aggr_data):
+        """
+        Applies the keylist mapping to aggr_data with NumPy, see
+        KeylistIndex.apply_numpy, for the same rows iter_output would give.
+
+        :returns: an iterator of the rows to appear in the csv file, or None
+                  if NumPy can not be used for aggr_data.
+        """
+        index = KeylistIndex(self.keylist_mapping)
+        result = index.apply_numpy(aggr_data)
+        if result is None:
+            return None
+        hours, values = result
+        return itertools.chain([['data_ts', 'account'] + index.fields],
+                               (get_output_row(hour, row.tolist())
+                                for hour, row in itertools.izip(hours,
+                                                                values)))
+
+    def spool_output(self, output):
+        """
+        Writes the rows of the csv file to a temporary file as they come,
+        which only stays in memory up to OUTPUT_SPOOL_SIZE bytes.
+
+        :param output: list or iterator of rows to appear in the csv file
+        :returns: the temporary file, positioned at its start, and the name
+                  to upload it as
+        """
 
-    def store_output(self, output):
+        h = hashlib.md5()
+        f = tempfile.SpooledTemporaryFile(max_size=OUTPUT_SPOOL_SIZE)
+        separator = ''
+        for row in output:
+            line = separator + ','.join(row)
+            h.update(line)
+            f.write(line)
+            separator = '\n'
+        f.seek(0)
+        upload_name = time.strftime('%Y/%m/%d/%H/') + \
+            '%s.csv.gz' % h.hexdigest()
+        return f, upload_name
+
+    def store_output(self, output, upload_name=None):
         """
-        Takes the a list of rows and stores a csv file of the values in the
-        stats account.
+        Takes the rows and stores a csv file of the values in the stats
+        account.
 
-        :param output: list of rows to appear in the csv file
+        :param output: list or iterator of rows to appear in the csv file,
+                       or a file from spool_output
+        :param upload_name: the name from spool_output, if output is a file
 
             This csv file is final product of this script.
+
+            The csv is uploaded (compressed on the fly) from the file
+            spool_output writes it to.
+
+        :returns: True if successful, False otherwise
         """
 
-        out_buf = '\n'.join([','.join(row) for row in output])
-        h = hashlib.md5(out_buf).hexdigest()
-        upload_name = time.strftime('%Y/%m/%d/%H/') + '%s.csv.gz' % h
-        f = cStringIO.StringIO(out_buf)
-        self.log_processor.internal_proxy.upload_file(f,
-            self.log_processor_account,
-            self.log_processor_container,
-            upload_name)
+        if upload_name is None:
+            f, upload_name = self.spool_output(output)
+        else:
+            f = output
+        try:
+            return self.log_processor.internal_proxy.upload_file(f,
+                self.log_processor_account,
+                self.log_processor_container,
+                upload_name)
+        finally:
+            f.close()
 
     @property
     def keylist_mapping(self):
@@ -344,40 +719,375 @@ class LogProcessorDaemon(Daemon):
                 self.log_processor.generate_keylist_mapping()
         return self._keylist_mapping
 
-    def process_logs(self, logs_to_process, processed_files):
+    def aggregate_logs(self, logs_to_process, processed_files,
+                       resume_data=None, worker_stats=None):
+        """
+        Processes logs and aggregates their stats by account/hour.
+
+        :param logs_to_process: list of logs to process
+        :param processed_files: set of processed files
+        :param resume_data: aggregated data of a run checkpoint to resume
+                            from, see resume_run_checkpoint
+        :param worker_stats: optional dict that the stats of each worker are
+                             added up in, see log_common.pop_worker_stats
+
+        :returns: the aggregated data, see get_aggregate_data.
+
+            Files processed are added to the processed_files set. Files that
+            failed or whose worker hung or died are left out of it, so they
+            are tried again on the next run.
+
+            With checkpoint_interval set, processed_files and the data
+            aggregated so far are stored as a run checkpoint every
+            checkpoint_interval seconds, so processed_files should only
+            hold the files of this run (and of the checkpoint resumed).
+        """
+
+        # map
+        processor_args = (self.total_conf, self.logger)
+        if self.combine_worker_results:
+            # workers merge their own results before sending them
+            combine_func = merge_aggregates
+        else:
+            combine_func = None
+        if self.pack_worker_results:
+            encode_func = PackedAggregate.from_dict
+        else:
+            encode_func = None
+        failed_items = []
+        if worker_stats is None:
+            worker_stats = {}
+        results = self.collate_func(LogProcessor, processor_args,
+                                    'process_one_file', logs_to_process,
+                                    self.worker_count,
+                                    combine_func=combine_func,
+                                    combine_count=
+                                        self.combine_worker_max_files,
+                                    encode_func=encode_func,
+                                    failed_items=failed_items,
+                                    item_timeout=self.item_timeout,
+                                    item_retries=self.item_retries,
+                                    concurrency=self.worker_concurrency,
+                                    worker_stats=worker_stats)
+
+        # reduce
+        aggr_data = None
+        if self.checkpoint_interval > 0:
+            aggr_data = self.new_aggregate()
+            if resume_data:
+                merge_stored_aggregate(aggr_data, resume_data)
+            del resume_data
+            results = self.iter_run_checkpoints(results, processed_files,
+                                                aggr_data)
+        aggr_data = self.get_aggregate_data(processed_files, results,
+                                            aggr_data)
+        del results
+        if failed_items:
+            self.logger.error(_('%d files could not be processed and will '
+                                'be retried on the next run') %
+                              len(failed_items))
+        log_worker_stats(self.logger, worker_stats)
+        return aggr_data
+
+    def process_logs(self, logs_to_process, processed_files,
+                     resume_data=None, worker_stats=None):
         """
         :param logs_to_process: list of logs to process
         :param processed_files: set of processed files
+        :param resume_data: see aggregate_logs
+        :param worker_stats: see aggregate_logs
 
-        :returns: returns a list of rows of processed data.
+        :returns: returns an iterator of the rows of processed data.
 
             The first row is the column headers. The rest of the rows contain
             hourly aggregate data for the account specified in the row.
 
-            Files processed are added to the processed_files set.
+            Files processed are added to the processed_files set, see
+            aggregate_logs.
 
             When a large data structure is no longer needed, it is deleted in
             an effort to conserve memory.
         """
 
-        # map
-        processor_args = (self.total_conf, self.logger)
-        results = multiprocess_collate(LogProcessor, processor_args,
-                                       'process_one_file', logs_to_process,
-                                       self.worker_count)
+        # map and reduce
+        aggr_data = self.aggregate_logs(logs_to_process, processed_files,
+                                        resume_data, worker_stats)
 
-        # reduce
-        aggr_data = self.get_aggregate_data(processed_files, results)
-        del results
+        # group and output
+        return self.iter_aggregate_output(aggr_data)
 
-        # group
+    def iter_aggregate_output(self, aggr_data):
+        """
+        Groups aggr_data by the keylist mapping into the rows of the csv
+        file, with NumPy if numpy_output is set and it can be used.
+
+        :param aggr_data: the results of get_aggregate_data
+        :returns: an iterator of the rows to appear in the csv file.
+        """
+
+        if isinstance(aggr_data, SpillingAggregate):
+            # read back from disk in hour order
+            return self.iter_output(self.iter_final_info(aggr_data))
+        if self.numpy_output:
+            # group and output in one go
+            output = self.iter_numpy_output(aggr_data)
+            if output is not None:
+                return output
         # reduce a large number of keys in aggr_data[k] to a small
         # number of output keys
-        final_info = self.get_final_info(aggr_data)
-        del aggr_data
+        return self.iter_output(self.get_final_info(aggr_data))
 
-        # output
-        return self.get_output(final_info)
+    def iter_run_checkpoints(self, results, files, aggr_data):
+        """
+        Passes results through, storing a run checkpoint of files and
+        aggr_data every checkpoint_interval seconds. Each result is merged
+        into files and aggr_data before the next one is asked for, so a
+        checkpoint holds exactly the results passed through before it.
+        """
+        last_checkpoint = time.time()
+        for result in results:
+            if time.time() - last_checkpoint >= self.checkpoint_interval:
+                if self.store_run_checkpoint(files, aggr_data):
+                    self.logger.debug(_('Stored a run checkpoint of %d '
+                                        'files') % len(files))
+                else:
+                    self.logger.error(_('Unable to store the run '
+                                        'checkpoint'))
+                last_checkpoint = time.time()
+            yield result
+
+    def get_run_checkpoint(self):
+        """
+        :returns: the (files, aggregated data, output name) of the run
+                  checkpoint, (set(), None, None) if there is none, or
+                  None on error. The aggregated data can be the rows
+                  load_state read, see merge_stored_aggregate.
+        """
+        try:
+            return load_state(self.log_processor.get_object_chunks(
+                                  self.log_processor_account,
+                                  self.log_processor_container,
+                                  self.run_checkpoint_filename,
+                                  compressed=True))
+        except BadFileDownload, err:
+            if err.status_code == 404:
+                return set(), None, None
+            return None
+
+    def store_run_checkpoint(self, files, aggr_data, output_name=None):
+        """
+        Stores the files a run processed so far and their aggregated data,
+        or once the run is storing its output, the files and the name of
+        the output.
+
+        :returns: True if successful, False otherwise
+        """
+        f = spool_state((files, aggr_data, output_name))
+        try:
+            return self.log_processor.internal_proxy.upload_file(f,
+                self.log_processor_account,
+                self.log_processor_container,
+                self.run_checkpoint_filename)
+        finally:
+            f.close()
+
+    def delete_run_checkpoint(self):
+        """
+        :returns: True if successful, False otherwise
+        """
+        return self.log_processor.internal_proxy.delete_object(
+            self.log_processor_account,
+            self.log_processor_container,
+            self.run_checkpoint_filename)
+
+    def resume_run_checkpoint(self, processed_files):
+        """
+        Loads the run checkpoint of an interrupted run.
+
+        A checkpoint whose files are all in processed_files was committed
+        by its run. One that names an output was stored by a run that was
+        storing its output: if the output exists, the run died before
+        storing its processed files, which is done now; if it does not, its
+        files are processed again; if that can not be told, the run is
+        stopped.
+
+        :param processed_files: set of processed files
+        :returns: the files and aggregated data to resume from, (set(),
+                  None) if there is nothing to resume, or None on error.
+        """
+        checkpoint = self.get_run_checkpoint()
+        if checkpoint is None:
+            return None
+        files, aggr_data, output_name = checkpoint
+        if not files or all(x in processed_files for x in files):
+            return set(), None
+        if output_name is None:
+            return files, aggr_data
+        status_code, _junk = self.log_processor.internal_proxy.head_object(
+            self.log_processor_account,
+            self.log_processor_container,
+            output_name)
+        if status_code == 404:
+            return set(), None
+        if not 200 <= status_code < 300:
+            # the output may be stored, it must not be output again
+            self.logger.error(_('Unable to check whether %(name)s was '
+                                'stored (%(status)s)') %
+                              {'name': output_name, 'status': status_code})
+            return None
+        self.logger.info(_('Storing the processed files of the run '
+                           'that stored %s') % output_name)
+        processed_files.update(files)
+        if not self.store_processed_files_list(processed_files):
+            return None
+        self.delete_run_checkpoint()
+        return set(), None
+
+    def store_run(self, output, processed_files, run_files):
+        """
+        Stores the output of a checkpointed run and adds the files it
+        processed to the processed files list, then deletes its run
+        checkpoint.
+
+        Before the output is uploaded, the run checkpoint is replaced by
+        one naming the output, so that resume_run_checkpoint knows whether
+        the output was stored and never outputs the same files twice.
+
+        :param output: list or iterator of rows to appear in the csv file
+        :param processed_files: set of processed files
+        :param run_files: the files of the output
+        :returns: True if successful, False otherwise
+        """
+        f, upload_name = self.spool_output(output)
+        if not self.store_run_checkpoint(run_files, None, upload_name):
+            f.close()
+            return False
+        if not self.store_output(f, upload_name):
+            return False
+        processed_files.update(run_files)
+        if not self.store_processed_files_list(processed_files):
+            return False
+        self.delete_run_checkpoint()
+        return True
+
+    def in_shard(self, item):
+        """
+        :returns: True if the work item is processed by this shard.
+        """
+        return self.shard_count <= 1 or get_shard(item[1], item[2], item[3],
+                                          self.shard_count) == self.shard_index
+
+    def get_partial(self, object_name):
+        """
+        :returns: the (processed files, aggregated data) a shard stored in
+                  object_name, or None on error. The aggregated data can be
+                  the rows load_state read, see merge_stored_aggregate.
+        """
+        try:
+            return load_state(self.log_processor.get_object_chunks(
+                                  self.log_processor_account,
+                                  self.log_processor_container,
+                                  object_name, compressed=True))
+        except BadFileDownload:
+            return None
+
+    def list_partials(self, shard_index=None):
+        """
+        :returns: the names of the partial aggregates waiting to be merged,
+                  all of them or those of one shard.
+        """
+        prefix = self.partials_prefix
+        if shard_index is not None:
+            prefix += '%d/' % shard_index
+        listing = self.log_processor.internal_proxy.get_container_list(
+                      self.log_processor_account,
+                      self.log_processor_container,
+                      prefix=prefix)
+        return [x['name'] for x in listing]
+
+    def get_unmerged_files(self):
+        """
+        :returns: the set of files this shard processed that are not merged
+                  into the processed files list yet, or None on error.
+        """
+        files = set()
+        for name in self.list_partials(self.shard_index):
+            partial = self.get_partial(name)
+            if partial is None:
+                return None
+            files.update(partial[0])
+        return files
+
+    def store_partial(self, processed_files, aggr_data):
+        """
+        Stores the files this shard processed and their aggregated data for
+        merge_partials.
+
+        :returns: True if successful, False otherwise
+        """
+        f = spool_state((processed_files, aggr_data))
+        try:
+            return self.log_processor.internal_proxy.upload_file(f,
+                self.log_processor_account,
+                self.log_processor_container,
+                '%s%d/%.5f.pickle.gz' % (self.partials_prefix,
+                                         self.shard_index, time.time()))
+        finally:
+            f.close()
+            if isinstance(aggr_data, SpillingAggregate):
+                aggr_data.close()
+
+    def merge_partials(self):
+        """
+        Merges the partial aggregates the shards stored into a csv file and
+        the processed files list, like an unsharded run would have stored
+        them, and deletes the partials.
+
+        Partials whose files are all in the processed files list were
+        already merged by a run that did not get to delete them, and are
+        only deleted.
+        """
+        processed_files = self.get_processed_files()
+        if processed_files == None:
+            self.logger.error(_('Log processing unable to load list of '
+                'already processed log files'))
+            return
+        aggr_data = self.new_aggregate()
+        merged = []
+        files_changed = False
+        for name in self.list_partials():
+            partial = self.get_partial(name)
+            if partial is None:
+                self.logger.error(_('Unable to load partial %s') % name)
+                continue
+            files, data = partial
+            merged.append(name)
+            if all(x in processed_files for x in files):
+                continue
+            processed_files.update(files)
+            files_changed = True
+            merge_stored_aggregate(aggr_data, data)
+            del data
+        if isinstance(aggr_data, SpillingAggregate):
+            aggr_data = aggr_data.finish()
+        self.logger.info(_('merging %d partials') % len(merged))
+        if aggr_data:
+            output = self.iter_aggregate_output(aggr_data)
+            del aggr_data
+            if not self.store_output(output):
+                self.logger.error(_('Unable to store the merged output'))
+                return
+        # even files without stats must not be processed again once their
+        # partials are deleted
+        if files_changed and \
+                not self.store_processed_files_list(processed_files):
+            self.logger.error(_('Unable to store the processed files list'))
+            return
+        for name in merged:
+            if not self.log_processor.internal_proxy.delete_object(
+                    self.log_processor_account,
+                    self.log_processor_container, name):
+                self.logger.error(_('Unable to delete partial %s') % name)
 
     def run_once(self, *args, **kwargs):
         """
@@ -386,6 +1096,10 @@ class LogProcessorDaemon(Daemon):
         Upload resulting csv file to stats account.
 
         Update processed files list and upload to stats account.
+
+        With shard_count set, only this shard's part of the log files is
+        processed, and the stats and processed files are uploaded as a
+        partial aggregate instead, for a run with merge_shards to merge.
         """
 
         for k in 'lookback_hours lookback_window'.split():
@@ -393,31 +1107,188 @@ class LogProcessorDaemon(Daemon):
                 setattr(self, k, kwargs[k])
 
         start = time.time()
+        if kwargs.get('merge_shards'):
+            self.logger.info(_("Beginning merge of shard partials"))
+            try:
+                self.merge_partials()
+            except BadFileDownload, err:
+                self.logger.error(_('Merge unable to download the processed '
+                    'files list (%s)') % err.status_code)
+                return
+            self.logger.info(_("Merge done (%0.2f minutes)") %
+                ((time.time() - start) / 60))
+            return
         self.logger.info(_("Beginning log processing"))
+        try:
+            if not self.process_lookback_interval():
+                return
+        except BadFileDownload, err:
+            # a day of the processed files list that was only needed
+            # once the run was under way
+            self.logger.error(_('Log processing unable to download the '
+                'processed files list (%s)') % err.status_code)
+            return
+        self.logger.info(_("Log processing done (%0.2f minutes)") %
+            ((time.time() - start) / 60))
 
+    def process_lookback_interval(self):
+        """
+        Processes the log files of the lookback interval, see run_once.
+
+        :returns: True if the run was done, False if it was stopped
+        :raises BadFileDownload: if a day of the processed files list could
+                                 not be downloaded when it was needed
+        """
         lookback_start, lookback_end = self.get_lookback_interval()
         self.logger.debug('lookback_start: %s' % lookback_start)
         self.logger.debug('lookback_end: %s' % lookback_end)
 
-        processed_files = self.get_processed_files_list()
+        sharded = self.shard_count > 1
+        if sharded:
+            # files processed by earlier runs of this shard that are not
+            # merged yet must not be processed again. They are read before
+            # the processed files list: a merge in between adds them to the
+            # list before it deletes the partials, so they are in one or the
+            # other
+            unmerged_files = self.get_unmerged_files()
+            if unmerged_files is None:
+                self.logger.error(_('Log processing unable to load the '
+                    'unmerged partials of shard %d') % self.shard_index)
+                return False
+        processed_files = self.get_processed_files(lookback_start,
+                                                   lookback_end)
         if processed_files == None:
             self.logger.error(_('Log processing unable to load list of '
                 'already processed log files'))
-            return
+            return False
         self.logger.debug(_('found %d processed files') %
             len(processed_files))
-
-        logs_to_process = self.log_processor.get_data_list(lookback_start,
-            lookback_end, processed_files)
-        self.logger.info(_('loaded %d files to process') %
-            len(logs_to_process))
-
-        if logs_to_process:
-            output = self.process_logs(logs_to_process, processed_files)
-            self.store_output(output)
-            del output
-
-            self.store_processed_files_list(processed_files)
-
-        self.logger.info(_("Log processing done (%0.2f minutes)") %
-            ((time.time() - start) / 60))
+        if sharded:
+            processed_files.update(unmerged_files)
+
+        resume_files, resume_data = set(), None
+        if self.checkpoint_interval > 0:
+            resume = self.resume_run_checkpoint(processed_files)
+            if resume is None:
+                self.logger.error(_('Log processing unable to load the run '
+                    'checkpoint'))
+                return False
+            resume_files, resume_data = resume
+            if resume_files:
+                # not listed again, their stats are in resume_data
+                self.logger.info(_('Resuming the run checkpoint of %d '
+                    'processed files') % len(resume_files))
+                processed_files.update(resume_files)
+
+        checkpoint = None
+        if self.listing_checkpoint:
+            checkpoint = self.log_processor.get_listing_checkpoint(
+                self.log_processor_account,
+                self.log_processor_container,
+                self.listing_checkpoint_filename,
+                self.listing_resync_hours * 3600)
+            if checkpoint.full_listing:
+                self.logger.info(_('Listing the whole lookback interval'))
+
+        if self.listing_concurrency:
+            # start processing while the listing is still in progress
+            logs_to_process = self.log_processor.iter_data_list(
+                lookback_start, lookback_end, processed_files,
+                self.listing_concurrency, checkpoint)
+            if sharded:
+                logs_to_process = itertools.ifilter(self.in_shard,
+                                                    logs_to_process)
+            first_log = next(logs_to_process, None)
+            if first_log is not None:
+                logs_to_process = itertools.chain([first_log],
+                                                  logs_to_process)
+            else:
+                logs_to_process = []
+            makespan = None
+        else:
+            item_sizes = {}
+            logs_to_process = self.log_processor.get_data_list(
+                lookback_start, lookback_end, processed_files, checkpoint,
+                item_sizes)
+            if sharded:
+                logs_to_process = filter(self.in_shard, logs_to_process)
+            self.logger.info(_('loaded %d files to process') %
+                len(logs_to_process))
+            logs_to_process, makespan = schedule_largest_first(
+                logs_to_process, item_sizes, self.worker_count)
+            total_bytes = sum(item_sizes.itervalues())
+
+        if logs_to_process or resume_files:
+            processed_count = len(processed_files)
+            process_start = time.time()
+            worker_stats = {}
+            if sharded:
+                shard_files = set(resume_files)
+                aggr_data = self.aggregate_logs(logs_to_process, shard_files,
+                                                resume_data,
+                                                worker_stats=worker_stats)
+            elif self.checkpoint_interval > 0:
+                run_files = set(resume_files)
+                output = self.process_logs(logs_to_process, run_files,
+                                           resume_data,
+                                           worker_stats=worker_stats)
+            else:
+                output = self.process_logs(logs_to_process, processed_files,
+                                           worker_stats=worker_stats)
+            del resume_data
+            if makespan:
+                # compare the expected balance of the work between the
+                # workers with what the busiest one did, to help tune
+                # worker_count
+                max_bytes, max_busy = max_worker_load(worker_stats)
+                self.logger.info(_('Processed %(bytes)d bytes with '
+                    '%(workers)d workers in %(elapsed).2fs: predicted '
+                    'makespan %(makespan)d bytes per worker (ideal '
+                    '%(ideal)d), busiest worker %(max_bytes)d bytes in '
+                    '%(max_busy).2fs') %
+                    {'bytes': total_bytes, 'workers': self.worker_count,
+                     'elapsed': time.time() - process_start,
+                     'makespan': makespan,
+                     'ideal': total_bytes / max(self.worker_count, 1),
+                     'max_bytes': max_bytes, 'max_busy': max_busy})
+            if sharded:
+                if shard_files and \
+                        not self.store_partial(shard_files, aggr_data):
+                    self.logger.error(_('Unable to store the partial of '
+                        'shard %d') % self.shard_index)
+                    shard_files = set()
+                elif self.checkpoint_interval > 0:
+                    # the partial holds the files of the checkpoint now
+                    self.delete_run_checkpoint()
+                del aggr_data
+                processed_files.update(shard_files)
+            elif self.checkpoint_interval > 0:
+                if not self.store_run(output, processed_files, run_files):
+                    self.logger.error(_('Unable to store the output of the '
+                        'run'))
+                    # the listing must not move past them
+                    checkpoint = None
+                del output
+            else:
+                self.store_output(output)
+                del output
+
+                self.store_processed_files_list(processed_files)
+            self.logger.info(_('processed %d files') %
+                (len(processed_files) - processed_count))
+
+        if checkpoint is not None:
+            def is_processed(account, container, object_name, size):
+                if sharded and get_shard(account, container, object_name,
+                        self.shard_count) != self.shard_index:
+                    # another shard's
+                    return True
+                return self.log_processor.is_processed(processed_files,
+                    account, container, object_name, size)
+            checkpoint.advance(is_processed)
+            if not self.log_processor.store_listing_checkpoint(checkpoint,
+                    self.log_processor_account,
+                    self.log_processor_container,
+                    self.listing_checkpoint_filename):
+                self.logger.error(_('Unable to store the listing checkpoint'))
+        return True
@@ -0,0 +1,180 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import errno
+import fcntl
+import time
+import hashlib
+from tempfile import mkstemp
+from contextlib import contextmanager
+
+# temp files older than this were left behind by a dead process
+STALE_TEMP_AGE = 3600
+
+
+class ObjectCache(object):
+    """
+    A local on-disk cache of log objects with a size budget and least
+    recently used eviction.
+
+    Entries are the raw (still compressed, if the object is) object data and
+    are keyed by account, container, object name and etag, so a re-uploaded
+    object never matches an old entry. The cache directory can be shared by
+    any number of processes: entries are written to a temp file and renamed
+    into place, and eviction is serialized with a lock file.
+
+    :param cache_dir: directory to keep the cached objects in
+    :param max_bytes: size budget of the cache
+    :param logger: logger to log cache activity to
+    :param chunk_size: size of the chunks read back from the cache
+    """
+
+    def __init__(self, cache_dir, max_bytes, logger, chunk_size=65536):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.stats = {'hits': 0, 'misses': 0, 'hit_bytes': 0,
+                      'miss_bytes': 0, 'evictions': 0}
+        try:
+            os.makedirs(cache_dir)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+
+    def _key(self, account, container, object_name):
+        return hashlib.md5('/'.join((account, container,
+                                     object_name))).hexdigest()
+
+    def _path(self, account, container, object_name, etag):
+        return os.path.join(self.cache_dir, '%s.%s' %
+                            (self._key(account, container, object_name),
+                             etag.strip('"')))
+
+    @contextmanager
+    def _lock(self):
+        fd = os.open(os.path.join(self.cache_dir, '.lock'),
+                     os.O_WRONLY | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def get(self, account, container, object_name, etag):
+        """
+        :returns: an iterator of the cached data of the object, or None if
+                  the object is not in the cache.
+        """
+        path = self._path(account, container, object_name, etag)
+        try:
+            f = open(path, 'rb')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            self.stats['misses'] += 1
+            return None
+        # mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.stats['hits'] += 1
+        return self._read(f)
+
+    def _read(self, f):
+        try:
+            for chunk in iter(lambda: f.read(self.chunk_size), ''):
+                self.stats['hit_bytes'] += len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+    def put(self, account, container, object_name, etag, chunks):
+        """
+        Yields the chunks of an object while writing them to the cache.
+
+        The entry is only added to the cache once every chunk has been read,
+        so a failed or abandoned download never leaves a truncated entry.
+        """
+        fd, tmp_path = mkstemp(dir=self.cache_dir, suffix='.tmp')
+        complete = False
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            self.stats['miss_bytes'] += size
+            if complete:
+                self._add(account, container, object_name, etag, tmp_path)
+            else:
+                os.unlink(tmp_path)
+
+    def _add(self, account, container, object_name, etag, tmp_path):
+        path = self._path(account, container, object_name, etag)
+        prefix = self._key(account, container, object_name) + '.'
+        with self._lock():
+            for name in os.listdir(self.cache_dir):
+                # entries for older versions of the object are useless now
+                if name.startswith(prefix) and not name.endswith('.tmp'):
+                    self._unlink(os.path.join(self.cache_dir, name))
+            os.rename(tmp_path, path)
+            self._evict()
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def _evict(self):
+        """
+        Removes the least recently used entries until the cache is within its
+        size budget. Must be called with the cache lock held.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name == '.lock':
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError, err:
+                if err.errno == errno.ENOENT:
+                    continue
+                raise
+            if name.endswith('.tmp'):
+                if now - st.st_mtime > STALE_TEMP_AGE:
+                    self._unlink(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # readers that already opened the entry can still finish it
+            self._unlink(path)
+            total -= size
+            self.stats['evictions'] += 1
+            self.logger.debug(_('Evicted %s from the object cache') % path)
@@ -0,0 +1,407 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+import struct
+import heapq
+import hashlib
+import cPickle
+import cStringIO
+from array import array
+from bisect import bisect_left
+from uuid import uuid4
+
+from slogging.log_common import BadFileDownload
+
+# log object names start with the hour of their logs
+DAY_RE = re.compile(r'^(\d{4})/(\d{2})/(\d{2})/')
+# partition of the files whose name has no date
+OTHER_PARTITION = 'other'
+# array typecode of the hashes of HashedSet, 64 bits on 64 bit platforms
+HASH_TYPECODE = 'L'
+HASH_BITS = array(HASH_TYPECODE).itemsize * 8
+_unpack_hash = struct.Struct(HASH_TYPECODE).unpack
+
+
+class HashedSet(object):
+    """
+    A set of processed files that only keeps a hash of each item, in a
+    sorted array looked up with bisect: 8 bytes per item instead of the
+    hundreds a set of tuples of strings takes, and a pickle that is the
+    array's bytes.
+
+    An item that is not in the set is taken for one that is if their hashes
+    collide, which for n items happens with a probability of n / 2 ** 64 per
+    lookup. Items can not be listed back.
+
+    Added items are kept in a small set and merged into the array in
+    batches, so adding is not linear in the size of the set.
+    """
+
+    def __init__(self, items=()):
+        self.hashes = array(HASH_TYPECODE)
+        self.pending = set()
+        self.update(items)
+
+    @staticmethod
+    def _hash(item):
+        try:
+            key = '\0'.join(item)
+        except TypeError:
+            # items with a byte range
+            key = repr(item)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return _unpack_hash(hashlib.md5(key).digest()[:HASH_BITS / 8])[0]
+
+    def _has_hash(self, h):
+        i = bisect_left(self.hashes, h)
+        return (i < len(self.hashes) and self.hashes[i] == h) or \
+            h in self.pending
+
+    def _merge(self):
+        if self.pending:
+            self.hashes = array(HASH_TYPECODE,
+                                heapq.merge(self.hashes,
+                                            sorted(self.pending)))
+            self.pending = set()
+
+    def __contains__(self, item):
+        return self._has_hash(self._hash(item))
+
+    def __len__(self):
+        return len(self.hashes) + len(self.pending)
+
+    def add(self, item):
+        h = self._hash(item)
+        if not self._has_hash(h):
+            self.pending.add(h)
+            if len(self.pending) > max(len(self.hashes) / 16, 1024):
+                self._merge()
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __getstate__(self):
+        self._merge()
+        return self.hashes.typecode, self.hashes.tostring()
+
+    def __setstate__(self, state):
+        typecode, data = state
+        self.hashes = array(typecode)
+        self.hashes.fromstring(data)
+        self.pending = set()
+
+
+def get_partition(item):
+    """
+    :param item: a work item, (plugin, account, container, object name)
+                 and optionally a byte range
+    :returns: the partition of the item, the YYYYMMDD day of its logs
+    """
+    match = DAY_RE.match(item[3])
+    if match is None:
+        return OTHER_PARTITION
+    return ''.join(match.groups())
+
+
+class ProcessedFiles(object):
+    """
+    The set of files the log processor processed, stored as one object per
+    day of logs instead of one pickle of every file ever processed.
+
+    Supports the set operations the log processor uses (in, add, update and
+    len). A partition is downloaded the first time one of its files is
+    looked up or added, and store only uploads the partitions that changed,
+    so a run only pays for the days its listing covers.
+
+    :param log_processor: LogProcessorCommon to download and upload with
+    :param account: account to keep the partitions in
+    :param container: container to keep the partitions in
+    :param prefix: object name prefix of the partitions
+    :param legacy_name: name of the single pickle to migrate the processed
+                        files from, if there are no partitions yet
+    :param compact: if True, the partitions are kept as HashedSets
+    """
+
+    def __init__(self, log_processor, account, container,
+                 prefix='processed_files/', legacy_name=None, compact=False):
+        self.log_processor = log_processor
+        self.account = account
+        self.container = container
+        self.prefix = prefix
+        self.legacy_name = legacy_name
+        self.compact = compact
+        # partition -> set of files, for the partitions loaded so far
+        self.partitions = {}
+        # the partitions that exist, None until load is called
+        self.stored = None
+        self.changed = set()
+
+    def _name(self, partition):
+        return '%s%s.pickle.gz' % (self.prefix, partition)
+
+    def _download(self, name):
+        """
+        :returns: the unpickled object, None if it does not exist
+        :raises BadFileDownload: if the object could not be downloaded
+        """
+        try:
+            stream = self.log_processor.get_object_data(self.account,
+                                                        self.container, name,
+                                                        compressed=True)
+            buf = '\n'.join(x for x in stream)
+        except BadFileDownload, err:
+            if err.status_code == 404:
+                return None
+            raise
+        if not buf:
+            raise BadFileDownload()
+        return cPickle.loads(buf)
+
+    def _partition(self, partition):
+        files = self.partitions.get(partition)
+        if files is None:
+            if self.stored is None or partition in self.stored:
+                files = self._download(self._name(partition))
+            if files is None:
+                files = set()
+            if self.compact and not isinstance(files, HashedSet):
+                files = HashedSet(files)
+            self.partitions[partition] = files
+        return files
+
+    def load(self, start_date=None, end_date=None):
+        """
+        Finds the stored partitions and downloads those of the days from
+        start_date to end_date (YYYYMMDDHH), so that download errors show up
+        before a run starts. Without dates, partitions are only downloaded
+        as needed.
+
+        If there are no partitions yet, the files in the legacy pickle are
+        added, to be stored as partitions by the next store. A legacy
+        HashedSet can not be partitioned and fails the load, as does a
+        listing of the partitions that failed.
+
+        :returns: True if successful, False otherwise
+        """
+        listing = self.log_processor.internal_proxy.list_container(
+                      self.account, self.container, prefix=self.prefix)
+        if listing is None:
+            return False
+        self.stored = set(x['name'][len(self.prefix):-len('.pickle.gz')]
+                          for x in listing)
+        try:
+            if not self.stored and self.legacy_name:
+                legacy = self._download(self.legacy_name)
+                if isinstance(legacy, HashedSet):
+                    # its items can not be listed back to be partitioned
+                    self.log_processor.logger.error(_('%s is compacted and '
+                        'can not be partitioned, keep using it by disabling '
+                        'partition_processed_files') % self.legacy_name)
+                    return False
+                self.update(legacy or ())
+            if start_date is None and end_date is None:
+                return True
+            start_day = (start_date or '')[:8]
+            end_day = (end_date or '99999999')[:8]
+            for partition in self.stored:
+                if partition == OTHER_PARTITION or \
+                        start_day <= partition <= end_day:
+                    self._partition(partition)
+        except BadFileDownload:
+            return False
+        return True
+
+    def __contains__(self, item):
+        return item in self._partition(get_partition(item))
+
+    def __len__(self):
+        """only counts the files in the partitions loaded so far"""
+        return sum(len(x) for x in self.partitions.itervalues())
+
+    def add(self, item):
+        partition = get_partition(item)
+        files = self._partition(partition)
+        if item not in files:
+            files.add(item)
+            self.changed.add(partition)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def store(self):
+        """
+        Uploads the partitions that changed.
+
+        :returns: True if successful, False otherwise
+        """
+        for partition in sorted(self.changed):
+            s = cPickle.dumps(self.partitions[partition],
+                              cPickle.HIGHEST_PROTOCOL)
+            f = cStringIO.StringIO(s)
+            if not self.log_processor.internal_proxy.upload_file(f,
+                    self.account, self.container, self._name(partition)):
+                return False
+            self.changed.discard(partition)
+        return True
+
+
+class ProcessedFilesJournal(object):
+    """
+    A set of processed object names, stored as a snapshot and a journal of
+    the names added since, so that storing the names a run added does not
+    cost more as the set grows.
+
+    The snapshot and the deltas are sorted lists of names, one per line,
+    which compress far better than a pickled set and are read back without
+    unpickling. store uploads the names added since the last store as a new
+    delta, and once there are compact_deltas deltas, folds them into a new
+    snapshot. Folding a delta in again is harmless, so a compaction that
+    fails halfway is finished by the next one.
+
+    :param log_processor: LogProcessorCommon to download and upload with
+    :param account: account to keep the journal in
+    :param container: container to keep the journal in
+    :param prefix: object name prefix of the journal
+    :param legacy_name: name of the pickled set to start the journal from,
+                        if there is no journal yet
+    :param compact_deltas: number of deltas that triggers a compaction
+    """
+
+    def __init__(self, log_processor, account, container,
+                 prefix='processed_files_journal/', legacy_name=None,
+                 compact_deltas=24):
+        self.log_processor = log_processor
+        self.account = account
+        self.container = container
+        self.prefix = prefix
+        self.snapshot_name = prefix + 'snapshot.gz'
+        self.delta_prefix = prefix + 'delta/'
+        self.legacy_name = legacy_name
+        self.compact_deltas = compact_deltas
+        self.files = set()
+        # names added since the last store
+        self.new_files = set()
+        self.deltas = []
+        self.needs_snapshot = False
+
+    def _download(self, name):
+        """
+        :returns: an iterator of the lines of the object
+        :raises BadFileDownload: if the object could not be downloaded
+        """
+        return self.log_processor.get_object_data(self.account,
+                                                  self.container, name,
+                                                  compressed=True)
+
+    def _upload(self, name, files):
+        f = cStringIO.StringIO('\n'.join(sorted(files)))
+        return self.log_processor.internal_proxy.upload_file(f,
+            self.account, self.container, name)
+
+    def load(self):
+        """
+        Reads the snapshot and the deltas. A listing of the journal that
+        failed fails the load.
+
+        :returns: True if successful, False otherwise
+        """
+        listing = self.log_processor.internal_proxy.list_container(
+                      self.account, self.container, prefix=self.prefix)
+        if listing is None:
+            # a delta left out would lose its names
+            return False
+        names = [x['name'] for x in listing]
+        self.deltas = [x for x in names if x.startswith(self.delta_prefix)]
+        files = set()
+        try:
+            if self.snapshot_name in names:
+                files.update(x for x in self._download(self.snapshot_name)
+                             if x)
+            elif not self.deltas and self.legacy_name:
+                try:
+                    buf = '\n'.join(self._download(self.legacy_name))
+                except BadFileDownload, err:
+                    if err.status_code != 404:
+                        raise
+                else:
+                    if buf:
+                        self.new_files.update(cPickle.loads(buf))
+                        self.needs_snapshot = True
+            for name in self.deltas:
+                files.update(x for x in self._download(name) if x)
+        except BadFileDownload:
+            return False
+        self.files = files
+        self.files.update(self.new_files)
+        return True
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, name):
+        if name not in self.files:
+            self.files.add(name)
+            self.new_files.add(name)
+
+    def update(self, names):
+        for name in names:
+            self.add(name)
+
+    def store(self):
+        """
+        Uploads the names added since the last store as a delta, and
+        compacts the journal if it has enough deltas. Names that could not
+        be stored are stored by the next store.
+
+        :returns: True if successful, False otherwise
+        """
+        if self.needs_snapshot:
+            return self.compact()
+        if self.new_files:
+            name = '%s%.5f.%s.gz' % (self.delta_prefix, time.time(),
+                                     uuid4().hex)
+            if not self._upload(name, self.new_files):
+                return False
+            self.new_files = set()
+            self.deltas.append(name)
+        if len(self.deltas) >= self.compact_deltas:
+            return self.compact()
+        return True
+
+    def compact(self):
+        """
+        Stores all the names as a new snapshot and deletes the deltas.
+
+        :returns: True if successful, False otherwise
+        """
+        if not self._upload(self.snapshot_name, self.files):
+            return False
+        self.new_files = set()
+        self.needs_snapshot = False
+        deltas, self.deltas = self.deltas, []
+        for name in deltas:
+            if not self.log_processor.internal_proxy.delete_object(
+                    self.account, self.container, name):
+                # folded in again by the next compaction
+                self.deltas.append(name)
+        return True
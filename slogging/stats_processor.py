@@ -25,34 +25,44 @@ class StatsLogProcessor(object):
     def process(self, obj_stream, data_object_account, data_object_container,
                 data_object_name):
         '''generate hourly groupings of data from one stats log file'''
+        return self.process_batch([obj_stream], data_object_account,
+                                  data_object_container, data_object_name)
+
+    def process_batch(self, obj_batches, data_object_account,
+                      data_object_container, data_object_name):
+        '''
+        generate hourly groupings of data from one stats log file delivered
+        as an iterable of lists of lines
+        '''
         account_totals = {}
         year, month, day, hour, _junk = data_object_name.split('/')
-        for line in obj_stream:
-            if not line:
-                continue
-            try:
-                (account,
-                container_count,
-                object_count,
-                bytes_used) = line.split(',')[:4]
-                account = account.strip('"')
-                container_count = int(container_count.strip('"'))
-                object_count = int(object_count.strip('"'))
-                bytes_used = int(bytes_used.strip('"'))
-            except (IndexError, ValueError):
-                # bad line data
-                self.logger.debug(_('Bad line data: %s') % repr(line))
-                continue
-            aggr_key = (account, year, month, day, hour)
-            d = account_totals.get(aggr_key, {})
-            d['replica_count'] = d.setdefault('replica_count', 0) + 1
-            d['container_count'] = d.setdefault('container_count', 0) + \
-                                   container_count
-            d['object_count'] = d.setdefault('object_count', 0) + \
-                                object_count
-            d['bytes_used'] = d.setdefault('bytes_used', 0) + \
-                              bytes_used
-            account_totals[aggr_key] = d
+        for batch in obj_batches:
+            for line in batch:
+                if not line:
+                    continue
+                try:
+                    (account,
+                    container_count,
+                    object_count,
+                    bytes_used) = line.split(',')[:4]
+                    account = account.strip('"')
+                    container_count = int(container_count.strip('"'))
+                    object_count = int(object_count.strip('"'))
+                    bytes_used = int(bytes_used.strip('"'))
+                except (IndexError, ValueError):
+                    # bad line data
+                    self.logger.debug(_('Bad line data: %s') % repr(line))
+                    continue
+                aggr_key = (account, year, month, day, hour)
+                d = account_totals.get(aggr_key, {})
+                d['replica_count'] = d.setdefault('replica_count', 0) + 1
+                d['container_count'] = d.setdefault('container_count', 0) + \
+                                       container_count
+                d['object_count'] = d.setdefault('object_count', 0) + \
+                                    object_count
+                d['bytes_used'] = d.setdefault('bytes_used', 0) + \
+                                  bytes_used
+                account_totals[aggr_key] = d
         return account_totals
 
     def keylist_mapping(self):
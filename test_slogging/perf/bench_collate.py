@@ -0,0 +1,115 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares slogging.log_common.multiprocess_collate with the polling collator
+it replaced, on many tiny work items and on fewer items that each take a
+while. Reports the wall clock time and the CPU time used by the parent
+process.
+
+Usage: python test_slogging/perf/bench_collate.py [items] [workers]
+"""
+
+import sys
+import time
+import resource
+import multiprocessing
+import Queue
+
+from slogging.log_common import multiprocess_collate
+
+
+class TinyProcessor(object):
+
+    def process(self, x):
+        return {('acct', '2010', '07', '09', '04'): {'bytes': x}}
+
+
+class SlowProcessor(TinyProcessor):
+
+    def process(self, x):
+        time.sleep(.05)
+        return TinyProcessor.process(self, x)
+
+
+def legacy_worker(processor_klass, processor_args, processor_method,
+                  in_queue, out_queue):
+    p = processor_klass(*processor_args)
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+        out_queue.put((item, getattr(p, processor_method)(*item)))
+
+
+def legacy_collate(processor_klass, processor_args, processor_method,
+                   items_to_process, worker_count):
+    results = []
+    in_queue = multiprocessing.Queue()
+    out_queue = multiprocessing.Queue()
+    for _junk in range(worker_count):
+        p = multiprocessing.Process(target=legacy_worker,
+                                    args=(processor_klass, processor_args,
+                                          processor_method, in_queue,
+                                          out_queue))
+        p.start()
+        results.append(p)
+    for x in items_to_process:
+        in_queue.put(x)
+    for _junk in range(worker_count):
+        in_queue.put(None)
+    while True:
+        try:
+            item, data = out_queue.get_nowait()
+        except Queue.Empty:
+            time.sleep(.01)
+        else:
+            yield item, data
+        if not any(r.is_alive() for r in results) and out_queue.empty():
+            break
+
+
+def timed(name, func, klass, item_count, worker_count):
+    items = ((i,) for i in xrange(item_count))
+    start = time.time()
+    start_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    count = 0
+    for _junk in func(klass, (), 'process', items, worker_count):
+        count += 1
+    end_cpu = resource.getrusage(resource.RUSAGE_SELF)
+    elapsed = time.time() - start
+    cpu = (end_cpu.ru_utime - start_cpu.ru_utime) + \
+          (end_cpu.ru_stime - start_cpu.ru_stime)
+    assert count == item_count
+    print '%-8s %-5s %6d items %2d workers: %.3fs elapsed, %.3fs parent ' \
+        'cpu' % (name, klass.__name__[:-9].lower(), item_count, worker_count,
+                 elapsed, cpu)
+
+
+def main():
+    item_count = 20000
+    worker_count = 4
+    if len(sys.argv) > 1:
+        item_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        worker_count = int(sys.argv[2])
+    for klass, count in ((TinyProcessor, item_count),
+                         (SlowProcessor, worker_count * 20)):
+        timed('legacy', legacy_collate, klass, count, worker_count)
+        timed('collate', multiprocess_collate, klass, count, worker_count)
+
+
+if __name__ == '__main__':
+    main()
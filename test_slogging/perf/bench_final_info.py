@@ -0,0 +1,98 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares applying the access log keylist mapping to hourly stats by looking
+up every key of every mapping in each row, as get_final_info used to, and
+with a slogging.aggregation.KeylistIndex.
+
+Usage: python test_slogging/perf/bench_final_info.py [rows]
+"""
+
+import sys
+import time
+import random
+
+from slogging.access_processor import AccessLogProcessor
+from slogging.aggregation import KeylistIndex, DenseAggregate
+
+
+def make_aggr_data(row_count):
+    aggr_data = {}
+    for i in xrange(row_count):
+        stats = {}
+        for source in ('public', 'service'):
+            for verb in random.sample(('GET', 'PUT', 'HEAD', 'DELETE'), 2):
+                for code in ('2xx', '4xx'):
+                    level = random.choice(('account', 'container',
+                                           'object'))
+                    stats[(source, level, verb, code)] = \
+                        random.randint(1, 1000)
+            stats[(source, 'bytes_out')] = random.randint(0, 10 ** 9)
+            stats[(source, 'bytes_in')] = random.randint(0, 10 ** 9)
+        for key in ('marker_query', 'format_query', 'delimiter_query',
+                    'path_query', 'prefix_query'):
+            stats[key] = random.randint(0, 100)
+        aggr_data[('AUTH_%032x' % (i / 24), '2010', '07', '09',
+                   '%02d' % (i % 24))] = stats
+    return aggr_data
+
+
+def lookup_every_key(keylist_mapping, aggr_data):
+    final_info = {}
+    for account, data in aggr_data.items():
+        final_info[account] = {}
+        for key, mapping in keylist_mapping.items():
+            if isinstance(mapping, (list, set)):
+                value = 0
+                for k in mapping:
+                    try:
+                        value += data[k]
+                    except KeyError:
+                        pass
+            else:
+                try:
+                    value = data[mapping]
+                except KeyError:
+                    value = 0
+            final_info[account][key] = value
+    return final_info
+
+
+def run(name, func):
+    start = time.time()
+    final_info = func()
+    print '%-8s %6d rows  %.3fs' % (name, len(final_info),
+                                   time.time() - start)
+    return final_info
+
+
+def main():
+    row_count = 20000
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    keylist_mapping = AccessLogProcessor({}).keylist_mapping()
+    aggr_data = make_aggr_data(row_count)
+    expected = run('lookup', lambda: lookup_every_key(keylist_mapping,
+                                                      aggr_data))
+    assert run('index', lambda: KeylistIndex(keylist_mapping).apply(
+        aggr_data)) == expected
+    dense = DenseAggregate().merge(aggr_data)
+    assert run('dense', lambda: KeylistIndex(keylist_mapping).apply(
+        dense)) == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares slogging.log_common.iter_lines with the split/concatenate loop that
+get_object_data used to run inline.
+
+Usage: python test_slogging/perf/bench_line_splitting.py [megabytes]
+"""
+
+import sys
+import time
+
+from slogging.log_common import iter_lines
+
+
+LINE = 'Jul  9 04:14:30 saio proxy-server 1.2.3.4 4.5.6.7 ' \
+       '09/Jul/2010/04/14/30 GET /v1/acct/foo/bar?format=json&foo ' \
+       'HTTP/1.0 200 - curl tk4e350daf-9338-4cc6-aabb-090e49babfbd 6 95 - ' \
+       'txfa431231-7f07-42fd-8fc7-7da9d8cc1f90 - 0.0262\n'
+
+
+def legacy_lines(chunks):
+    last_part = ''
+    for chunk in chunks:
+        parts = chunk.split('\n')
+        parts[0] = last_part + parts[0]
+        for part in parts[:-1]:
+            yield part
+        last_part = parts[-1]
+    if last_part:
+        yield last_part
+
+
+def timed(func, chunks):
+    start = time.time()
+    count = 0
+    for _junk in func(chunks):
+        count += 1
+    return count, time.time() - start
+
+
+def run(name, data, chunk_size):
+    chunks = [data[i:i + chunk_size]
+              for i in xrange(0, len(data), chunk_size)]
+    legacy_count, legacy_time = timed(legacy_lines, chunks)
+    new_count, new_time = timed(iter_lines, chunks)
+    assert legacy_count == new_count
+    print '%-12s %8d byte chunks: legacy %.3fs  iter_lines %.3fs  (%.1fx)' % (
+        name, chunk_size, legacy_time, new_time, legacy_time / new_time)
+
+
+def main():
+    megabytes = 64
+    if len(sys.argv) > 1:
+        megabytes = int(sys.argv[1])
+    size = megabytes * 1024 * 1024
+    access_log = LINE * (size / len(LINE))
+    long_lines = ('x' * (4 * 1024 * 1024) + '\n') * (megabytes / 4 or 1)
+    for chunk_size in (512, 4096, 65536):
+        run('access log', access_log, chunk_size)
+    for chunk_size in (4096, 65536):
+        run('long lines', long_lines, chunk_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares turning reduced access log stats into csv rows with
+LogProcessorDaemon.get_final_info and get_output and with
+LogProcessorDaemon.iter_numpy_output, from a dict of dicts and from a
+slogging.aggregation.DenseAggregate. Needs NumPy.
+
+Usage: python test_slogging/perf/bench_output.py [accounts] [hours]
+"""
+
+import sys
+import time
+import random
+
+from slogging.access_processor import AccessLogProcessor
+from slogging.aggregation import DenseAggregate
+from slogging.log_processor import LogProcessorDaemon
+
+
+class Daemon(LogProcessorDaemon):
+
+    def __init__(self):
+        self._keylist_mapping = AccessLogProcessor({}).keylist_mapping()
+
+
+def make_aggr_data(account_count, hour_count):
+    aggr_data = {}
+    for i in xrange(account_count):
+        for hour in xrange(hour_count):
+            stats = {}
+            for source in ('public', 'service'):
+                for verb in ('GET', 'PUT', 'HEAD', 'DELETE'):
+                    for code in ('2xx', '4xx'):
+                        level = random.choice(('account', 'container',
+                                               'object'))
+                        stats[(source, level, verb, code)] = \
+                            random.randint(1, 1000)
+                stats[(source, 'bytes_out')] = random.randint(0, 10 ** 9)
+                stats[(source, 'bytes_in')] = random.randint(0, 10 ** 9)
+            aggr_data[('AUTH_%032x' % i, '2010', '07', '%02d' % (hour / 24),
+                       '%02d' % (hour % 24))] = stats
+    return aggr_data
+
+
+def run(name, func):
+    start = time.time()
+    output = func()
+    print '%-12s %7d rows  %.3fs' % (name, len(output) - 1,
+                                     time.time() - start)
+    return output
+
+
+def main():
+    account_count = 1000
+    hour_count = 48
+    if len(sys.argv) > 1:
+        account_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        hour_count = int(sys.argv[2])
+    daemon = Daemon()
+    aggr_data = make_aggr_data(account_count, hour_count)
+    expected = run('python', lambda: daemon.get_output(
+                                         daemon.get_final_info(aggr_data)))
+    assert run('numpy', lambda: list(
+                            daemon.iter_numpy_output(aggr_data))) == expected
+    dense = DenseAggregate().merge(aggr_data)
+    assert run('python dense', lambda: daemon.get_output(
+                                           daemon.get_final_info(dense))) == \
+        expected
+    assert run('numpy dense', lambda: list(
+                                  daemon.iter_numpy_output(dense))) == expected
+
+
+if __name__ == '__main__':
+    main()
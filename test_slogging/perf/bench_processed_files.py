@@ -0,0 +1,76 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares keeping the processed files list as a set of work items and as a
+slogging.processed_files.HashedSet: the memory they take, the time to look
+up listed objects in them and the size and load time of their pickles.
+
+Usage: python test_slogging/perf/bench_processed_files.py [files]
+"""
+
+import sys
+import time
+import cPickle
+
+from slogging.processed_files import HashedSet
+
+
+def make_items(count, offset=0):
+    return [('access', 'AUTH_%032x' % (i % 1000), 'log_data',
+             '2011/03/%02d/%02d/%032x.gz' % (i / 24 % 28 + 1, i % 24, i))
+            for i in xrange(offset, offset + count)]
+
+
+def set_size(files):
+    size = sys.getsizeof(files)
+    for item in files:
+        size += sys.getsizeof(item) + sum(sys.getsizeof(x) for x in item)
+    return size
+
+
+def hashed_set_size(files):
+    return sys.getsizeof(files.hashes) + sys.getsizeof(files.pending)
+
+
+def run(name, files, size, lookups):
+    start = time.time()
+    found = sum(1 for x in lookups if x in files)
+    lookup_time = time.time() - start
+    s = cPickle.dumps(files, cPickle.HIGHEST_PROTOCOL)
+    start = time.time()
+    cPickle.loads(s)
+    load_time = time.time() - start
+    print '%-7s %11d bytes  %d lookups %.3fs  pickle %d bytes, ' \
+        'load %.3fs' % (name, size, len(lookups), lookup_time, len(s),
+                        load_time)
+    return found
+
+
+def main():
+    file_count = 200000
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    items = make_items(file_count)
+    # half the listed objects were processed already
+    lookups = items[::2] + make_items(file_count / 2, file_count)
+    files = set(items)
+    expected = run('set', files, set_size(files), lookups)
+    files = HashedSet(items)
+    assert run('hashed', files, hashed_set_size(files), lookups) == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares reducing per-file access log results in the parent into a dict of
+dicts and into a slogging.aggregation.DenseAggregate, from dicts and from
+PackedAggregates as the workers send them with pack_worker_results.
+
+Usage: python test_slogging/perf/bench_reduce.py [files] [accounts] [hours]
+"""
+
+import sys
+import time
+import random
+
+from slogging.aggregation import merge_aggregates, PackedAggregate, \
+    DenseAggregate
+
+
+def make_result(account_count, hour_count):
+    result = {}
+    hour = random.randrange(hour_count)
+    for i in random.sample(xrange(account_count * 2), account_count):
+        stats = {}
+        for source in ('public', 'service'):
+            for verb in ('GET', 'PUT', 'HEAD', 'DELETE'):
+                for code in ('2xx', '4xx'):
+                    stats[(source, 'object', verb, code)] = \
+                        random.randint(0, 1000)
+            stats[(source, 'bytes_out')] = random.randint(0, 10 ** 9)
+            stats[(source, 'bytes_in')] = random.randint(0, 10 ** 9)
+        for key in ('marker_query', 'format_query', 'delimiter_query',
+                    'path_query', 'prefix_query'):
+            stats[key] = random.randint(0, 100)
+        result[('AUTH_%032x' % i, '2010', '07', '%02d' % (hour / 24),
+                '%02d' % (hour % 24))] = stats
+    return result
+
+
+def rows_size(aggr_data):
+    """the size of the hour rows, without the keys they share"""
+    if isinstance(aggr_data, DenseAggregate):
+        rows = aggr_data.rows
+    else:
+        rows = aggr_data
+    return sys.getsizeof(rows) + sum(sys.getsizeof(x)
+                                     for x in rows.itervalues())
+
+
+def run(name, results, aggr_data):
+    start = time.time()
+    for result in results:
+        merge_aggregates(aggr_data, result)
+    merge_time = time.time() - start
+    size = rows_size(aggr_data)
+    if isinstance(aggr_data, DenseAggregate):
+        aggr_data = aggr_data.to_dict()
+    print '%-12s %6d rows %10d bytes  merge %.3fs' % (
+        name, len(aggr_data), size, merge_time)
+    return aggr_data
+
+
+def main():
+    file_count = 500
+    account_count = 500
+    hour_count = 24
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        account_count = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        hour_count = int(sys.argv[3])
+    results = [make_result(account_count, hour_count)
+               for _junk in xrange(file_count)]
+    expected = run('dict', results, {})
+    assert run('dense', results, DenseAggregate()) == expected
+    results = [PackedAggregate.from_dict(r) for r in results]
+    assert run('packed dict', results, {}) == expected
+    assert run('packed dense', results, DenseAggregate()) == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares sending per-file access log results between processes as pickled
+dicts and as slogging.aggregation.PackedAggregate: the pickled size, the
+time to pickle them in the workers and the time to unpickle and merge them
+in the parent.
+
+Usage: python test_slogging/perf/bench_result_encoding.py [files] [accounts]
+"""
+
+import sys
+import time
+import random
+import cPickle
+
+from slogging.aggregation import merge_aggregates, PackedAggregate
+
+
+def make_result(account_count):
+    result = {}
+    for i in xrange(account_count):
+        stats = {}
+        for source in ('public', 'service'):
+            for verb in ('GET', 'PUT', 'HEAD', 'DELETE'):
+                for code in ('2xx', '4xx'):
+                    stats[(source, 'object', verb, code)] = \
+                        random.randint(0, 1000)
+            stats[(source, 'bytes_out')] = random.randint(0, 10 ** 9)
+            stats[(source, 'bytes_in')] = random.randint(0, 10 ** 9)
+        for key in ('marker_query', 'format_query', 'delimiter_query',
+                    'path_query', 'prefix_query'):
+            stats[key] = random.randint(0, 100)
+        result[('AUTH_%032x' % i, '2010', '07', '09', '04')] = stats
+    return result
+
+
+def run(name, results, encode):
+    start = time.time()
+    messages = [cPickle.dumps(encode(r), cPickle.HIGHEST_PROTOCOL)
+                for r in results]
+    encode_time = time.time() - start
+    start = time.time()
+    aggr_data = {}
+    for message in messages:
+        merge_aggregates(aggr_data, cPickle.loads(message))
+    merge_time = time.time() - start
+    print '%-7s %9d bytes  encode+pickle %.3fs  unpickle+merge %.3fs' % (
+        name, sum(len(m) for m in messages), encode_time, merge_time)
+    return aggr_data
+
+
+def main():
+    file_count = 200
+    account_count = 200
+    if len(sys.argv) > 1:
+        file_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        account_count = int(sys.argv[2])
+    results = [make_result(account_count) for _junk in xrange(file_count)]
+    expected = run('dict', results, lambda r: r)
+    packed = run('packed', results, PackedAggregate.from_dict)
+    assert packed == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the peak memory of storing the csv output by joining every row
+into one string, as store_output used to, and by streaming the rows from
+LogProcessorDaemon.iter_output through LogProcessorDaemon.store_output.
+Each is run in its own process, which reports its peak RSS.
+
+Usage: python test_slogging/perf/bench_store_output.py [rows]
+"""
+
+import os
+import sys
+import time
+import hashlib
+import resource
+import cStringIO
+
+from slogging.log_processor import LogProcessorDaemon
+
+
+class NullProxy(object):
+
+    def upload_file(self, f, account, container, object_name):
+        for chunk in iter(lambda: f.read(65536), ''):
+            pass
+        return True
+
+
+class Daemon(LogProcessorDaemon):
+
+    def __init__(self):
+        self._keylist_mapping = dict(('field%02d' % i, 'key%02d' % i)
+                                     for i in xrange(25))
+        self.log_processor = self
+        self.internal_proxy = NullProxy()
+        self.log_processor_account = 'a'
+        self.log_processor_container = 'c'
+
+
+def make_final_info(row_count):
+    return dict((('AUTH_%032x' % (i / 24), '2010', '07', '09',
+                  '%02d' % (i % 24)),
+                 dict(('field%02d' % j, i * j) for j in xrange(25)))
+                for i in xrange(row_count))
+
+
+def store_joined(daemon, final_info):
+    out_buf = '\n'.join([','.join(row)
+                         for row in daemon.get_output(final_info)])
+    hashlib.md5(out_buf).hexdigest()
+    return daemon.internal_proxy.upload_file(cStringIO.StringIO(out_buf),
+                                             'a', 'c', 'o')
+
+
+def store_streamed(daemon, final_info):
+    return daemon.store_output(daemon.iter_output(final_info))
+
+
+def run(name, func, row_count):
+    pid = os.fork()
+    if pid == 0:
+        final_info = make_final_info(row_count)
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        func(Daemon(), final_info)
+        print '%-8s %7d rows  %.3fs  peak RSS +%d KB' % (
+            name, row_count, time.time() - start,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base)
+        sys.stdout.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def main():
+    row_count = 100000
+    if len(sys.argv) > 1:
+        row_count = int(sys.argv[1])
+    run('joined', store_joined, row_count)
+    run('streamed', store_streamed, row_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -200,6 +200,40 @@ class TestAccessLogDelivery(unittest.TestCase):
         expected = True
         self.assertEquals(res, expected)
 
+    def test_process_one_file_generation(self):
+        with temptree([]) as t:
+            conf = {'working_dir': t}
+            p = access_log_delivery.AccessLogDelivery(conf, DumbLogger())
+            metadata = {}
+
+            class FakeProxy(object):
+                def get_container_metadata(self, account, container):
+                    return metadata
+
+            def my_get_object_data(*a, **kw):
+                log_line = [str(x) for x in range(18)]
+                log_line[1] = 'proxy-server'
+                log_line[4] = '1/Jan/3/4/5/6'
+                log_line[6] = '/v1/a/gen/o'
+                yield 'x' * 16 + ' '.join(log_line)
+            p._internal_proxy = FakeProxy()
+            p.get_object_data = my_get_object_data
+            metadata[p.metadata_key] = 'yes'
+            p.memcache = FakeMemcache()
+            res = p.process_one_file('a', 'c', '2011/03/14/12/hash',
+                                     generation=1)
+            self.assertEquals(res, set(['%s/a/gen/2011/03/14/12' % t]))
+            # remembered for the rest of the run
+            metadata[p.metadata_key] = 'no'
+            p.memcache = FakeMemcache()
+            res = p.process_one_file('a', 'c', '2011/03/14/12/hash',
+                                     generation=1)
+            self.assertEquals(res, set(['%s/a/gen/2011/03/14/12' % t]))
+            # and looked up again on the next one
+            res = p.process_one_file('a', 'c', '2011/03/14/12/hash',
+                                     generation=2)
+            self.assertEquals(res, set())
+
     def test_process_one_file(self):
         with temptree([]) as t:
             conf = {'working_dir': t}
@@ -0,0 +1,168 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import cPickle
+import sys
+from array import array
+
+from slogging import aggregation
+
+
+class TestAggregation(unittest.TestCase):
+
+    def test_merge_aggregates(self):
+        aggr_data = {'acct1_time1': {'field1': 1}}
+        data = {'acct1_time1': {'field1': 10, 'field2': 2},
+                'acct2_time1': {'field1': 6}}
+        result = aggregation.merge_aggregates(aggr_data, data)
+        self.assert_(result is aggr_data)
+        self.assertEquals(aggr_data,
+                          {'acct1_time1': {'field1': 11, 'field2': 2},
+                           'acct2_time1': {'field1': 6}})
+        # the merged data is not modified by later merges
+        aggregation.merge_aggregates(aggr_data, data)
+        self.assertEquals(data['acct2_time1'], {'field1': 6})
+        self.assertEquals(aggr_data['acct2_time1'], {'field1': 12})
+
+    def test_packed_aggregate(self):
+        data = {('acct', '2010', '07', '09', '04'):
+                    {('public', 'object', 'GET', '2xx'): 1,
+                     ('public', 'bytes_out'): 95,
+                     'format_query': 0},
+                ('acct2', '2010', '07', '09', '04'):
+                    {('public', 'object', 'GET', '2xx'): 3,
+                     ('public', 'bytes_out'): sys.maxint + 1,
+                     'avg': 0.5},
+                ('acct3', '2010', '07', '09', '04'): {}}
+        packed = aggregation.PackedAggregate.from_dict(data)
+        self.assertEquals(packed.to_dict(), data)
+        # each stats key is only stored once
+        self.assertEquals(len(packed.stat_keys), 3)
+        self.assertEquals(packed.overflow.keys(),
+                          [('acct2', '2010', '07', '09', '04')])
+        for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+            unpickled = cPickle.loads(cPickle.dumps(packed, protocol))
+            self.assertEquals(unpickled.to_dict(), data)
+            self.assertEquals(unpickled, packed)
+
+    def test_packed_aggregate_values(self):
+        data = {'acct1_time1': {'field1': 1, 'field2': -1}}
+        packed = aggregation.PackedAggregate.from_dict(data)
+        self.assertEquals(packed.values.typecode, 'i')
+        data = {'acct1_time1': {'field1': 1, 'field2': 0x80000000}}
+        packed = aggregation.PackedAggregate.from_dict(data)
+        self.assertEquals(packed.values.itemsize, array('l').itemsize)
+        unpickled = cPickle.loads(cPickle.dumps(packed, 2))
+        self.assertEquals(unpickled.to_dict(), data)
+
+    def test_merge_packed_aggregate(self):
+        aggr_data = {'acct1_time1': {'field1': 1}}
+        data = {'acct1_time1': {'field1': 10, 'field2': 2},
+                'acct2_time1': {'field1': 6, 'field3': 2.5}}
+        packed = aggregation.PackedAggregate.from_dict(data)
+        result = aggregation.merge_aggregates(aggr_data, packed)
+        self.assert_(result is aggr_data)
+        self.assertEquals(aggr_data,
+                          {'acct1_time1': {'field1': 11, 'field2': 2},
+                           'acct2_time1': {'field1': 6, 'field3': 2.5}})
+        self.assertNotEquals(packed, aggregation.PackedAggregate())
+
+    def test_dense_aggregate(self):
+        dense = aggregation.DenseAggregate()
+        data = {'acct1_time1': {'field1': 10, 'field2': 2, 'field3': 0},
+                'acct2_time1': {'field1': 6, 'field4': sys.maxint,
+                                'avg': 0.5}}
+        result = aggregation.merge_aggregates(dense, data)
+        self.assert_(result is dense)
+        aggregation.merge_aggregates(dense,
+            aggregation.PackedAggregate.from_dict(data))
+        aggregation.merge_aggregates(dense,
+            {'acct1_time1': {'field5': 1}})
+        expected = {'acct1_time1': {'field1': 20, 'field2': 4, 'field3': 0,
+                                    'field5': 1},
+                    'acct2_time1': {'field1': 12, 'field4': 2 * sys.maxint,
+                                    'avg': 1.0}}
+        self.assertEquals(dense.to_dict(), expected)
+        self.assertEquals(len(dense), 2)
+        # each stats key has one column
+        self.assertEquals(len(dense.stat_keys), 6)
+        self.assertEquals(len(dense.rows['acct1_time1']), 6)
+        for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+            unpickled = cPickle.loads(cPickle.dumps(dense, protocol))
+            self.assertEquals(unpickled.to_dict(), expected)
+        aggr_data = {'acct1_time1': {'field1': 1}}
+        aggregation.merge_aggregates(aggr_data, dense)
+        expected['acct1_time1']['field1'] += 1
+        self.assertEquals(aggr_data, expected)
+        other = aggregation.merge_aggregates(aggregation.DenseAggregate(),
+                                             dense)
+        self.assertEquals(other.to_dict(), dense.to_dict())
+
+    def test_spilling_aggregate(self):
+        data = [{'acct2_time1': {'field1': 1}, 'acct1_time1': {'field1': 2}},
+                {'acct1_time2': {'field2': 3}},
+                aggregation.PackedAggregate.from_dict(
+                    {'acct1_time1': {'field1': 4, 'field2': 0.5}}),
+                {'acct3_time1': {'field3': 5}, 'acct1_time1': {'field3': 0}}]
+        expected = {}
+        for d in data:
+            aggregation.merge_aggregates(expected, d)
+        for klass in (dict, aggregation.DenseAggregate):
+            spilling = aggregation.SpillingAggregate(1, klass)
+            for d in data:
+                result = aggregation.merge_aggregates(spilling, d)
+                self.assert_(result is spilling)
+            self.assertEquals(len(spilling.runs), 3)
+            self.assert_(spilling.finish() is spilling)
+            rows = list(spilling.iteritems())
+            self.assertEquals(rows, sorted(expected.items()))
+            # the runs can be read again until closed
+            self.assertEquals(list(spilling.iteritems()), rows)
+            spilling.close()
+            self.assertEquals(spilling.runs, [])
+        spilling = aggregation.SpillingAggregate(10)
+        self.assertFalse(spilling)
+        for d in data:
+            aggregation.merge_aggregates(spilling, d)
+        self.assert_(spilling)
+        self.assertEquals(spilling.runs, [])
+        self.assertEquals(spilling.finish(), expected)
+
+    def test_keylist_index(self):
+        index = aggregation.KeylistIndex({
+            'bw_in': ('public', 'bytes_in'),
+            'requests': set([('public', 'GET'), ('public', 'PUT')]),
+            'gets': [('public', 'GET')],
+            'twice': ['field1', 'field1'],
+            'missing': 'field2'})
+        self.assertEquals(index.fields,
+                          ['bw_in', 'gets', 'missing', 'requests', 'twice'])
+        self.assertEquals(sorted(index.index[('public', 'GET')]), [1, 3])
+        data = {'acct1_time1': {('public', 'bytes_in'): 5,
+                                ('public', 'GET'): 2, ('public', 'PUT'): 1,
+                                'field1': 3, 'other': 7}}
+        expected = {'acct1_time1': {'bw_in': 5, 'gets': 2, 'missing': 0,
+                                    'requests': 3, 'twice': 6}}
+        self.assertEquals(index.apply(data), expected)
+        dense = aggregation.DenseAggregate()
+        dense.merge(data)
+        dense.merge({'acct1_time1': {'field1': 0.5}})
+        expected['acct1_time1']['twice'] = 7.0
+        self.assertEquals(index.apply(dense), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
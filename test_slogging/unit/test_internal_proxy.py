@@ -113,6 +113,41 @@ class TestInternalProxy(unittest.TestCase):
         self.assertEquals(code, 200)
         self.assertEquals(body, '')
 
+    def test_get_object_headers(self):
+        status_codes = [206]
+        internal_proxy.BaseApplication = DumbBaseApplicationFactory(
+                                            status_codes, body='data')
+        p = internal_proxy.InternalProxy()
+        requests = []
+        orig_handle_request = p.upload_app.handle_request
+
+        def handle_request(req):
+            requests.append(req)
+            return orig_handle_request(req)
+        p.upload_app.handle_request = handle_request
+        code, body = p.get_object('a', 'c', 'o',
+                                  headers={'Range': 'bytes=4-'})
+        self.assertEquals(code, 206)
+        self.assertEquals(''.join(body), 'data')
+        self.assertEquals(requests[0].headers['Range'], 'bytes=4-')
+
+    def test_head_object(self):
+        status_codes = [200]
+        internal_proxy.BaseApplication = DumbBaseApplicationFactory(
+                                            status_codes)
+        p = internal_proxy.InternalProxy()
+        code, headers = p.head_object('a', 'c', 'o')
+        self.assertEquals(code, 200)
+        self.assert_('Content-Length' in headers)
+
+    def test_delete_object(self):
+        for status_code, expected in ((204, True), (404, True),
+                                      (500, False)):
+            internal_proxy.BaseApplication = DumbBaseApplicationFactory(
+                                                [status_code])
+            p = internal_proxy.InternalProxy()
+            self.assertEquals(p.delete_object('a', 'c', 'o'), expected)
+
     def test_create_container(self):
         status_codes = [200]
         internal_proxy.BaseApplication = DumbBaseApplicationFactory(
@@ -172,6 +207,29 @@ class TestInternalProxy(unittest.TestCase):
                                     limit=100, prefix='/', delimiter='.')
         self.assertEquals(resp, [])
 
+    def test_list_container(self):
+        obj_a = dict(name='foo', hash='foo', bytes=3,
+                     content_type='text/plain', last_modified='2011/01/01')
+        obj_b = dict(name='goo', hash='goo', bytes=3,
+                     content_type='text/plain', last_modified='2011/01/01')
+        body = [json.dumps([obj_a]), json.dumps([obj_b]), json.dumps([])]
+        internal_proxy.BaseApplication = DumbBaseApplicationFactory(
+                                            [200, 200, 200], body=body)
+        p = internal_proxy.InternalProxy()
+        resp = p.list_container('a', 'c')
+        self.assertEquals([x['name'] for x in resp], ['foo', 'goo'])
+        # a missing container is empty
+        internal_proxy.BaseApplication = DumbBaseApplicationFactory([404])
+        p = internal_proxy.InternalProxy()
+        self.assertEquals(p.list_container('a', 'c'), [])
+        # a page that fails fails the listing
+        body = [json.dumps([obj_a])]
+        internal_proxy.BaseApplication = DumbBaseApplicationFactory(
+                                            [200, 503], body=body)
+        p = internal_proxy.InternalProxy()
+        self.assertEquals(p.list_container('a', 'c'), None)
+        self.assertEquals(p.get_container_list('a', 'c'), [])
+
     def test_upload_file(self):
         status_codes = [200, 200]  # container PUT + object PUT
         internal_proxy.BaseApplication = DumbBaseApplicationFactory(
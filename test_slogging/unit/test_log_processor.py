@@ -14,16 +14,24 @@
 # limitations under the License.
 
 import unittest
-from test.unit import tmpfile
+from test.unit import tmpfile, temptree
 import Queue
 import datetime
+import collections
+import os
 import hashlib
 import pickle
 import time
+import gzip
+import cStringIO
+import eventlet
+from nose import SkipTest
 
 from slogging import internal_proxy
 from slogging import log_processor
 from slogging import log_common
+from slogging import aggregation
+from slogging.aggregation import PackedAggregate, DenseAggregate
 from swift.common.exceptions import ChunkReadTimeout
 
 
@@ -40,11 +48,68 @@ class DumbLogger(object):
         pass
 
 
+class FakeProxy(object):
+    """An in-memory stand-in for InternalProxy."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, source_file, account, container, object_name,
+                    compress=True, content_type=None, etag=None):
+        data = source_file.read()
+        if compress:
+            buf = cStringIO.StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(data)
+            f.close()
+            data = buf.getvalue()
+        self.objects[(account, container, object_name)] = data
+        return True
+
+    def get_object(self, account, container, object_name, headers=None):
+        try:
+            return 200, [self.objects[(account, container, object_name)]]
+        except KeyError:
+            return 404, []
+
+    def delete_object(self, account, container, object_name):
+        self.objects.pop((account, container, object_name), None)
+        return True
+
+    def head_object(self, account, container, object_name):
+        if (account, container, object_name) in self.objects:
+            return 200, {}
+        return 404, {}
+
+    def get_container_list(self, account, container, marker=None,
+                           end_marker=None, limit=None, prefix=None,
+                           delimiter=None, full_listing=True):
+        return [{'name': o, 'bytes': len(data)}
+                for (a, c, o), data in sorted(self.objects.iteritems())
+                if (a, c) == (account, container) and
+                   (not marker or o > marker) and
+                   (not end_marker or o < end_marker) and
+                   o.startswith(prefix or '')]
+
+    def list_container(self, account, container, prefix=None,
+                       delimiter=None):
+        return self.get_container_list(account, container, prefix=prefix)
+
+    def get_csv(self):
+        rows = []
+        for (a, c, o), data in self.objects.iteritems():
+            if o.endswith('.csv.gz'):
+                data = gzip.GzipFile(fileobj=cStringIO.StringIO(data)).read()
+                rows.extend(data.split('\n')[1:])
+        return sorted(rows)
+
+
 class DumbInternalProxy(object):
     def __init__(self, code=200, timeout=False, bad_compressed=False):
         self.code = code
         self.timeout = timeout
         self.bad_compressed = bad_compressed
+        self.heads = 0
 
     def get_container_list(self, account, container, marker=None,
                            end_marker=None):
@@ -52,12 +117,16 @@ class DumbInternalProxy(object):
         if marker is None or n > marker:
             if end_marker:
                 if n <= end_marker:
-                    return [{'name': n}]
+                    return [{'name': n, 'bytes': 9, 'hash': 'etag'}]
                 else:
                     return []
-            return [{'name': n}]
+            return [{'name': n, 'bytes': 9, 'hash': 'etag'}]
         return []
 
+    def head_object(self, account, container, object_name):
+        self.heads += 1
+        return self.code, {'Etag': 'etag'}
+
     def get_object(self, account, container, object_name):
         if object_name.endswith('.gz'):
             if self.bad_compressed:
@@ -83,6 +152,59 @@ class DumbInternalProxy(object):
         return self.code, data()
 
 
+class EchoProcessor(object):
+    def process(self, x):
+        return x + 0
+
+
+class StatsProcessor(object):
+    def process(self, x, y=0):
+        return x + y
+
+    def pop_stats(self):
+        return {'cache_hits': 1}
+
+
+class PidProcessor(object):
+    def process(self, x):
+        return os.getpid()
+
+
+class BrokenProcessor(object):
+    def __init__(self):
+        raise Exception('broken')
+
+
+class SlowProcessor(object):
+    def process(self, x):
+        eventlet.sleep(0.1)
+        return x
+
+
+class FlakyProcessor(object):
+    """
+    Hangs or dies the first time it gets an item (across processes), until
+    it has done that times times.
+    """
+
+    def __init__(self, state_dir, action, times=1):
+        self.state_dir = state_dir
+        self.action = action
+        self.times = times
+
+    def process(self, x):
+        if x < 0:
+            path = os.path.join(self.state_dir, '%d.%d' % (-x, self.times))
+            for i in xrange(self.times):
+                path = os.path.join(self.state_dir, '%d.%d' % (-x, i))
+                if not os.path.exists(path):
+                    open(path, 'w').close()
+                    if self.action == 'hang':
+                        time.sleep(60)
+                    os._exit(1)
+        return x
+
+
 class TestLogProcessor(unittest.TestCase):
 
     access_test_line = 'Jul  9 04:14:30 saio proxy-server 1.2.3.4 4.5.6.7 '\
@@ -191,6 +313,49 @@ use = egg:swift#proxy
                     'prefix_query': 0}}
         self.assertEquals(result, expected)
 
+    def test_process_one_access_file_batches(self):
+        access_proxy_config = self.proxy_config.copy()
+        access_proxy_config.update({
+                        'log-processor-access': {
+                            'source_filename_format': '%Y%m%d%H*',
+                            'class_path':
+                                'slogging.access_processor.AccessLogProcessor',
+                            'batch_size': '2',
+                        }})
+        p = log_processor.LogProcessor(access_proxy_config, DumbLogger())
+        self.assertEquals(p.plugins['access']['batch_size'], 2)
+
+        def get_object_batches(*a, **kw):
+            self.assertEquals(kw['batch_size'], 2)
+            return [[self.access_test_line, 'bad line'],
+                    [self.access_test_line]]
+        p.get_object_batches = get_object_batches
+        result = p.process_one_file('access', 'a', 'c', 'o')
+        expected = {('acct', '2010', '07', '09', '04'):
+                    {('public', 'object', 'GET', '2xx'): 2,
+                    ('public', 'bytes_out'): 190,
+                    'marker_query': 0,
+                    'format_query': 2,
+                    'delimiter_query': 0,
+                    'path_query': 0,
+                    ('public', 'bytes_in'): 12,
+                    'prefix_query': 0}}
+        self.assertEquals(result, expected)
+
+    def test_process_one_file_batches_plugin_without_process_batch(self):
+        class Plugin(object):
+            def process(self, obj_stream, *a):
+                return list(obj_stream)
+
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        p.plugins['plugin'] = {'instance': Plugin(), 'batch_size': 10}
+
+        def get_object_data(*a, **kw):
+            return ['line1', 'line2']
+        p.get_object_data = get_object_data
+        result = p.process_one_file('plugin', 'a', 'c', 'o')
+        self.assertEquals(result, ['line1', 'line2'])
+
     def test_process_one_access_file_error(self):
         access_proxy_config = self.proxy_config.copy()
         access_proxy_config.update({
@@ -228,6 +393,185 @@ use = egg:swift#proxy
                                             end_date='2010031413')
         expected = ['2010/03/14/13/obj1']
         self.assertEquals(result, expected)
+        result = p.get_container_listing('a', 'foo', with_sizes=True)
+        expected = [('2010/03/14/13/obj1', 9)]
+        self.assertEquals(result, expected)
+
+    def test_get_hourly_prefixes(self):
+        self.assertEquals(log_common.get_hourly_prefixes(None, None), None)
+        self.assertEquals(log_common.get_hourly_prefixes('2010031422',
+                                                         None), None)
+        self.assertEquals(log_common.get_hourly_prefixes('bad', '2010031422'),
+                          None)
+        self.assertEquals(log_common.get_hourly_prefixes('2010031422',
+                                                         '2010031501'),
+                          ['2010/03/14/22/', '2010/03/14/23/',
+                           '2010/03/15/00/', '2010/03/15/01/'])
+        self.assertEquals(log_common.get_hourly_prefixes('2010031422',
+                                                         '2010031421'), [])
+
+    def test_iter_container_listing(self):
+        class PrefixInternalProxy(DumbInternalProxy):
+            names = ['2010/03/14/12/obj1', '2010/03/14/13/obj1',
+                     '2010/03/14/13/obj2', '2010/03/14/15/obj1']
+
+            def get_container_list(self, account, container, marker=None,
+                                   end_marker=None, prefix=None):
+                if prefix is None:
+                    return DumbInternalProxy.get_container_list(self,
+                                account, container, marker, end_marker)
+                return [{'name': n, 'bytes': 1} for n in self.names
+                        if n.startswith(prefix)]
+
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        p._internal_proxy = PrefixInternalProxy()
+        result = list(p.iter_container_listing('a', 'foo', '2010031413',
+                                               '2010031415', concurrency=2))
+        self.assertEquals(result, ['2010/03/14/13/obj1',
+                                   '2010/03/14/13/obj2',
+                                   '2010/03/14/15/obj1'])
+        result = list(p.iter_container_listing('a', 'foo', '2010031412',
+                        '2010031413', listing_filter=['2010/03/14/13/obj2'],
+                        with_sizes=True))
+        self.assertEquals(result, [('2010/03/14/12/obj1', 1),
+                                   ('2010/03/14/13/obj1', 1)])
+        # without both dates, the listing is not split by hour
+        result = list(p.iter_container_listing('a', 'foo', '2010031412'))
+        self.assertEquals(result, ['2010/03/14/13/obj1'])
+
+    def test_listing_checkpoint(self):
+        listing = [{'name': 'o1', 'bytes': 1}, {'name': 'o2', 'bytes': 2},
+                   {'name': 'o3', 'bytes': 3}]
+        checkpoint = log_common.ListingCheckpoint()
+        self.assertTrue(checkpoint.full_listing)
+        self.assertEquals(checkpoint.get_marker('a', 'c', 'p/'), None)
+        checkpoint.add_listing('a', 'c', 'p/', listing)
+        checkpoint.add_listing('a', 'c', 'q/', listing)
+        checkpoint.add_listing('a', 'c', 'r/', [])
+        # the markers stop before the first object that is not processed
+        checkpoint.advance(lambda a, c, o, size: (c, o) != ('c', 'o3'))
+        self.assertEquals(checkpoint.markers,
+                          {('a', 'c'): {'p/': 'o2', 'q/': 'o2'}})
+
+        checkpoint = log_common.ListingCheckpoint(3600,
+                                                  checkpoint.get_state())
+        self.assertFalse(checkpoint.full_listing)
+        self.assertEquals(checkpoint.get_marker('a', 'c', 'p/'), 'o2')
+        self.assertEquals(checkpoint.get_marker('a', 'c', 'r/'), None)
+        checkpoint.add_listing('a', 'c', 'q/', listing[2:])
+        checkpoint.advance(lambda a, c, o, size: size == 2)
+        # o3 is still not processed and p/ was not listed
+        self.assertEquals(checkpoint.markers, {('a', 'c'): {'q/': 'o2'}})
+
+        # markers are ignored once the resync interval is over
+        state = checkpoint.get_state()
+        checkpoint = log_common.ListingCheckpoint(0, state)
+        self.assertTrue(checkpoint.full_listing)
+        self.assertEquals(checkpoint.get_marker('a', 'c', 'q/'), None)
+        checkpoint.add_listing('a', 'c', 'q/', listing)
+        checkpoint.advance(lambda a, c, o, size: True)
+        self.assertEquals(checkpoint.markers, {('a', 'c'): {'q/': 'o3'}})
+        self.assertTrue(checkpoint.last_full_listing > state[1])
+
+    def test_container_listing_checkpoint(self):
+        class MarkerInternalProxy(DumbInternalProxy):
+            names = ['2010/03/14/13/obj1', '2010/03/14/13/obj2',
+                     '2010/03/14/14/obj1']
+
+            def get_container_list(self, account, container, marker=None,
+                                   end_marker=None, prefix=None):
+                self.markers.append(marker)
+                return [{'name': n, 'bytes': 1} for n in self.names
+                        if n.startswith(prefix or '') and
+                           (marker is None or n > marker) and
+                           (end_marker is None or n < end_marker)]
+
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        p._internal_proxy = MarkerInternalProxy()
+        p._internal_proxy.markers = []
+        checkpoint = log_common.ListingCheckpoint()
+        result = list(p.iter_container_listing('a', 'c', '2010031413',
+                                               '2010031414',
+                                               checkpoint=checkpoint))
+        self.assertEquals(result, MarkerInternalProxy.names)
+        self.assertEquals(p._internal_proxy.markers, [None, None])
+        checkpoint.advance(lambda a, c, o, size: o != '2010/03/14/13/obj2')
+
+        checkpoint = log_common.ListingCheckpoint(3600,
+                                                  checkpoint.get_state())
+        p._internal_proxy.markers = []
+        result = list(p.iter_container_listing('a', 'c', '2010031413',
+                                               '2010031414',
+                                               checkpoint=checkpoint))
+        self.assertEquals(result, ['2010/03/14/13/obj2'])
+        self.assertEquals(p._internal_proxy.markers,
+                          ['2010/03/14/13/obj1', '2010/03/14/14/obj1'])
+
+        # a single marker is kept when the listing is not split by hour
+        checkpoint = log_common.ListingCheckpoint()
+        result = p.get_container_listing('a', 'c', '2010031413',
+                                         checkpoint=checkpoint)
+        self.assertEquals(result, MarkerInternalProxy.names)
+        checkpoint.advance(lambda a, c, o, size: True)
+        self.assertEquals(checkpoint.markers,
+                          {('a', 'c'): {'': '2010/03/14/14/obj1'}})
+        checkpoint = log_common.ListingCheckpoint(3600,
+                                                  checkpoint.get_state())
+        p._internal_proxy.markers = []
+        result = p.get_container_listing('a', 'c', '2010031413',
+                                         checkpoint=checkpoint)
+        self.assertEquals(result, [])
+        self.assertEquals(p._internal_proxy.markers, ['2010/03/14/14/obj1'])
+
+    def test_get_listing_checkpoint(self):
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        uploads = []
+
+        class CheckpointInternalProxy(DumbInternalProxy):
+            def upload_file(self, source_file, account, container,
+                            object_name):
+                uploads.append((account, container, object_name,
+                                source_file.read()))
+                return True
+
+        p._internal_proxy = CheckpointInternalProxy()
+        checkpoint = log_common.ListingCheckpoint()
+        checkpoint.markers = {('a', 'c'): {'': 'o'}}
+        self.assertTrue(p.store_listing_checkpoint(checkpoint, 'a', 'c',
+                                                   'cp.pickle.gz'))
+        self.assertEquals(uploads[0][:3], ('a', 'c', 'cp.pickle.gz'))
+        self.assertEquals(pickle.loads(uploads[0][3]),
+                          checkpoint.get_state())
+
+        # a missing or unreadable checkpoint lists everything
+        for code in (404, 500):
+            p._internal_proxy = DumbInternalProxy(code=code)
+            checkpoint = p.get_listing_checkpoint('a', 'c', 'cp.pickle.gz',
+                                                  3600)
+            self.assertTrue(checkpoint.full_listing)
+            self.assertEquals(checkpoint.markers, {})
+
+    def test_is_processed(self):
+        stats_proxy_config = self.proxy_config.copy()
+        stats_proxy_config.update({
+                        'log-processor-stats': {
+                            'class_path':
+                                'slogging.stats_processor.StatsLogProcessor',
+                            'swift_account': 'a',
+                            'container_name': 'c',
+                        }})
+        p = log_processor.LogProcessor(stats_proxy_config, DumbLogger())
+        item = ('stats', 'a', 'c', 'o')
+        self.assertFalse(p.is_processed(set(), 'a', 'c', 'o', 9))
+        self.assertTrue(p.is_processed(set([item]), 'a', 'c', 'o', 9))
+        # no plugin reads that container
+        self.assertTrue(p.is_processed(set(), 'a', 'c2', 'o', 9))
+        p.range_split_size = 5
+        self.assertFalse(p.is_processed(set([item + ((0, 5),)]),
+                                        'a', 'c', 'o', 9))
+        self.assertTrue(p.is_processed(set([item + ((0, 5),),
+                                            item + ((5, 9),)]),
+                                       'a', 'c', 'o', 9))
 
     def test_get_object_data(self):
         p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
@@ -238,6 +582,254 @@ use = egg:swift#proxy
         result = list(p.get_object_data('a', 'c', 'o.gz', True))
         self.assertEquals(result, expected)
 
+    def test_iter_lines(self):
+        for chunks, expected in [
+                ([], []),
+                ([''], []),
+                (['obj\n', 'data'], ['obj', 'data']),
+                (['obj\ndata\n'], ['obj', 'data']),
+                (['ob', 'j\nda', 'ta'], ['obj', 'data']),
+                (['o', 'b', 'j', '\n', 'd', 'a', 't', 'a'], ['obj', 'data']),
+                (['\n\nobj\n', '\n'], ['', '', 'obj', '']),
+                (['obj', '', '\n', 'data\n', ''], ['obj', 'data']),
+                (['x' * 10] * 100 + ['\ny'], ['x' * 1000, 'y']),
+            ]:
+            self.assertEquals(list(log_common.iter_lines(chunks)), expected)
+
+    def test_iter_line_batches(self):
+        chunks = ['obj\nda', 'ta\nfoo\nb', 'ar\n', 'baz']
+        result = list(log_common.iter_line_batches(chunks, 1))
+        self.assertEquals(result, [['obj'], ['data', 'foo'], ['bar'],
+                                   ['baz']])
+        result = list(log_common.iter_line_batches(chunks, 3))
+        self.assertEquals(result, [['obj', 'data', 'foo'], ['bar', 'baz']])
+        result = list(log_common.iter_line_batches(chunks, 100))
+        self.assertEquals(result, [['obj', 'data', 'foo', 'bar', 'baz']])
+        self.assertEquals(list(log_common.iter_line_batches([], 10)), [])
+
+    def test_get_object_batches(self):
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        p._internal_proxy = DumbInternalProxy()
+        result = list(p.get_object_batches('a', 'c', 'o', False,
+                                           batch_size=10))
+        self.assertEquals(result, [['obj', 'data']])
+        result = list(p.get_object_batches('a', 'c', 'o.gz', True,
+                                           batch_size=1))
+        self.assertEquals(sum(result, []), ['obj', 'data'])
+        p._internal_proxy = DumbInternalProxy(code=500)
+        result = p.get_object_batches('a', 'c', 'o')
+        self.assertRaises(log_common.BadFileDownload, list, result)
+
+    def test_read_ahead(self):
+        chunks = ['chunk%d' % i for i in range(20)]
+        timings = collections.defaultdict(float)
+        result = list(log_common.read_ahead(iter(chunks), 2,
+                                            timings=timings))
+        self.assertEquals(result, chunks)
+        self.assert_('read_ahead_wait' in timings)
+        self.assert_('read_ahead_full' in timings)
+        result = list(log_common.read_ahead(iter(chunks), 100, max_bytes=1))
+        self.assertEquals(result, chunks)
+        self.assertEquals(list(log_common.read_ahead(iter([]), 1)), [])
+
+    def test_read_ahead_green(self):
+        get_ident = eventlet.patcher.original('thread').get_ident
+        idents = []
+
+        def chunks():
+            for i in range(5):
+                idents.append(get_ident())
+                eventlet.sleep(0)
+                yield 'chunk%d' % i
+
+        def consume():
+            return list(log_common.read_ahead(chunks(), 2))
+        pool = eventlet.GreenPool()
+        results = [pool.spawn(consume) for _junk in range(2)]
+        for result in results:
+            self.assertEquals(result.wait(),
+                              ['chunk%d' % i for i in range(5)])
+        # in green threads, the chunks are pulled by a green thread
+        self.assertEquals(set(idents), set([get_ident()]))
+
+    def test_read_ahead_errors(self):
+        def chunks():
+            yield 'obj\n'
+            yield 'data'
+            raise log_common.BadFileDownload(503)
+        result = []
+        try:
+            for chunk in log_common.read_ahead(chunks(), 1):
+                result.append(chunk)
+        except log_common.BadFileDownload, err:
+            self.assertEquals(err.status_code, 503)
+        else:
+            self.fail('BadFileDownload not raised')
+        self.assertEquals(result, ['obj\n', 'data'])
+
+    def test_read_ahead_base_exceptions(self):
+        class Killed(BaseException):
+            pass
+
+        def chunks():
+            yield 'data'
+            raise Killed()
+        reader = log_common.read_ahead(chunks(), 1)
+        self.assertEquals(reader.next(), 'data')
+        self.assertRaises(Killed, reader.next)
+
+        class Chunks(object):
+            def __iter__(self):
+                return iter(['data'])
+
+            def close(self):
+                raise log_common.BadFileDownload(503)
+        reader = log_common.read_ahead(Chunks(), 1)
+        self.assertEquals(reader.next(), 'data')
+        self.assertRaises(log_common.BadFileDownload, reader.next)
+
+    def test_read_ahead_close(self):
+        closed = []
+
+        def chunks():
+            try:
+                while True:
+                    yield 'data'
+            finally:
+                closed.append(True)
+        reader = log_common.read_ahead(chunks(), 1)
+        self.assertEquals(reader.next(), 'data')
+        reader.close()
+        for _junk in range(100):
+            if closed:
+                break
+            time.sleep(.01)
+        self.assertEquals(closed, [True])
+
+    def test_get_object_data_read_ahead(self):
+        conf = {'log-processor': {'read_ahead_chunks': '1'}}
+        p = log_processor.LogProcessor(conf, DumbLogger())
+        self.assertEquals(p.read_ahead_chunks, 1)
+        p._internal_proxy = DumbInternalProxy()
+        result = list(p.get_object_data('a', 'c', 'o', False))
+        self.assertEquals(result, ['obj', 'data'])
+        result = list(p.get_object_data('a', 'c', 'o.gz', True))
+        self.assertEquals(result, ['obj', 'data'])
+        for k in ('fetch', 'decompress', 'read_ahead_wait'):
+            self.assert_(k in p.stage_timings)
+        p._internal_proxy = DumbInternalProxy(code=500)
+        result = p.get_object_data('a', 'c', 'o')
+        self.assertRaises(log_common.BadFileDownload, list, result)
+        p._internal_proxy = DumbInternalProxy(bad_compressed=True)
+        result = p.get_object_data('a', 'c', 'o.gz', True)
+        self.assertRaises(log_common.BadFileDownload, list, result)
+        p._internal_proxy = DumbInternalProxy(timeout=True)
+        result = p.get_object_data('a', 'c', 'o')
+        self.assertRaises(log_common.BadFileDownload, list, result)
+
+    def test_iter_line_range(self):
+        data = 'aa\nbbb\n\nc\ndddd\n\nee'
+        for chunk_size in (1, 2, 3, 5, 100):
+            for range_size in (1, 2, 3, 4, 7, 100):
+                lines = []
+                for start in range(0, len(data), range_size):
+                    end = min(start + range_size, len(data))
+                    offset = max(start - 1, 0)
+                    chunks = [data[i:i + chunk_size] for i in
+                              range(offset, len(data), chunk_size)]
+                    lines.extend(log_common.iter_lines(
+                        log_common.iter_line_range(chunks, offset, start,
+                                                   end)))
+                self.assertEquals(lines, data.split('\n'),
+                                  (chunk_size, range_size))
+
+    def test_get_object_data_byte_range(self):
+        class RangeInternalProxy(object):
+            data = 'obj\ndata\nfoo\n'
+
+            def get_object(self, account, container, object_name,
+                           headers=None):
+                offset = int(headers['Range'][len('bytes='):-1])
+                return 206, iter([self.data[offset:]])
+
+        p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
+        p._internal_proxy = RangeInternalProxy()
+        result = list(p.get_object_data('a', 'c', 'o', byte_range=(0, 4)))
+        self.assertEquals(result, ['obj'])
+        result = list(p.get_object_data('a', 'c', 'o', byte_range=(4, 6)))
+        self.assertEquals(result, ['data'])
+        result = list(p.get_object_data('a', 'c', 'o', byte_range=(6, 9)))
+        self.assertEquals(result, [])
+        result = list(p.get_object_data('a', 'c', 'o', byte_range=(9, 14)))
+        self.assertEquals(result, ['foo'])
+
+    def test_get_data_list_byte_ranges(self):
+        stats_proxy_config = self.proxy_config.copy()
+        stats_proxy_config.update({
+                        'log-processor-stats': {
+                            'class_path':
+                                'slogging.stats_processor.StatsLogProcessor',
+                            'swift_account': 'a',
+                            'container_name': 'c',
+                        }})
+        p = log_processor.LogProcessor(stats_proxy_config, DumbLogger())
+        p._internal_proxy = DumbInternalProxy()
+        item = ('stats', 'a', 'c', '2010/03/14/13/obj1')
+        self.assertEquals(p.get_data_list(listing_filter=set()), [item])
+        # the etag of the listing is passed along with a whole object
+        self.assertEquals(p.get_data_list(listing_filter=set())[0].kwargs,
+                          {'etag': 'etag'})
+        p.range_split_size = 4
+        self.assertEquals(p.get_data_list(listing_filter=set()),
+                          [item + ((0, 4),), item + ((4, 8),),
+                           item + ((8, 9),)])
+        self.assertEquals(p.get_data_list(listing_filter=set([item])), [])
+        self.assertEquals(p.get_data_list(
+                            listing_filter=set([item + ((4, 8),)])),
+                          [item + ((0, 4),), item + ((8, 9),)])
+        item_sizes = {}
+        p.get_data_list(listing_filter=set(), item_sizes=item_sizes)
+        self.assertEquals(item_sizes, {item + ((0, 4),): 4,
+                                       item + ((4, 8),): 4,
+                                       item + ((8, 9),): 1})
+        p.range_split_size = 0
+        item_sizes = {}
+        p.get_data_list(listing_filter=set(), item_sizes=item_sizes)
+        self.assertEquals(item_sizes, {item: 9})
+
+    def test_get_object_data_object_cache(self):
+        with temptree([]) as t:
+            conf = {'log-processor': {'object_cache_dir': t}}
+            p = log_processor.LogProcessor(conf, DumbLogger())
+            p._internal_proxy = DumbInternalProxy()
+            for _junk in range(2):
+                result = list(p.get_object_data('a', 'c', 'o', False))
+                self.assertEquals(result, ['obj', 'data'])
+                result = list(p.get_object_data('a', 'c', 'o.gz', True))
+                self.assertEquals(result, ['obj', 'data'])
+            self.assertEquals(p.object_cache.stats['misses'], 2)
+            self.assertEquals(p.object_cache.stats['hits'], 2)
+            self.assertEquals(p._internal_proxy.heads, 4)
+            # the etag of the listing saves the HEAD
+            result = list(p.get_object_data('a', 'c', 'o', etag='etag'))
+            self.assertEquals(result, ['obj', 'data'])
+            self.assertEquals(p.object_cache.stats['hits'], 3)
+            self.assertEquals(p._internal_proxy.heads, 4)
+            stats = p.pop_stats()
+            self.assertEquals(stats['cache_hits'], 3)
+            self.assertEquals(stats['cache_misses'], 2)
+            self.assertEquals(p.pop_stats()['cache_hits'], 0)
+            list(p.get_object_data('a', 'c', 'o', etag='etag'))
+            self.assertEquals(p.pop_stats()['bytes'], len('obj\ndata'))
+            p._internal_proxy = DumbInternalProxy(code=500)
+            result = p.get_object_data('a', 'c', 'o2')
+            self.assertRaises(log_common.BadFileDownload, list, result)
+            p._internal_proxy = DumbInternalProxy(timeout=True)
+            result = p.get_object_data('a', 'c', 'o3')
+            self.assertRaises(log_common.BadFileDownload, list, result)
+            self.assertEquals(p.object_cache.get('a', 'c', 'o3', 'etag'),
+                              None)
+
     def test_get_object_data_errors(self):
         p = log_processor.LogProcessor(self.proxy_config, DumbLogger())
         p._internal_proxy = DumbInternalProxy(code=500)
@@ -358,6 +950,7 @@ use = egg:swift#proxy
                         ('public', 'bytes_in'): 6,
                         'prefix_query': 0}}
             self.assertEquals(ret, expected)
+            self.assertEquals(q_out.get(), (None, ('end', os.getpid(), 1)))
         finally:
             log_processor.LogProcessor._internal_proxy = None
             log_processor.LogProcessor.get_object_data = orig_get_object_data
@@ -411,11 +1004,11 @@ use = egg:swift#proxy
             item = ('access', 'a', 'c', 'o')
             logs_to_process = [item]
             processor_klass = log_processor.LogProcessor
-            results = log_processor.multiprocess_collate(processor_klass,
-                                                         processor_args,
-                                                         'process_one_file',
-                                                         logs_to_process,
-                                                         1)
+            results = log_common.multiprocess_collate(processor_klass,
+                                                      processor_args,
+                                                      'process_one_file',
+                                                      logs_to_process,
+                                                      1)
             results = list(results)
             expected = [(item, {('acct', '2010', '07', '09', '04'):
                         {('public', 'object', 'GET', '2xx'): 1,
@@ -460,6 +1053,397 @@ use = egg:swift#proxy
             log_processor.LogProcessor._internal_proxy = None
             log_processor.LogProcessor.get_object_data = orig_get_object_data
 
+    def test_schedule_largest_first(self):
+        item_sizes = {'a': 5, 'b': 1, 'c': 4, 'd': 3, 'e': 3}
+        items, makespan = log_common.schedule_largest_first(
+            ['a', 'b', 'c', 'd', 'e', 'unknown'], item_sizes, 2)
+        self.assertEquals(items, ['a', 'c', 'd', 'e', 'b', 'unknown'])
+        # a + e and c + d + b
+        self.assertEquals(makespan, 8)
+        self.assertEquals(log_common.schedule_largest_first([], {}, 2),
+                          ([], 0))
+        self.assertEquals(log_common.schedule_largest_first(['a'],
+                                                            item_sizes, 0),
+                          (['a'], 5))
+
+    def test_multiprocess_collate_many_items(self):
+        items = [(i,) for i in xrange(100)]
+        results = log_common.multiprocess_collate(EchoProcessor, (),
+                                                  'process', items, 3)
+        self.assertEquals(sorted(results), [(x, x[0]) for x in items])
+
+    def test_collate_worker_busy(self):
+        # items processed at once count once in the busy time
+        q_in = Queue.Queue()
+        q_out = Queue.Queue()
+        for i in xrange(4):
+            q_in.put((i,))
+        q_in.put(None)
+        start = time.time()
+        log_common.collate_worker(SlowProcessor, (), 'process', q_in, q_out,
+                                  concurrency=4, send_stats=True,
+                                  worker_id=1)
+        elapsed = time.time() - start
+        busy = 0
+        while True:
+            item, data = q_out.get_nowait()
+            if item is None and data[0] == 'end':
+                break
+            if item is None:
+                self.assertEquals(data[:2], ('stats', 1))
+                busy += data[2]['busy']
+        self.assertTrue(0 < busy <= elapsed)
+
+    def test_collate_worker_combine(self):
+        q_in = Queue.Queue()
+        q_out = Queue.Queue()
+        for item in [(1,), (2,), ('x',), (3,), None]:
+            q_in.put(item)
+        log_common.collate_worker(EchoProcessor, (), 'process', q_in, q_out,
+                                  combine_func=lambda x, y: x + y,
+                                  combine_count=2)
+        self.assertEquals(q_out.get(), ([(1,), (2,)], 3))
+        # errors are still sent one by one
+        item, ret = q_out.get()
+        self.assertEquals(item, ('x',))
+        self.assertTrue(isinstance(ret, TypeError))
+        self.assertEquals(q_out.get(), ([(3,)], 3))
+        self.assertEquals(q_out.get(), (None, ('end', os.getpid(), 4)))
+        self.assertTrue(q_out.empty())
+
+    def test_multiprocess_collate_combine(self):
+        items = [(i,) for i in xrange(100)]
+        results = list(log_common.multiprocess_collate(EchoProcessor, (),
+                            'process', items, 3,
+                            combine_func=lambda x, y: x + y,
+                            combine_count=10))
+        done = []
+        for item, data in results:
+            self.assertEquals(data, sum(x[0] for x in item))
+            done.extend(item)
+        self.assertEquals(sorted(done), items)
+
+    def test_multiprocess_collate_encode(self):
+        items = [(i,) for i in xrange(10)]
+        results = list(log_common.multiprocess_collate(EchoProcessor, (),
+                            'process', items, 2,
+                            encode_func=lambda x: -x))
+        self.assertEquals(sorted(results), [(x, -x[0]) for x in items])
+
+    def test_collate_worker_concurrency(self):
+        q_in = Queue.Queue()
+        q_out = Queue.Queue()
+        for item in [(1,), (2,), (3,), (4,), None]:
+            q_in.put(item)
+        start = time.time()
+        log_common.collate_worker(SlowProcessor, (), 'process', q_in, q_out,
+                                  concurrency=4)
+        # the items were processed at the same time
+        self.assertTrue(time.time() - start < 0.3)
+        results = [q_out.get() for _junk in xrange(5)]
+        self.assertEquals(results[-1], (None, ('end', os.getpid(), 4)))
+        self.assertEquals(sorted(results[:-1]),
+                          [((x,), x) for x in xrange(1, 5)])
+        self.assertTrue(q_out.empty())
+
+    def test_multiprocess_collate_concurrency(self):
+        items = [(i,) for i in xrange(20)]
+        results = list(log_common.multiprocess_collate(SlowProcessor, (),
+                            'process', items, 2,
+                            combine_func=lambda x, y: x + y,
+                            concurrency=5))
+        done = []
+        for item, data in results:
+            self.assertEquals(data, sum(x[0] for x in item))
+            done.extend(item)
+        self.assertEquals(sorted(done), items)
+
+    def test_collate_executors(self):
+        items = [(i,) for i in xrange(50)] + [('x',)]
+        for executor in ('serial', 'thread', 'eventlet', 'process'):
+            collate_func = log_common.get_collate_func(executor)
+            failed_items = []
+            results = collate_func(EchoProcessor, (), 'process', items, 3,
+                                   failed_items=failed_items,
+                                   item_timeout=10, concurrency=2)
+            self.assertEquals(sorted(results),
+                              [(x, x[0]) for x in items[:-1]])
+            self.assertEquals(failed_items, [('x',)])
+        self.assertRaises(ValueError, log_common.get_collate_func, 'nope')
+
+    def test_collate_worker_stats(self):
+        items = [log_common.WorkItem((i,), {'y': 1}) for i in xrange(20)]
+        for executor in ('serial', 'thread', 'eventlet', 'process'):
+            collate_func = log_common.get_collate_func(executor)
+            worker_stats = {}
+            results = collate_func(StatsProcessor, (), 'process', items, 3,
+                                   worker_stats=worker_stats)
+            self.assertEquals(sorted(results),
+                              [(x, x[0] + 1) for x in items])
+            self.assertEquals(sum(x['items']
+                                  for x in worker_stats.itervalues()), 20)
+            self.assertEquals(sum(x['cache_hits']
+                                  for x in worker_stats.itervalues()), 20)
+            self.assertTrue(all(x['busy'] >= 0
+                                for x in worker_stats.itervalues()))
+        self.assertEquals(log_common.max_worker_load({}), (0, 0))
+        self.assertEquals(log_common.max_worker_load({
+            1: {'bytes': 10, 'busy': 3.0}, 2: {'bytes': 20, 'busy': 1.0}}),
+            (20, 3.0))
+        infos = []
+
+        class InfoLogger(DumbLogger):
+            def info(self, msg):
+                infos.append(msg)
+        logger = InfoLogger()
+        log_common.log_worker_stats(logger, {1: {'items': 2}})
+        self.assertEquals(infos, [])
+        log_common.log_worker_stats(logger, {
+            1: {'items': 2, 'cache_hits': 1, 'cache_hit_bytes': 10,
+                'cache_misses': 1, 'cache_miss_bytes': 20,
+                'cache_evictions': 0},
+            2: {'items': 1, 'cache_hits': 1, 'cache_hit_bytes': 5,
+                'cache_misses': 0, 'cache_miss_bytes': 0,
+                'cache_evictions': 1}})
+        self.assertEquals(infos, ['Object cache: 2 hits (15 bytes), '
+                                         '1 misses (20 bytes), 1 evictions'])
+
+    def test_local_collate_combine(self):
+        items = [(i,) for i in xrange(100)]
+        for executor in ('thread', 'eventlet'):
+            collate_func = log_common.get_collate_func(executor)
+            done = []
+            for item, data in collate_func(EchoProcessor, (), 'process',
+                                           items, 3,
+                                           combine_func=lambda x, y: x + y,
+                                           combine_count=10):
+                self.assertEquals(data, sum(x[0] for x in item))
+                done.extend(item)
+            self.assertEquals(sorted(done), items)
+
+    def test_local_collate_broken_workers(self):
+        failed_items = []
+        results = log_common.thread_collate(BrokenProcessor, (), 'process',
+                                            [(1,), (2,)], 2,
+                                            failed_items=failed_items)
+        self.assertEquals(list(results), [])
+        self.assertEquals(sorted(failed_items), [(1,), (2,)])
+
+    def test_multiprocess_collate_dead_worker(self):
+        def dying_worker(*args):
+            os._exit(1)
+        orig_collate_worker = log_common.collate_worker
+        orig_check_interval = log_common.WORKER_CHECK_INTERVAL
+        try:
+            log_common.collate_worker = dying_worker
+            log_common.WORKER_CHECK_INTERVAL = 0.01
+            errors = []
+
+            class ErrorLogger(DumbLogger):
+                def error(self, msg):
+                    errors.append(msg)
+            results = log_common.multiprocess_collate(EchoProcessor, (),
+                                                      'process', [(1,)], 2,
+                                                      logger=ErrorLogger())
+            self.assertEquals(list(results), [])
+            self.assertTrue(errors[0].startswith('Worker process'))
+            self.assertEquals(errors[-1], 'Stopping the run, 1 items '
+                              'handed out were not processed')
+        finally:
+            log_common.collate_worker = orig_collate_worker
+            log_common.WORKER_CHECK_INTERVAL = orig_check_interval
+
+    def test_multiprocess_collate_processor_error(self):
+        errors = []
+
+        class ErrorLogger(DumbLogger):
+            def error(self, msg):
+                errors.append(msg)
+        results = log_common.multiprocess_collate(BrokenProcessor, (),
+                                                  'process', [(1,)], 2,
+                                                  logger=ErrorLogger())
+        self.assertEquals(list(results), [])
+        self.assertEquals(errors[-1], 'Stopping the run, 1 items '
+                          'handed out were not processed')
+
+    def test_worker_pool(self):
+        items = [(i,) for i in xrange(20)]
+        pool = log_common.WorkerPool(PidProcessor, (), 'process', 2)
+        try:
+            results = list(pool.collate(items))
+            self.assertEquals(sorted(x[0] for x in results), items)
+            pids = set(pool.workers)
+            self.assertEquals(len(pids), 2)
+            self.assertEquals(set(x[1] for x in results) - pids, set())
+            # the same workers are used for the next run
+            results = list(pool.collate(items))
+            self.assertEquals(sorted(x[0] for x in results), items)
+            self.assertEquals(set(pool.workers), pids)
+            self.assertEquals(list(pool.collate([])), [])
+        finally:
+            pool.close()
+        self.assertEquals(pool.workers, {})
+        self.assertEquals(pool.in_queue, None)
+
+    def test_worker_pool_max_items(self):
+        items = [(i,) for i in xrange(20)]
+        pool = log_common.WorkerPool(PidProcessor, (), 'process', 1,
+                                     max_items=3)
+        try:
+            results = list(pool.collate(items))
+            self.assertEquals(sorted(x[0] for x in results), items)
+            # each worker processed 3 items at most
+            pids = [x[1] for x in results]
+            self.assertEquals(len(set(pids)), 7)
+            self.assertTrue(max(pids.count(x) for x in pids) <= 3)
+            self.assertEquals(len(pool.workers), 1)
+        finally:
+            pool.close()
+
+    def test_worker_pool_item_timeout(self):
+        orig_check_interval = log_common.WORKER_CHECK_INTERVAL
+        log_common.WORKER_CHECK_INTERVAL = 0.01
+        try:
+            with temptree([]) as t:
+                items = [(i,) for i in xrange(-2, 10)]
+                failed_items = []
+                results = log_common.multiprocess_collate(FlakyProcessor,
+                                (t, 'hang'), 'process', items, 2,
+                                failed_items=failed_items, item_timeout=0.2,
+                                item_retries=1)
+                self.assertEquals(sorted(results), [(x, x[0]) for x in items])
+                self.assertEquals(failed_items, [])
+                # the hung items are given up on after the retries
+                failed_items = []
+                results = log_common.multiprocess_collate(FlakyProcessor,
+                                (t, 'hang', 3), 'process', items, 2,
+                                failed_items=failed_items, item_timeout=0.2,
+                                item_retries=1)
+                self.assertEquals(sorted(results),
+                                  [(x, x[0]) for x in items[2:]])
+                self.assertEquals(sorted(failed_items), items[:2])
+        finally:
+            log_common.WORKER_CHECK_INTERVAL = orig_check_interval
+
+    def test_worker_pool_crash_recovery(self):
+        orig_check_interval = log_common.WORKER_CHECK_INTERVAL
+        log_common.WORKER_CHECK_INTERVAL = 0.01
+        try:
+            with temptree([]) as t:
+                items = [(i,) for i in xrange(-2, 10)]
+                failed_items = []
+                pool = log_common.WorkerPool(FlakyProcessor, (t, 'die', 2),
+                                             'process', 2, item_retries=2)
+                try:
+                    results = list(pool.collate(items, failed_items))
+                    self.assertEquals(sorted(results),
+                                      [(x, x[0]) for x in items])
+                    self.assertEquals(failed_items, [])
+                    self.assertEquals(len(pool.workers), 2)
+                    # without enough retries
+                    pool.item_retries = 0
+                    items = [(-3,)] + items[2:]
+                    results = list(pool.collate(items, failed_items))
+                    self.assertEquals(sorted(results),
+                                      [(x, x[0]) for x in items[1:]])
+                    self.assertEquals(failed_items, [(-3,)])
+                finally:
+                    pool.close()
+        finally:
+            log_common.WORKER_CHECK_INTERVAL = orig_check_interval
+
+    def test_worker_pool_duplicate_combined_result(self):
+        for item_retries in (1, 0):
+            pool = log_common.WorkerPool(EchoProcessor, (), 'process', 1,
+                                         combine_func=lambda x, y: x + y,
+                                         item_retries=item_retries)
+            handed_out = []
+
+            class InQueue(Queue.Queue):
+                def put(self, item):
+                    handed_out.append(item)
+                    Queue.Queue.put(self, item)
+
+            class OutQueue(object):
+                # the queued result of a worker thought lost, then the
+                # result of the same items combined with another one after
+                # a retry
+                results = [([(1,), (2,)], 3), ([(1,), (2,), (3,)], 6)]
+
+                def get(self, timeout=None):
+                    if self.results:
+                        return self.results.pop(0)
+                    item = pool.in_queue.get_nowait()
+                    return item, item[0]
+
+            pool._start = lambda: None
+            pool.in_queue = InQueue()
+            pool.out_queue = OutQueue()
+            failed_items = []
+            results = list(pool.collate([(1,), (2,), (3,)], failed_items))
+            done = sorted(x for item, _junk in results
+                          for x in (item if isinstance(item, list)
+                                    else [item]))
+            if item_retries:
+                self.assertEquals(sum(x[1] for x in results), 6)
+                self.assertEquals(done, [(1,), (2,), (3,)])
+                # the other item of the dropped result was handed out again
+                self.assertEquals(handed_out.count((3,)), 2)
+                self.assertEquals(failed_items, [])
+            else:
+                # which counts as a retry
+                self.assertEquals(done, [(1,), (2,)])
+                self.assertEquals(handed_out.count((3,)), 1)
+                self.assertEquals(failed_items, [(3,)])
+
+    def test_worker_pool_restart_retries(self):
+        class Conn(object):
+            def poll(self):
+                return False
+
+        for item_retries in (0, 1):
+            pool = log_common.WorkerPool(EchoProcessor, (), 'process', 2,
+                                         item_retries=item_retries)
+            pool.close = lambda terminate=False: None
+            pool._start = lambda: None
+            pool.in_queue = Queue.Queue()
+            pool.workers = {7: None}
+            pool.start_conns = {7: Conn()}
+            pool.outstanding = {(1,): 0, (2,): 0, (3,): 0}
+            pool.taken = {7: set([(2,)])}
+            pool.failed_items = []
+            # (1,) was lost with its worker, (2,) was taken by the other one
+            # and (3,) was still queued
+            pool._restart([(1,)])
+            handed_out = []
+            while not pool.in_queue.empty():
+                handed_out.append(pool.in_queue.get())
+            if item_retries:
+                self.assertEquals(sorted(handed_out), [(1,), (2,), (3,)])
+                self.assertEquals(pool.outstanding,
+                                  {(1,): 1, (2,): 1, (3,): 0})
+                self.assertEquals(pool.failed_items, [])
+            else:
+                self.assertEquals(handed_out, [(3,)])
+                self.assertEquals(pool.outstanding, {(3,): 0})
+                self.assertEquals(sorted(pool.failed_items), [(1,), (2,)])
+
+    def test_multiprocess_collate_failed_items(self):
+        failed_items = []
+        results = log_common.multiprocess_collate(EchoProcessor, (),
+                                                  'process', [(1,), ('x',)],
+                                                  2,
+                                                  failed_items=failed_items)
+        self.assertEquals(list(results), [((1,), 1)])
+        self.assertEquals(failed_items, [('x',)])
+
+    def test_multiprocess_collate_close(self):
+        items = [(i,) for i in xrange(100)]
+        results = log_common.multiprocess_collate(EchoProcessor, (),
+                                                  'process', items, 2)
+        results.next()
+        results.close()
+
 
 class TestLogProcessorDaemon(unittest.TestCase):
 
@@ -503,6 +1487,7 @@ class TestLogProcessorDaemon(unittest.TestCase):
                 self.log_processor_account = 'account'
                 self.log_processor_container = 'container'
                 self.processed_files_filename = 'filename'
+                self.compact_processed_files = False
 
         file_list = set(['a', 'b', 'c'])
 
@@ -528,6 +1513,7 @@ class TestLogProcessorDaemon(unittest.TestCase):
                 self.log_processor_account = 'account'
                 self.log_processor_container = 'container'
                 self.processed_files_filename = 'filename'
+                self.compact_processed_files = False
 
         for c, l in [[404, set()], [503, None], [None, None]]:
             self.assertEquals(l,
@@ -561,7 +1547,8 @@ class TestLogProcessorDaemon(unittest.TestCase):
 
         class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
             def __init__(self):
-                pass
+                self.dense_aggregates = False
+                self.reduce_max_rows = 0
 
         d = MockLogProcessorDaemon()
         data_out = d.get_aggregate_data(processed_files, data_in)
@@ -571,6 +1558,107 @@ class TestLogProcessorDaemon(unittest.TestCase):
 
         self.assertEquals(set(['file1', 'file2']), processed_files)
 
+    def test_get_aggregate_data_combined(self):
+        processed_files = set()
+        data_in = [
+            [['file1', 'file2'], {'acct1_time1': {'field1': 11}}],
+            ['file3', {'acct1_time1': {'field1': 1, 'field2': 2}}],
+        ]
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self.dense_aggregates = False
+                self.reduce_max_rows = 0
+
+        d = MockLogProcessorDaemon()
+        data_out = d.get_aggregate_data(processed_files, data_in)
+        self.assertEquals(data_out,
+                          {'acct1_time1': {'field1': 12, 'field2': 2}})
+        self.assertEquals(set(['file1', 'file2', 'file3']), processed_files)
+
+    def test_get_aggregate_data_packed(self):
+        processed_files = set()
+        data_in = [
+            ['file1', PackedAggregate.from_dict(
+                        {'acct1_time1': {'field1': 11}})],
+            [['file2'], {'acct1_time1': {'field1': 1, 'field2': 2}}],
+        ]
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self.dense_aggregates = False
+                self.reduce_max_rows = 0
+
+        d = MockLogProcessorDaemon()
+        data_out = d.get_aggregate_data(processed_files, data_in)
+        self.assertEquals(data_out,
+                          {'acct1_time1': {'field1': 12, 'field2': 2}})
+        self.assertEquals(set(['file1', 'file2']), processed_files)
+
+    def test_get_aggregate_data_dense(self):
+        processed_files = set()
+        data_in = [
+            ['file1', PackedAggregate.from_dict(
+                        {'acct1_time1': {'field1': 11, 'field3': 0}})],
+            [['file2'], {'acct1_time1': {'field1': 1, 'field2': 2.5},
+                         'acct2_time1': {'field1': 3}}],
+        ]
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self.dense_aggregates = True
+                self.reduce_max_rows = 0
+
+        d = MockLogProcessorDaemon()
+        data_out = d.get_aggregate_data(processed_files, data_in)
+        self.assert_(isinstance(data_out, DenseAggregate))
+        self.assertEquals(data_out.to_dict(),
+                          {'acct1_time1': {'field1': 12, 'field2': 2.5,
+                                           'field3': 0},
+                           'acct2_time1': {'field1': 3}})
+        self.assertEquals(set(['file1', 'file2']), processed_files)
+
+    def test_get_aggregate_data_spilled(self):
+        data_in = [
+            ['file1', {('acct1', '2010', '07', '09', '04'): {'field1': 1},
+                       ('acct2', '2010', '07', '09', '03'): {'field2': 2}}],
+            ['file2', {('acct1', '2010', '07', '09', '04'): {'field1': 3},
+                       ('acct1', '2010', '07', '09', '05'): {'field3': 4}}],
+            ['file3', PackedAggregate.from_dict(
+                {('acct3', '2010', '07', '09', '04'): {'field1': 5},
+                 ('acct2', '2010', '07', '09', '03'): {'field1': 6}})],
+        ]
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self, reduce_max_rows, dense_aggregates):
+                self._keylist_mapping = {'out1': ['field1', 'field2'],
+                                         'out2': 'field3'}
+                self.dense_aggregates = dense_aggregates
+                self.reduce_max_rows = reduce_max_rows
+                self.reduce_spill_dir = None
+                self.numpy_output = True
+
+        d = MockLogProcessorDaemon(0, False)
+        expected = list(d.iter_aggregate_output(
+            d.get_aggregate_data(set(), data_in)))
+        self.assertEquals(len(expected), 5)
+        for dense_aggregates in (False, True):
+            d = MockLogProcessorDaemon(1, dense_aggregates)
+            processed_files = set()
+            aggr_data = d.get_aggregate_data(processed_files, data_in)
+            self.assert_(isinstance(aggr_data,
+                                    aggregation.SpillingAggregate))
+            self.assertEquals(set(['file1', 'file2', 'file3']),
+                              processed_files)
+            self.assertEquals(list(d.iter_aggregate_output(aggr_data)),
+                              expected)
+            # the runs are closed once the output is read
+            self.assertEquals(aggr_data.runs, [])
+        # nothing is spilled within the budget
+        d = MockLogProcessorDaemon(10, False)
+        self.assert_(isinstance(d.get_aggregate_data(set(), data_in),
+                                dict))
+
     def test_get_final_info(self):
         # when run "for real"
         # the various keys/values in the input and output
@@ -614,6 +1702,9 @@ class TestLogProcessorDaemon(unittest.TestCase):
 
         self.assertEquals(expected_data_out,
             MockLogProcessorDaemon().get_final_info(data_in))
+        dense = DenseAggregate().merge(data_in)
+        self.assertEquals(expected_data_out,
+            MockLogProcessorDaemon().get_final_info(dense))
 
     def test_store_processed_files_list(self):
         class MockInternalProxy:
@@ -678,6 +1769,39 @@ class TestLogProcessorDaemon(unittest.TestCase):
         for row in expected_data_out[1:]:
             self.assert_(row in data_out)
 
+    def test_iter_numpy_output(self):
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self._keylist_mapping = {'a': ['x', 'y'], 'b': 'y',
+                                         'c': ('z', 'w')}
+
+        data_in = {
+            ('acct1', '2010', '01', '01', '00'): {'x': 1, 'y': 2},
+            ('acct1', '2010', '01', '01', '01'): {'y': 20, ('z', 'w'): 3},
+            ('acct2', '2008', '03', '06', '09'): {'x': 8, 'q': 4},
+        }
+        d = MockLogProcessorDaemon()
+        expected = d.get_output(d.get_final_info(data_in))
+        self.assertEquals(expected[1],
+                          ['2010/01/01 00:00:00', 'acct1', '3', '2', '0'])
+        orig_numpy = aggregation.numpy
+        try:
+            aggregation.numpy = None
+            self.assertEquals(d.iter_numpy_output(data_in), None)
+        finally:
+            aggregation.numpy = orig_numpy
+        if aggregation.numpy is None:
+            raise SkipTest('NumPy is not installed')
+        self.assertEquals(list(d.iter_numpy_output(data_in)), expected)
+        self.assertEquals(
+            list(d.iter_numpy_output(DenseAggregate().merge(data_in))),
+            expected)
+        # values that do not fit in 64 bits are left to get_output
+        data_in[('acct2', '2008', '03', '06', '09')]['y'] = 2 ** 64
+        self.assertEquals(d.iter_numpy_output(data_in), None)
+        data_in[('acct2', '2008', '03', '06', '09')]['y'] = 0.5
+        self.assertEquals(d.iter_numpy_output(data_in), None)
+
     def test_store_output(self):
         try:
             real_strftime = time.strftime
@@ -714,7 +1838,8 @@ class TestLogProcessorDaemon(unittest.TestCase):
                     self.test.assertEquals(self.daemon.log_processor_container,
                         container)
                     self.test.assertEquals(self.expected_filename, filename)
-                    self.test.assertEquals(self.expected_output, f.getvalue())
+                    self.test.assertEquals(self.expected_output, f.read())
+                    return True
 
             class MockLogProcessor:
                 def __init__(self, test, daemon, expected_filename,
@@ -730,8 +1855,17 @@ class TestLogProcessorDaemon(unittest.TestCase):
                     self.log_processor_container = 'container'
                     self.processed_files_filename = 'filename'
 
-            MockLogProcessorDaemon(self, expected_filename, expected_output).\
-                store_output(data_in)
+            d = MockLogProcessorDaemon(self, expected_filename,
+                                       expected_output)
+            self.assertTrue(d.store_output(data_in))
+            # rows can be streamed, and are spooled to disk past
+            # OUTPUT_SPOOL_SIZE
+            orig_spool_size = log_processor.OUTPUT_SPOOL_SIZE
+            try:
+                log_processor.OUTPUT_SPOOL_SIZE = 10
+                self.assertTrue(d.store_output(iter(data_in)))
+            finally:
+                log_processor.OUTPUT_SPOOL_SIZE = orig_spool_size
         finally:
             log_processor.time.strftime = real_strftime
 
@@ -762,59 +1896,76 @@ class TestLogProcessorDaemon(unittest.TestCase):
         self.assertEquals(1, d.log_processor.call_count)
 
     def test_process_logs(self):
-        try:
-            mock_logs_to_process = 'logs_to_process'
-            mock_processed_files = 'processed_files'
-
-            real_multiprocess_collate = log_processor.multiprocess_collate
-            multiprocess_collate_return = 'multiprocess_collate_return'
-
-            get_aggregate_data_return = 'get_aggregate_data_return'
-            get_final_info_return = 'get_final_info_return'
-            get_output_return = 'get_output_return'
+        mock_logs_to_process = 'logs_to_process'
+        mock_processed_files = 'processed_files'
 
-            class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
-                def __init__(self, test):
-                    self.test = test
-                    self.total_conf = 'total_conf'
-                    self.logger = 'logger'
-                    self.worker_count = 'worker_count'
-
-                def get_aggregate_data(self, processed_files, results):
-                    self.test.assertEquals(mock_processed_files,
-                        processed_files)
-                    self.test.assertEquals(multiprocess_collate_return,
-                        results)
-                    return get_aggregate_data_return
-
-                def get_final_info(self, aggr_data):
-                    self.test.assertEquals(get_aggregate_data_return,
-                        aggr_data)
-                    return get_final_info_return
-
-                def get_output(self, final_info):
-                    self.test.assertEquals(get_final_info_return, final_info)
-                    return get_output_return
-
-            d = MockLogProcessorDaemon(self)
-
-            def mock_multiprocess_collate(processor_klass, processor_args,
-                                          processor_method, logs_to_process,
-                                          worker_count):
-                self.assertEquals(d.total_conf, processor_args[0])
-                self.assertEquals(d.logger, processor_args[1])
-
-                self.assertEquals(mock_logs_to_process, logs_to_process)
-                self.assertEquals(d.worker_count, worker_count)
+        multiprocess_collate_return = 'multiprocess_collate_return'
 
-                return multiprocess_collate_return
+        get_aggregate_data_return = 'get_aggregate_data_return'
+        get_final_info_return = 'get_final_info_return'
+        get_output_return = 'get_output_return'
 
-            log_processor.multiprocess_collate = mock_multiprocess_collate
-
-            output = d.process_logs(mock_logs_to_process, mock_processed_files)
-            self.assertEquals(get_output_return, output)
-        finally:
-            log_processor.multiprocess_collate = real_multiprocess_collate
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self, test):
+                self.test = test
+                self.total_conf = 'total_conf'
+                self.logger = 'logger'
+                self.worker_count = 'worker_count'
+                self.combine_worker_results = False
+                self.combine_worker_max_files = 'max_files'
+                self.pack_worker_results = False
+                self.numpy_output = False
+                self.checkpoint_interval = 0
+                self.item_timeout = 'item_timeout'
+                self.item_retries = 'item_retries'
+                self.worker_concurrency = 'worker_concurrency'
+
+            def get_aggregate_data(self, processed_files, results,
+                                   aggr_data=None):
+                self.test.assertEquals(mock_processed_files,
+                    processed_files)
+                self.test.assertEquals(multiprocess_collate_return,
+                    results)
+                return get_aggregate_data_return
+
+            def get_final_info(self, aggr_data):
+                self.test.assertEquals(get_aggregate_data_return,
+                    aggr_data)
+                return get_final_info_return
+
+            def iter_output(self, final_info):
+                self.test.assertEquals(get_final_info_return, final_info)
+                return get_output_return
+
+        d = MockLogProcessorDaemon(self)
+
+        def mock_multiprocess_collate(processor_klass, processor_args,
+                                      processor_method, logs_to_process,
+                                      worker_count, combine_func,
+                                      combine_count, encode_func,
+                                      failed_items, item_timeout,
+                                      item_retries, concurrency,
+                                      worker_stats):
+            self.assertEquals(d.total_conf, processor_args[0])
+            self.assertEquals(d.logger, processor_args[1])
+            self.assertEquals(combine_func, None)
+            self.assertEquals(combine_count, 'max_files')
+            self.assertEquals(encode_func, None)
+            self.assertEquals(failed_items, [])
+            self.assertEquals(item_timeout, 'item_timeout')
+            self.assertEquals(item_retries, 'item_retries')
+            self.assertEquals(concurrency, 'worker_concurrency')
+            self.assertEquals(worker_stats, {})
+
+            self.assertEquals(mock_logs_to_process, logs_to_process)
+            self.assertEquals(d.worker_count, worker_count)
+
+            return multiprocess_collate_return
+
+        d.collate_func = mock_multiprocess_collate
+
+        output = d.process_logs(mock_logs_to_process, mock_processed_files)
+        self.assertEquals(get_output_return, output)
 
     def test_run_once_get_processed_files_list_returns_none(self):
         class MockLogProcessor:
@@ -827,6 +1978,8 @@ class TestLogProcessorDaemon(unittest.TestCase):
             def __init__(self):
                 self.logger = DumbLogger()
                 self.log_processor = MockLogProcessor()
+                self.partition_processed_files = False
+                self.shard_count = 1
 
             def get_lookback_interval(self):
                 return None, None
@@ -843,7 +1996,9 @@ class TestLogProcessorDaemon(unittest.TestCase):
                 self.test = test
 
             def get_data_list(self, lookback_start, lookback_end,
-                processed_files):
+                processed_files, checkpoint, item_sizes):
+                self.test.assertEquals(checkpoint, None)
+                self.test.assertEquals(item_sizes, {})
                 self.test.assertEquals(self.daemon.lookback_start,
                     lookback_start)
                 self.test.assertEquals(self.daemon.lookback_end,
@@ -859,6 +2014,12 @@ class TestLogProcessorDaemon(unittest.TestCase):
                 self.lookback_start = 'lookback_start'
                 self.lookback_end = 'lookback_end'
                 self.processed_files = ['a', 'b', 'c']
+                self.listing_concurrency = 0
+                self.listing_checkpoint = False
+                self.partition_processed_files = False
+                self.shard_count = 1
+                self.checkpoint_interval = 0
+                self.worker_count = 1
 
             def get_lookback_interval(self):
                 return self.lookback_start, self.lookback_end
@@ -866,8 +2027,417 @@ class TestLogProcessorDaemon(unittest.TestCase):
             def get_processed_files_list(self):
                 return self.processed_files
 
-            def process_logs(logs_to_process, processed_files):
+            def process_logs(logs_to_process, processed_files,
+                             worker_stats=None):
                 raise unittest.TestCase.failureException, \
                     'Method should not be called'
 
         MockLogProcessorDaemon(self).run_once()
+
+    def test_run_once_streaming_listing(self):
+        test = self
+        items = [('access', 'a', 'c', 'o1'), ('access', 'a', 'c', 'o2')]
+
+        class MockLogProcessor():
+            def iter_data_list(self, lookback_start, lookback_end,
+                               processed_files, listing_concurrency,
+                               checkpoint):
+                test.assertEquals(listing_concurrency, 4)
+                test.assertEquals(checkpoint, None)
+                for item in items:
+                    yield item
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self.logger = DumbLogger()
+                self.log_processor = MockLogProcessor()
+                self.listing_concurrency = 4
+                self.listing_checkpoint = False
+                self.partition_processed_files = False
+                self.shard_count = 1
+                self.checkpoint_interval = 0
+                self.processed = None
+                self.stored = False
+
+            def get_lookback_interval(self):
+                return None, None
+
+            def get_processed_files_list(self):
+                return set()
+
+            def process_logs(self, logs_to_process, processed_files,
+                             worker_stats=None):
+                self.processed = list(logs_to_process)
+                processed_files.update(self.processed)
+                return []
+
+            def store_output(self, output):
+                pass
+
+            def store_processed_files_list(self, processed_files):
+                self.stored = True
+
+        d = MockLogProcessorDaemon()
+        d.run_once()
+        self.assertEquals(d.processed, items)
+        self.assertTrue(d.stored)
+        del items[:]
+        d = MockLogProcessorDaemon()
+        d.run_once()
+        self.assertEquals(d.processed, None)
+        self.assertFalse(d.stored)
+
+    def test_run_once_listing_checkpoint(self):
+        test = self
+        stored = []
+
+        class MockLogProcessor():
+            def get_listing_checkpoint(self, account, container, object_name,
+                                       resync_interval):
+                test.assertEquals(object_name, 'listing_checkpoint.pickle.gz')
+                test.assertEquals(resync_interval, 7200)
+                return log_common.ListingCheckpoint(resync_interval)
+
+            def get_data_list(self, lookback_start, lookback_end,
+                              processed_files, checkpoint, item_sizes):
+                listing = [{'name': 'o1', 'bytes': 1},
+                           {'name': 'o2', 'bytes': 1}]
+                checkpoint.add_listing('a', 'c', '', listing)
+                return [('access', 'a', 'c', x['name']) for x in listing]
+
+            def is_processed(self, processed_files, account, container,
+                             object_name, size):
+                return ('access', account, container, object_name) in \
+                    processed_files
+
+            def store_listing_checkpoint(self, checkpoint, account,
+                                         container, object_name):
+                stored.append(checkpoint)
+                return True
+
+        class MockLogProcessorDaemon(log_processor.LogProcessorDaemon):
+            def __init__(self):
+                self.logger = DumbLogger()
+                self.log_processor = MockLogProcessor()
+                self.log_processor_account = 'stats'
+                self.log_processor_container = 'log_processing_data'
+                self.listing_concurrency = 0
+                self.listing_checkpoint = True
+                self.partition_processed_files = False
+                self.shard_count = 1
+                self.checkpoint_interval = 0
+                self.listing_resync_hours = 2
+                self.listing_checkpoint_filename = \
+                    'listing_checkpoint.pickle.gz'
+                self.worker_count = 1
+
+            def get_lookback_interval(self):
+                return None, None
+
+            def get_processed_files_list(self):
+                return set()
+
+            def process_logs(self, logs_to_process, processed_files,
+                             worker_stats=None):
+                # o2 fails
+                processed_files.add(logs_to_process[0])
+                return []
+
+            def store_output(self, output):
+                pass
+
+            def store_processed_files_list(self, processed_files):
+                pass
+
+        MockLogProcessorDaemon().run_once()
+        self.assertEquals(len(stored), 1)
+        self.assertEquals(stored[0].markers, {('a', 'c'): {'': 'o1'}})
+
+    def test_sharded_run_once(self):
+        line = TestLogProcessor.access_test_line
+        proxy = FakeProxy()
+        for i in xrange(20):
+            data = '\n'.join(line.replace('/acct/', '/acct%d/' % (i % 3))
+                             for _junk in xrange(i + 1))
+            proxy.upload_file(cStringIO.StringIO(data), 'logs', 'log_data',
+                              '2010070904_%d' % i, compress=False)
+
+        def make_daemon(shard_count, shard_index, reduce_max_rows=0):
+            conf = {'log-processor': {
+                        'swift_account': 'stats',
+                        'proxy_server_conf': '',
+                        'lookback_hours': '0',
+                        'executor': 'serial',
+                        'shard_count': str(shard_count),
+                        'shard_index': str(shard_index),
+                        'reduce_max_rows': str(reduce_max_rows)},
+                    'log-processor-access': {
+                        'swift_account': 'logs',
+                        'container_name': 'log_data',
+                        'source_filename_format': '%Y%m%d%H*',
+                        'class_path':
+                            'slogging.access_processor.AccessLogProcessor'}}
+            return log_processor.LogProcessorDaemon(conf)
+
+        def processed_files(proxy):
+            return pickle.loads(gzip.GzipFile(fileobj=cStringIO.StringIO(
+                proxy.objects[('stats', 'log_processing_data',
+                               'processed_files.pickle.gz')])).read())
+
+        real_internal_proxy = log_common.InternalProxy
+        try:
+            unsharded_proxy = FakeProxy()
+            unsharded_proxy.objects = dict(proxy.objects)
+            log_common.InternalProxy = lambda *a, **kw: unsharded_proxy
+            make_daemon(1, 0).run_once()
+            expected = unsharded_proxy.get_csv()
+            self.assertEquals(len(expected), 3)
+
+            log_common.InternalProxy = lambda *a, **kw: proxy
+            logs = dict(proxy.objects)
+            shards = [make_daemon(3, i) for i in xrange(3)]
+            for d in shards:
+                d.run_once()
+            self.assertEquals(len(shards[0].list_partials()), 3)
+            # unmerged files are not processed again
+            shards[0].run_once()
+            self.assertEquals(len(shards[0].list_partials()), 3)
+            self.assertEquals(proxy.get_csv(), [])
+
+            # the merge is retried if the partials could not be deleted
+            proxy.delete_object = lambda *a: False
+            shards[0].run_once(merge_shards=True)
+            self.assertEquals(proxy.get_csv(), expected)
+            del proxy.delete_object
+            shards[0].run_once(merge_shards=True)
+            self.assertEquals(proxy.get_csv(), expected)
+            self.assertEquals(shards[0].list_partials(), [])
+            self.assertEquals(processed_files(proxy),
+                              processed_files(unsharded_proxy))
+
+            # a merge between the shard reading its unmerged partials and
+            # the processed files list does not get them processed again
+            proxy.objects = dict(logs)
+            shards = [make_daemon(3, i) for i in xrange(3)]
+            for d in shards:
+                d.run_once()
+            real_get_processed_files = shards[0].get_processed_files
+
+            def get_processed_files(*args):
+                files = real_get_processed_files(*args)
+                shards[1].run_once(merge_shards=True)
+                return files
+            shards[0].get_processed_files = get_processed_files
+            shards[0].run_once()
+            self.assertEquals(shards[0].list_partials(), [])
+            self.assertEquals(proxy.get_csv(), expected)
+
+            # spilled aggregates are stored and merged a row at a time
+            proxy.objects = dict(logs)
+            shards = [make_daemon(3, i, reduce_max_rows=1)
+                      for i in xrange(3)]
+            for d in shards:
+                d.run_once()
+            shards[0].run_once(merge_shards=True)
+            self.assertEquals(proxy.get_csv(), expected)
+            self.assertEquals(processed_files(proxy),
+                              processed_files(unsharded_proxy))
+
+            # files without stats are merged into the processed files list
+            proxy.objects = {}
+            proxy.upload_file(cStringIO.StringIO('junk'), 'logs',
+                              'log_data', '2010070904_x', compress=False)
+            shards = [make_daemon(3, i) for i in xrange(3)]
+            for d in shards:
+                d.run_once()
+            shards[0].run_once(merge_shards=True)
+            self.assertEquals(shards[0].list_partials(), [])
+            self.assertEquals(proxy.get_csv(), [])
+            self.assertEquals(processed_files(proxy),
+                              set([('access', 'logs', 'log_data',
+                                    '2010070904_x')]))
+        finally:
+            log_common.InternalProxy = real_internal_proxy
+
+    def test_run_once_run_checkpoints(self):
+        line = TestLogProcessor.access_test_line
+        proxy = FakeProxy()
+        for i in xrange(20):
+            data = '\n'.join(line.replace('/acct/', '/acct%d/' % (i % 3))
+                             for _junk in xrange(i + 1))
+            proxy.upload_file(cStringIO.StringIO(data), 'logs', 'log_data',
+                              '2010070904_%d' % i, compress=False)
+        conf = {'log-processor': {
+                    'swift_account': 'stats',
+                    'proxy_server_conf': '',
+                    'lookback_hours': '0',
+                    'executor': 'serial'},
+                'log-processor-access': {
+                    'swift_account': 'logs',
+                    'container_name': 'log_data',
+                    'source_filename_format': '%Y%m%d%H*',
+                    'class_path':
+                        'slogging.access_processor.AccessLogProcessor'}}
+
+        def processed_files(proxy):
+            return pickle.loads(gzip.GzipFile(fileobj=cStringIO.StringIO(
+                proxy.objects[('stats', 'log_processing_data',
+                               'processed_files.pickle.gz')])).read())
+
+        def make_daemon(crash_after=None):
+            conf['log-processor']['checkpoint_interval'] = '1'
+            d = log_processor.LogProcessorDaemon(conf)
+            d.collated = []
+            real_collate_func = d.collate_func
+
+            def collate_func(*args, **kwargs):
+                d.collated = list(args[3])
+                args = args[:3] + (d.collated,) + args[4:]
+                for i, result in enumerate(real_collate_func(*args,
+                                                             **kwargs)):
+                    if i == crash_after:
+                        raise Exception('crashed')
+                    yield result
+            d.collate_func = collate_func
+            return d
+
+        checkpoint_key = ('stats', 'log_processing_data',
+                          'run_checkpoint.pickle.gz')
+        real_internal_proxy = log_common.InternalProxy
+        real_time = log_processor.time.time
+        try:
+            expected_proxy = FakeProxy()
+            expected_proxy.objects = dict(proxy.objects)
+            log_common.InternalProxy = lambda *a, **kw: expected_proxy
+            log_processor.LogProcessorDaemon(conf).run_once()
+            expected = expected_proxy.get_csv()
+            self.assertEquals(len(expected), 3)
+
+            # every result takes 10 seconds
+            now = [0]
+
+            def fake_time():
+                now[0] += 10
+                return now[0]
+            log_processor.time.time = fake_time
+            log_common.InternalProxy = lambda *a, **kw: proxy
+            logs = dict(proxy.objects)
+            for reduce_max_rows in ('0', '1'):
+                conf['log-processor']['reduce_max_rows'] = reduce_max_rows
+                proxy.objects = dict(logs)
+                d = make_daemon(crash_after=8)
+                self.assertRaises(Exception, d.run_once)
+                self.assert_(checkpoint_key in proxy.objects)
+                self.assertEquals(proxy.get_csv(), [])
+                state = log_processor.load_state(
+                    gzip.GzipFile(fileobj=cStringIO.StringIO(
+                        proxy.objects[checkpoint_key])))
+                self.assertEquals(len(state[0]), 7)
+                if reduce_max_rows == '1':
+                    # the spilled rows are stored one by one
+                    self.assertEquals(len(list(state[1])), 3)
+                else:
+                    self.assertEquals(len(state[1]), 3)
+
+                # the last checkpoint was stored before the eighth result,
+                # the restarted run only processes the files after the
+                # seventh
+                d = make_daemon()
+                d.run_once()
+                self.assertEquals(len(d.collated), 13)
+                self.assertEquals(proxy.get_csv(), expected)
+                self.assert_(checkpoint_key not in proxy.objects)
+                self.assertEquals(processed_files(proxy),
+                                  processed_files(expected_proxy))
+            conf['log-processor']['reduce_max_rows'] = '0'
+
+            # a run that stored its output but not its processed files is
+            # finished by the next one instead of being processed again
+            proxy.objects = dict(logs)
+            d = make_daemon()
+            d.store_processed_files_list = lambda *a: False
+            d.run_once()
+            self.assertEquals(proxy.get_csv(), expected)
+            self.assert_(checkpoint_key in proxy.objects)
+            # unless it can not tell whether the output was stored
+            real_head_object = proxy.head_object
+            proxy.head_object = lambda *a: (503, {})
+            d = make_daemon()
+            d.run_once()
+            self.assertEquals(d.collated, [])
+            self.assertEquals(proxy.get_csv(), expected)
+            self.assert_(checkpoint_key in proxy.objects)
+            proxy.head_object = real_head_object
+            d = make_daemon()
+            d.run_once()
+            self.assertEquals(d.collated, [])
+            self.assertEquals(proxy.get_csv(), expected)
+            self.assert_(checkpoint_key not in proxy.objects)
+            self.assertEquals(processed_files(proxy),
+                              processed_files(expected_proxy))
+        finally:
+            log_common.InternalProxy = real_internal_proxy
+            log_processor.time.time = real_time
+
+    def test_get_shard(self):
+        shards = [log_processor.get_shard('a', 'c', 'o%d' % i, 4)
+                  for i in xrange(100)]
+        self.assertEquals(set(shards), set(range(4)))
+        self.assertEquals(shards, [log_processor.get_shard('a', 'c',
+                                   'o%d' % i, 4) for i in xrange(100)])
+        self.assertRaises(ValueError, log_processor.LogProcessorDaemon,
+                          {'log-processor': {'swift_account': 'stats',
+                                             'shard_count': '2',
+                                             'shard_index': '2'}})
+
+    def test_run_once_partitioned_processed_files(self):
+        line = TestLogProcessor.access_test_line
+        proxy = FakeProxy()
+        for i in xrange(4):
+            proxy.upload_file(cStringIO.StringIO(line), 'logs', 'log_data',
+                              '2010/07/0%d/04/obj' % (i + 1), compress=False)
+        conf = {'log-processor': {
+                    'swift_account': 'stats',
+                    'proxy_server_conf': '',
+                    'lookback_hours': '0',
+                    'executor': 'serial',
+                    'partition_processed_files': 'true'},
+                'log-processor-access': {
+                    'swift_account': 'logs',
+                    'container_name': 'log_data',
+                    'source_filename_format': '%Y%m%d%H*',
+                    'class_path':
+                        'slogging.access_processor.AccessLogProcessor'}}
+        real_internal_proxy = log_common.InternalProxy
+        log_common.InternalProxy = lambda *a, **kw: proxy
+        try:
+            log_processor.LogProcessorDaemon(conf).run_once()
+            self.assertEquals(len(proxy.get_csv()), 1)
+            self.assertEquals(sorted(o for a, c, o in proxy.objects
+                                     if o.startswith('processed_files')),
+                              ['processed_files/20100701.pickle.gz',
+                               'processed_files/20100702.pickle.gz',
+                               'processed_files/20100703.pickle.gz',
+                               'processed_files/20100704.pickle.gz'])
+            # nothing is processed again
+            log_processor.LogProcessorDaemon(conf).run_once()
+            self.assertEquals(len(proxy.get_csv()), 1)
+            # a day that can not be downloaded when it is needed stops the
+            # run instead of crashing the daemon
+            proxy.upload_file(cStringIO.StringIO(line), 'logs', 'log_data',
+                              '2010/07/05/04/obj', compress=False)
+            real_get_object = proxy.get_object
+
+            def get_object(account, container, object_name, headers=None):
+                if object_name == 'processed_files/20100702.pickle.gz':
+                    return 503, []
+                return real_get_object(account, container, object_name,
+                                       headers)
+            proxy.get_object = get_object
+            log_processor.LogProcessorDaemon(conf).run_once()
+            self.assertEquals(len(proxy.get_csv()), 1)
+            self.assert_(('stats', 'log_processing_data',
+                          'processed_files/20100705.pickle.gz') not in
+                         proxy.objects)
+        finally:
+            log_common.InternalProxy = real_internal_proxy
@@ -0,0 +1,91 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import os
+import time
+
+from test.unit import temptree
+from slogging import object_cache
+
+
+class DumbLogger(object):
+    def __getattr__(self, n):
+        return self.foo
+
+    def foo(self, *a, **kw):
+        pass
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def test_get_put(self):
+        with temptree([]) as t:
+            cache = object_cache.ObjectCache(t, 1000, DumbLogger(),
+                                             chunk_size=3)
+            self.assertEquals(cache.get('a', 'c', 'o', 'etag'), None)
+            chunks = ['obj\n', 'data']
+            result = list(cache.put('a', 'c', 'o', 'etag', iter(chunks)))
+            self.assertEquals(result, chunks)
+            result = cache.get('a', 'c', 'o', 'etag')
+            self.assertEquals(''.join(result), 'obj\ndata')
+            self.assertEquals(cache.get('a', 'c', 'o', 'other_etag'), None)
+            self.assertEquals(cache.stats, {'hits': 1, 'misses': 2,
+                                            'hit_bytes': 8, 'miss_bytes': 8,
+                                            'evictions': 0})
+
+    def test_put_incomplete(self):
+        with temptree([]) as t:
+            cache = object_cache.ObjectCache(t, 1000, DumbLogger())
+
+            def chunks():
+                yield 'obj\n'
+                raise ValueError()
+            self.assertRaises(ValueError, list,
+                              cache.put('a', 'c', 'o', 'etag', chunks()))
+            reader = cache.put('a', 'c', 'o', 'etag', iter(['a', 'b']))
+            reader.next()
+            reader.close()
+            self.assertEquals(cache.get('a', 'c', 'o', 'etag'), None)
+            self.assertEquals([n for n in os.listdir(t)
+                               if n.endswith('.tmp')], [])
+
+    def test_new_etag_replaces_entry(self):
+        with temptree([]) as t:
+            cache = object_cache.ObjectCache(t, 1000, DumbLogger())
+            list(cache.put('a', 'c', 'o', 'etag1', iter(['old'])))
+            list(cache.put('a', 'c', 'o', '"etag2"', iter(['new'])))
+            self.assertEquals(cache.get('a', 'c', 'o', 'etag1'), None)
+            self.assertEquals(''.join(cache.get('a', 'c', 'o', 'etag2')),
+                              'new')
+
+    def test_lru_eviction(self):
+        with temptree([]) as t:
+            cache = object_cache.ObjectCache(t, 10, DumbLogger())
+            list(cache.put('a', 'c', 'o1', 'etag', iter(['x' * 4])))
+            list(cache.put('a', 'c', 'o2', 'etag', iter(['x' * 4])))
+            # make o1 the most recently used entry
+            past = time.time() - 100
+            os.utime(cache._path('a', 'c', 'o2', 'etag'), (past, past))
+            list(cache.get('a', 'c', 'o1', 'etag'))
+            list(cache.put('a', 'c', 'o3', 'etag', iter(['x' * 4])))
+            self.assertEquals(cache.get('a', 'c', 'o2', 'etag'), None)
+            self.assert_(cache.get('a', 'c', 'o1', 'etag') is not None)
+            self.assert_(cache.get('a', 'c', 'o3', 'etag') is not None)
+            self.assertEquals(cache.stats['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
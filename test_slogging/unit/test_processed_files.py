@@ -0,0 +1,309 @@
+# Copyright (c) 2010-2011 OpenStack, LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import cPickle
+
+from slogging import processed_files
+from slogging.log_common import BadFileDownload
+
+
+class FakeLogProcessor(object):
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = []
+        self.uploads = []
+        self.internal_proxy = self
+        self.fail = False
+        self.list_fail = False
+        self.errors = []
+        self.logger = self
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+    def get_object_data(self, account, container, object_name,
+                        compressed=False):
+        self.downloads.append(object_name)
+        if self.fail:
+            raise BadFileDownload(503)
+        try:
+            return self.objects[object_name].split('\n')
+        except KeyError:
+            raise BadFileDownload(404)
+
+    def list_container(self, account, container, prefix=None):
+        if self.list_fail:
+            return None
+        return [{'name': x} for x in sorted(self.objects)
+                if x.startswith(prefix)]
+
+    def upload_file(self, f, account, container, object_name):
+        self.uploads.append(object_name)
+        self.objects[object_name] = f.read()
+        return True
+
+    def delete_object(self, account, container, object_name):
+        self.objects.pop(object_name, None)
+        return True
+
+
+def item(name):
+    return ('access', 'a', 'c', name)
+
+
+class TestHashedSet(unittest.TestCase):
+
+    def test_membership(self):
+        files = processed_files.HashedSet([item('x'), item('y')])
+        self.assertTrue(item('x') in files)
+        self.assertFalse(item('z') in files)
+        self.assertEquals(len(files), 2)
+        files.add(item('z'))
+        files.add(item('z'))
+        files.update([item('x'), item('w')])
+        self.assertEquals(len(files), 4)
+        for name in 'wxyz':
+            self.assertTrue(item(name) in files)
+        self.assertFalse(item('x') + ((0, 10),) in files)
+        files.add(item(u'caf\xe9'))
+        self.assertTrue(item(u'caf\xe9') in files)
+        self.assertTrue(item(u'caf\xe9'.encode('utf-8')) in files)
+        self.assertTrue(item(u'x') in files)
+
+    def test_merge(self):
+        files = processed_files.HashedSet()
+        items = [item(str(i)) for i in xrange(3000)]
+        files.update(items)
+        # added items are merged into the sorted array in batches
+        self.assertTrue(len(files.hashes) > 0)
+        self.assertTrue(len(files.pending) <= 1024)
+        self.assertEquals(list(files.hashes), sorted(files.hashes))
+        self.assertEquals(len(files), 3000)
+        self.assertTrue(all(x in files for x in items))
+
+    def test_pickle(self):
+        items = [item(str(i)) for i in xrange(100)]
+        files = processed_files.HashedSet(items)
+        s = cPickle.dumps(files, cPickle.HIGHEST_PROTOCOL)
+        self.assertTrue(len(s) < len(cPickle.dumps(set(items),
+                                                   cPickle.HIGHEST_PROTOCOL)))
+        files = cPickle.loads(s)
+        self.assertEquals(len(files), 100)
+        self.assertTrue(all(x in files for x in items))
+        self.assertFalse(item('100') in files)
+
+
+class TestProcessedFiles(unittest.TestCase):
+
+    def test_get_partition(self):
+        self.assertEquals(processed_files.get_partition(
+                          item('2011/03/04/05/x.gz')), '20110304')
+        self.assertEquals(processed_files.get_partition(
+                          item('2011/03/04/05/x.gz') + ((0, 10),)),
+                          '20110304')
+        self.assertEquals(processed_files.get_partition(item('x.gz')),
+                          'other')
+
+    def test_migrate_legacy(self):
+        lp = FakeLogProcessor()
+        legacy = set([item('2011/03/04/05/x'), item('2011/03/04/06/y'),
+                      item('2011/03/05/00/z'), item('odd')])
+        lp.objects['processed_files.pickle.gz'] = cPickle.dumps(legacy)
+        files = processed_files.ProcessedFiles(lp, 'a', 'c',
+                    legacy_name='processed_files.pickle.gz')
+        self.assertTrue(files.load())
+        self.assertEquals(len(files), 4)
+        self.assertTrue(item('2011/03/04/06/y') in files)
+        self.assertTrue(files.store())
+        self.assertEquals(sorted(lp.uploads),
+                          ['processed_files/20110304.pickle.gz',
+                           'processed_files/20110305.pickle.gz',
+                           'processed_files/other.pickle.gz'])
+        self.assertEquals(cPickle.loads(
+                          lp.objects['processed_files/20110304.pickle.gz']),
+                          set([item('2011/03/04/05/x'),
+                               item('2011/03/04/06/y')]))
+        # the legacy pickle is only read while there are no partitions
+        lp.downloads = []
+        files = processed_files.ProcessedFiles(lp, 'a', 'c',
+                    legacy_name='processed_files.pickle.gz')
+        self.assertTrue(files.load())
+        self.assertEquals(lp.downloads, [])
+
+    def test_migrate_compacted_legacy(self):
+        lp = FakeLogProcessor()
+        lp.objects['processed_files.pickle.gz'] = cPickle.dumps(
+            processed_files.HashedSet([item('2011/03/04/05/x')]),
+            cPickle.HIGHEST_PROTOCOL)
+        files = processed_files.ProcessedFiles(lp, 'a', 'c',
+                    legacy_name='processed_files.pickle.gz')
+        self.assertFalse(files.load())
+        self.assertEquals(len(lp.errors), 1)
+        self.assertEquals(lp.uploads, [])
+
+    def test_load_window(self):
+        lp = FakeLogProcessor()
+        for day in ('20110301', '20110302', '20110303', 'other'):
+            lp.objects['processed_files/%s.pickle.gz' % day] = \
+                cPickle.dumps(set([item('%s/%s/%s/00/x' % (day[:4],
+                                   day[4:6], day[6:]))]))
+        files = processed_files.ProcessedFiles(lp, 'a', 'c')
+        self.assertTrue(files.load('2011030200', '2011030323'))
+        self.assertEquals(sorted(lp.downloads),
+                          ['processed_files/20110302.pickle.gz',
+                           'processed_files/20110303.pickle.gz',
+                           'processed_files/other.pickle.gz'])
+        # other days are loaded as needed
+        self.assertTrue(item('2011/03/01/00/x') in files)
+        self.assertFalse(item('2011/03/01/00/y') in files)
+        self.assertEquals(len(lp.downloads), 4)
+        # days without a partition are not downloaded
+        self.assertFalse(item('2011/02/01/00/x') in files)
+        self.assertEquals(len(lp.downloads), 4)
+        # only the changed partitions are stored
+        files.add(item('2011/03/02/00/x'))
+        files.update([item('2011/03/02/01/x'), item('2011/02/01/00/x')])
+        self.assertTrue(files.store())
+        self.assertEquals(sorted(lp.uploads),
+                          ['processed_files/20110201.pickle.gz',
+                           'processed_files/20110302.pickle.gz'])
+        lp.uploads = []
+        self.assertTrue(files.store())
+        self.assertEquals(lp.uploads, [])
+
+    def test_compact(self):
+        lp = FakeLogProcessor()
+        lp.objects['processed_files/20110301.pickle.gz'] = \
+            cPickle.dumps(set([item('2011/03/01/00/x')]))
+        files = processed_files.ProcessedFiles(lp, 'a', 'c', compact=True)
+        self.assertTrue(files.load('2011030100', '2011030123'))
+        self.assertTrue(isinstance(files.partitions['20110301'],
+                                   processed_files.HashedSet))
+        self.assertTrue(item('2011/03/01/00/x') in files)
+        files.add(item('2011/03/01/01/x'))
+        self.assertTrue(files.store())
+        files = processed_files.ProcessedFiles(lp, 'a', 'c', compact=True)
+        self.assertTrue(files.load('2011030100', '2011030123'))
+        self.assertTrue(item('2011/03/01/01/x') in files)
+        self.assertEquals(len(files), 2)
+
+    def test_load_error(self):
+        lp = FakeLogProcessor()
+        lp.objects['processed_files/20110301.pickle.gz'] = \
+            cPickle.dumps(set())
+        lp.fail = True
+        files = processed_files.ProcessedFiles(lp, 'a', 'c')
+        self.assertFalse(files.load('2011030100', '2011030123'))
+        files = processed_files.ProcessedFiles(lp, 'a', 'c')
+        self.assertTrue(files.load())
+        self.assertRaises(BadFileDownload, files.__contains__,
+                          item('2011/03/01/00/x'))
+        # a failed listing is not taken for no partitions
+        lp.fail = False
+        lp.list_fail = True
+        files = processed_files.ProcessedFiles(lp, 'a', 'c',
+                                               legacy_name='legacy')
+        self.assertFalse(files.load())
+        self.assertEquals(lp.downloads, ['processed_files/20110301.pickle.gz',
+                                         'processed_files/20110301.pickle.gz'])
+
+
+class TestProcessedFilesJournal(unittest.TestCase):
+
+    def journal(self, lp):
+        journal = processed_files.ProcessedFilesJournal(lp, 'a', 'c',
+                      legacy_name='processed_files.pickle.gz',
+                      compact_deltas=3)
+        self.assertTrue(journal.load())
+        return journal
+
+    def test_deltas_and_compaction(self):
+        lp = FakeLogProcessor()
+        journal = self.journal(lp)
+        self.assertEquals(len(journal), 0)
+        journal.update(['b', 'a'])
+        self.assertTrue(journal.store())
+        self.assertEquals(len(lp.uploads), 1)
+        self.assertTrue(lp.uploads[0].startswith(
+                        'processed_files_journal/delta/'))
+        self.assertEquals(lp.objects[lp.uploads[0]], 'a\nb')
+        # nothing new, nothing stored
+        journal.add('a')
+        self.assertTrue(journal.store())
+        self.assertEquals(len(lp.uploads), 1)
+
+        journal = self.journal(lp)
+        self.assertTrue('a' in journal)
+        self.assertFalse('c' in journal)
+        journal.add('c')
+        self.assertTrue(journal.store())
+        journal.add('d')
+        self.assertTrue(journal.store())
+        # the third delta triggered a compaction
+        self.assertEquals(sorted(lp.objects),
+                          ['processed_files_journal/snapshot.gz'])
+        self.assertEquals(lp.objects['processed_files_journal/snapshot.gz'],
+                          'a\nb\nc\nd')
+        journal.add('e')
+        self.assertTrue(journal.store())
+        journal = self.journal(lp)
+        self.assertEquals(sorted(journal.files), ['a', 'b', 'c', 'd', 'e'])
+
+    def test_failed_store(self):
+        lp = FakeLogProcessor()
+        journal = self.journal(lp)
+        journal.add('a')
+        lp.upload_file = lambda *a: False
+        self.assertFalse(journal.store())
+        del lp.upload_file
+        journal.add('b')
+        self.assertTrue(journal.store())
+        self.assertEquals(sorted(self.journal(lp).files), ['a', 'b'])
+
+    def test_migrate_legacy(self):
+        lp = FakeLogProcessor()
+        lp.objects['processed_files.pickle.gz'] = \
+            cPickle.dumps(set(['x', 'y']))
+        journal = self.journal(lp)
+        self.assertTrue('x' in journal)
+        self.assertTrue(journal.store())
+        self.assertEquals(lp.objects['processed_files_journal/snapshot.gz'],
+                          'x\ny')
+        # the legacy set is not read again
+        del lp.objects['processed_files.pickle.gz']
+        journal.add('z')
+        self.assertTrue(journal.store())
+        self.assertEquals(sorted(self.journal(lp).files), ['x', 'y', 'z'])
+
+    def test_load_error(self):
+        lp = FakeLogProcessor()
+        lp.objects['processed_files_journal/snapshot.gz'] = 'a'
+        lp.fail = True
+        journal = processed_files.ProcessedFilesJournal(lp, 'a', 'c')
+        self.assertFalse(journal.load())
+        # a failed listing is not taken for an empty journal
+        lp.fail = False
+        lp.list_fail = True
+        journal = processed_files.ProcessedFilesJournal(lp, 'a', 'c')
+        self.assertFalse(journal.load())
+        lp.list_fail = False
+        self.assertTrue(journal.load())
+        self.assertEquals(journal.files, set(['a']))
+
+
+if __name__ == '__main__':
+    unittest.main()
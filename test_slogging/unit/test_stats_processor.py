@@ -46,6 +46,16 @@ class TestStatsProcessor(unittest.TestCase):
                         'replica_count': 1, 'bytes_used': 1}}
         self.assertEquals(res, expected)
 
+    def test_process_batch(self):
+        p = stats_processor.StatsLogProcessor({})
+        test_obj_batches = [['a, 1, 1, 1', ''], ['a, 1, 1, 1', 'bad line']]
+        res = p.process_batch(test_obj_batches, 'foo', 'bar',
+                              '2011/03/14/12/baz')
+        expected = {('a', '2011', '03', '14', '12'):
+                        {'object_count': 2, 'container_count': 2,
+                        'replica_count': 2, 'bytes_used': 2}}
+        self.assertEquals(res, expected)
+
 
 if __name__ == '__main__':
     unittest.main()